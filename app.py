@@ -45,6 +45,12 @@ def create_app(test_config=None):
 
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+    # Per-request profiling (wall time, query count, slow queries), off by default
+    app.config.setdefault('PROFILE', os.environ.get('PROFILE') == '1')
+    app.config.setdefault('PROFILE_SQL_THRESHOLD', float(os.environ.get('PROFILE_SQL_THRESHOLD', '0.05')))
+    if app.config['PROFILE']:
+        app.config['SQLALCHEMY_RECORD_QUERIES'] = True
+
     # Initialize extensions with app
     db.init_app(app)
     login_manager.init_app(app)
@@ -61,6 +67,10 @@ def create_app(test_config=None):
         app.register_blueprint(auth_bp)
         app.register_blueprint(admin_bp)
 
+        if app.config['PROFILE']:
+            from profiling import init_profiler
+            init_profiler(app)
+
         # Create database tables for development (if they don't exist)
         # db.create_all() -> Removed for production performance. Run migrations manually.
     
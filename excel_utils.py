@@ -1,7 +1,9 @@
-from openpyxl import Workbook
+from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
+from openpyxl.cell import WriteOnlyCell
 from datetime import datetime
+from functools import lru_cache
 import pytz
 
 # Buenos Aires timezone for displaying dates
@@ -15,64 +17,99 @@ def to_buenos_aires(dt):
         dt = pytz.utc.localize(dt)
     return dt.astimezone(BUENOS_AIRES_TZ)
 
-def generate_task_excel(tasks, filters):
+def _styled_cell(ws, value, font=None, fill=None, alignment=None, border=None):
+    """WriteOnlyCell with the given styles (write-only sheets have no ws['A1'])."""
+    cell = WriteOnlyCell(ws, value=value)
+    if font is not None:
+        cell.font = font
+    if fill is not None:
+        cell.fill = fill
+    if alignment is not None:
+        cell.alignment = alignment
+    if border is not None:
+        cell.border = border
+    return cell
+
+def generate_task_excel(tasks, filters, counts=None):
     """
     Generate an Excel report for tasks with professional formatting.
     
+    The workbook is write-only: rows are streamed to a temp file as they
+    are appended, so memory stays flat regardless of the number of tasks.
+    It can be saved only once.
+    
     Args:
-        tasks: List of Task objects to include in the report
+        tasks: Task objects to include in the report (list or any iterable,
+            e.g. a yield_per query)
         filters: Dictionary of applied filters
+        counts: Optional (total, completed) tuple; required when tasks is
+            not a list
         
     Returns:
         Workbook object ready to be saved
     """
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Reporte de Tareas"
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Reporte de Tareas")
     
     # Brand Colors - Caja de Abogados
     brand_blue = "0077BE"  # RGB(0, 119, 190)
     brand_red = "C1272D"   # RGB(193, 39, 45)
+    blue_fill = PatternFill(start_color=brand_blue, end_color=brand_blue, fill_type="solid")
+    thin = Side(style='thin')
+    thin_border = Border(left=thin, right=thin, top=thin, bottom=thin)
+
+    # Column widths must be set before the first row is written
+    column_widths = [30, 40, 15, 12, 15, 12, 25, 20, 18, 18]
+    for col_num, width in enumerate(column_widths, 1):
+        ws.column_dimensions[get_column_letter(col_num)].width = width
 
     # Get area name from filters
     area_name = filters.get('area_name', 'Todas las áreas')
 
     # --- Header Section ---
-    ws.merge_cells('A1:J1')
-    header_cell = ws['A1']
-    header_cell.value = "Gestor de Tareas"
-    header_cell.font = Font(name='Arial', size=22, bold=True, color="FFFFFF")
-    header_cell.fill = PatternFill(start_color=brand_blue, end_color=brand_blue, fill_type="solid")
-    header_cell.alignment = Alignment(horizontal='center', vertical='center')
+    ws.merged_cells.add('A1:J1')
     ws.row_dimensions[1].height = 35
+    ws.append([_styled_cell(
+        ws, "Gestor de Tareas",
+        font=Font(name='Arial', size=22, bold=True, color="FFFFFF"),
+        fill=blue_fill,
+        alignment=Alignment(horizontal='center', vertical='center')
+    )])
 
     # --- Area Name ---
-    ws.merge_cells('A2:J2')
-    area_cell = ws['A2']
-    area_cell.value = area_name
-    area_cell.font = Font(name='Arial', size=14, bold=False, color="FFFFFF")
-    area_cell.fill = PatternFill(start_color=brand_blue, end_color=brand_blue, fill_type="solid")
-    area_cell.alignment = Alignment(horizontal='center', vertical='center')
+    ws.merged_cells.add('A2:J2')
     ws.row_dimensions[2].height = 25
+    ws.append([_styled_cell(
+        ws, area_name,
+        font=Font(name='Arial', size=14, bold=False, color="FFFFFF"),
+        fill=blue_fill,
+        alignment=Alignment(horizontal='center', vertical='center')
+    )])
 
     # --- Date and Time ---
-    ws.merge_cells('A3:J3')
-    date_cell = ws['A3']
-    date_cell.value = f"Generado el {to_buenos_aires(datetime.utcnow()).strftime('%d/%m/%Y %H:%M')}"
-    date_cell.font = Font(name='Arial', size=10, italic=True)
-    date_cell.alignment = Alignment(horizontal='center')
+    ws.merged_cells.add('A3:J3')
+    ws.append([_styled_cell(
+        ws, f"Generado el {to_buenos_aires(datetime.utcnow()).strftime('%d/%m/%Y %H:%M')}",
+        font=Font(name='Arial', size=10, italic=True),
+        alignment=Alignment(horizontal='center')
+    )])
+    ws.append([])
     
     # --- Summary Section ---
     row = 5
-    total_tasks = len(tasks)
-    completed_tasks = sum(1 for t in tasks if t.status == 'Completed')
+    if counts is None:
+        total_tasks = len(tasks)
+        completed_tasks = sum(1 for t in tasks if t.status == 'Completed')
+    else:
+        total_tasks, completed_tasks = counts
     pending_tasks = total_tasks - completed_tasks
     
-    ws.merge_cells(f'A{row}:H{row}')
-    summary_cell = ws[f'A{row}']
-    summary_cell.value = "Resumen Ejecutivo"
-    summary_cell.font = Font(name='Arial', size=14, bold=True)
-    summary_cell.alignment = Alignment(horizontal='left')
+    ws.merged_cells.add(f'A{row}:H{row}')
+    ws.append([_styled_cell(
+        ws, "Resumen Ejecutivo",
+        font=Font(name='Arial', size=14, bold=True),
+        alignment=Alignment(horizontal='left')
+    )])
     row += 1
     
     # Summary stats
@@ -83,20 +120,22 @@ def generate_task_excel(tasks, filters):
     ]
     
     for label, value in summary_data:
-        ws[f'A{row}'] = label
-        ws[f'A{row}'].font = Font(name='Arial', size=11, bold=True)
-        ws[f'B{row}'] = value
-        ws[f'B{row}'].font = Font(name='Arial', size=11)
+        ws.append([
+            _styled_cell(ws, label, font=Font(name='Arial', size=11, bold=True)),
+            _styled_cell(ws, value, font=Font(name='Arial', size=11))
+        ])
         row += 1
     
+    ws.append([])
     row += 1
     
     # --- Filters Info ---
-    ws.merge_cells(f'A{row}:H{row}')
-    filters_cell = ws[f'A{row}']
-    filters_cell.value = "Filtros Aplicados:"
-    filters_cell.font = Font(name='Arial', size=12, bold=True)
-    filters_cell.alignment = Alignment(horizontal='left')
+    ws.merged_cells.add(f'A{row}:H{row}')
+    ws.append([_styled_cell(
+        ws, "Filtros Aplicados:",
+        font=Font(name='Arial', size=12, bold=True),
+        alignment=Alignment(horizontal='left')
+    )])
     row += 1
     
     filter_text = []
@@ -111,38 +150,41 @@ def generate_task_excel(tasks, filters):
         filter_text.append(f"Etiqueta: {filters['tag']}")
     
     if not filter_text:
-        ws[f'A{row}'] = "Ninguno (Mostrando todas las tareas)"
-        ws[f'A{row}'].font = Font(name='Arial', size=10, italic=True)
+        ws.append([_styled_cell(ws, "Ninguno (Mostrando todas las tareas)",
+                                font=Font(name='Arial', size=10, italic=True))])
         row += 1
     else:
         for ft in filter_text:
-            ws[f'A{row}'] = ft
-            ws[f'A{row}'].font = Font(name='Arial', size=10)
+            ws.append([_styled_cell(ws, ft, font=Font(name='Arial', size=10))])
             row += 1
     
+    ws.append([])
+    ws.append([])
     row += 2
     
     # --- Table Headers ---
     headers = ['Título', 'Descripción', 'Estado', 'Prioridad', 'Vencimiento', 'Tiempo', 'Creado por', 'Asignados', 'Completado por', 'Fecha Completado']
-    header_row = row
+    header_font = Font(name='Arial', size=11, bold=True, color="FFFFFF")
+    header_alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
     
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=header_row, column=col_num)
-        cell.value = header
-        cell.font = Font(name='Arial', size=11, bold=True, color="FFFFFF")
-        cell.fill = PatternFill(start_color=brand_blue, end_color=brand_blue, fill_type="solid")
-        cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-        cell.border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-    
-    ws.row_dimensions[header_row].height = 30
+    ws.row_dimensions[row].height = 30
+    ws.append([
+        _styled_cell(ws, header, font=header_font, fill=blue_fill,
+                     alignment=header_alignment, border=thin_border)
+        for header in headers
+    ])
     row += 1
     
     # --- Table Data ---
+    # Styles are shared by every data row
+    data_font = Font(name='Arial', size=10)
+    data_alignment = Alignment(horizontal='left', vertical='top', wrap_text=True)
+    zebra_fill = PatternFill(start_color="F3F4F6", end_color="F3F4F6", fill_type="solid")
+    completed_font = Font(name='Arial', size=10, bold=True, color="047857")  # Green
+    completed_fill = PatternFill(start_color="D1FAE5", end_color="D1FAE5", fill_type="solid")
+    pending_font = Font(name='Arial', size=10, bold=True, color=brand_red)
+    pending_fill = PatternFill(start_color="FEE2E2", end_color="FEE2E2", fill_type="solid")
+    
     for task in tasks:
         # Assignees
         assignees_list = ', '.join([a.full_name for a in task.assignees])
@@ -178,39 +220,25 @@ def generate_task_excel(tasks, filters):
             completed_at_str
         ]
         
+        row_fill = zebra_fill if row % 2 == 0 else None
+        cells = []
         for col_num, value in enumerate(row_data, 1):
-            cell = ws.cell(row=row, column=col_num)
-            cell.value = value
-            cell.font = Font(name='Arial', size=10)
-            cell.alignment = Alignment(horizontal='left', vertical='top', wrap_text=True)
-            cell.border = Border(
-                left=Side(style='thin'),
-                right=Side(style='thin'),
-                top=Side(style='thin'),
-                bottom=Side(style='thin')
-            )
-            
             # Special formatting for status
             if col_num == 3:  # Status column
                 if task.status == 'Completed':
-                    cell.font = Font(name='Arial', size=10, bold=True, color="047857")  # Green
-                    cell.fill = PatternFill(start_color="D1FAE5", end_color="D1FAE5", fill_type="solid")
+                    font, fill = completed_font, completed_fill
                 else:
-                    cell.font = Font(name='Arial', size=10, bold=True, color=brand_red)
-                    cell.fill = PatternFill(start_color="FEE2E2", end_color="FEE2E2", fill_type="solid")
-            
-            # Zebra striping
-            elif row % 2 == 0:
-                cell.fill = PatternFill(start_color="F3F4F6", end_color="F3F4F6", fill_type="solid")
+                    font, fill = pending_font, pending_fill
+            else:
+                # Zebra striping
+                font, fill = data_font, row_fill
+            cells.append(_styled_cell(ws, value, font=font, fill=fill,
+                                      alignment=data_alignment, border=thin_border))
         
         ws.row_dimensions[row].height = 40
+        ws.append(cells)
         row += 1
     
-    # --- Adjust column widths ---
-    column_widths = [30, 40, 15, 12, 15, 12, 25, 20, 18, 18]
-    for col_num, width in enumerate(column_widths, 1):
-        ws.column_dimensions[get_column_letter(col_num)].width = width
-    
     return wb
 
 
@@ -300,8 +328,16 @@ def parse_date_flexible(value):
         return value
     if isinstance(value, date):
         return datetime.combine(value, datetime.min.time())
+    return _parse_date_str(str(value).strip())
+
+
+@lru_cache(maxsize=512)
+def _parse_date_str(fecha_str):
+    """
+    String branch of parse_date_flexible(). Imported sheets repeat the same
+    few dates, so each distinct string goes through strptime only once.
+    """
     # Try multiple string formats
-    fecha_str = str(value).strip()
     for fmt in ['%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y']:
         try:
             return datetime.strptime(fecha_str, fmt)
@@ -349,12 +385,14 @@ def process_excel_import(file_stream, current_user, area_id=None):
     Returns:
         tuple: (success_count, error_list)
     """
-    from openpyxl import load_workbook
-    from models import Task, User, Tag, Process
+    from models import Task, User, Tag, Process, task_assignments, task_tags, STATUS_SORT_CODES
     from extensions import db
 
+    # Read-only: rows are streamed from the sheet XML instead of building
+    # the whole workbook (cells + styles) in memory; data_only returns the
+    # cached value of formula cells
     try:
-        wb = load_workbook(file_stream)
+        wb = load_workbook(file_stream, read_only=True, data_only=True)
         ws = wb.active
     except Exception as e:
         return 0, [f"Error al leer el archivo Excel: {str(e)}"]
@@ -362,12 +400,55 @@ def process_excel_import(file_stream, current_user, area_id=None):
     success_count = 0
     errors = []
 
-    # Cache users and tags to avoid repeats
-    all_users = {u.username.lower(): u for u in User.query.all()}
-    for u in list(all_users.values()):
-        all_users[u.full_name.lower()] = u
-
-    all_tags = {t.name.lower(): t for t in Tag.query.all()}
+    # First pass: every user/tag name and process id referenced by the
+    # file, so they are looked up with one IN query each (each iter_rows()
+    # call streams the sheet again, nothing is kept in memory)
+    def split_names(value):
+        return [n.strip().lower() for n in str(value).split(',')] if value else []
+
+    user_names = set()
+    tag_names = set()
+    process_ids = set()
+    for row in ws.iter_rows(min_row=2, values_only=True):
+        if not row:
+            continue
+        row = tuple(row) + (None,) * (12 - len(row))
+        user_names.update(split_names(row[7]))
+        user_names.update(split_names(row[11]))
+        tag_names.update(split_names(row[8]))
+        try:
+            process_ids.add(int(row[9]))
+        except (ValueError, TypeError):
+            pass
+
+    # Users match by username or full name (case-insensitive)
+    all_users = {}
+    if user_names:
+        matched_users = User.query.filter(db.or_(
+            db.func.lower(User.username).in_(user_names),
+            db.func.lower(User.full_name).in_(user_names)
+        )).all()
+        all_users = {u.username.lower(): u for u in matched_users}
+        for u in matched_users:
+            all_users[u.full_name.lower()] = u
+
+    all_tags = {
+        t.name.lower(): t
+        for t in Tag.query.filter(db.func.lower(Tag.name).in_(tag_names))
+    } if tag_names else {}
+
+    all_processes = {
+        p.id: p for p in Process.query.filter(Process.id.in_(process_ids))
+    } if process_ids else {}
+
+    # Area of rows without a process: the selected one, or the user's first
+    default_area_id = area_id or (current_user.areas[0].id if current_user.areas else None)
+
+    # Rows are collected as plain dicts and bulk-inserted after the loop,
+    # skipping per-object unit-of-work bookkeeping and mid-loop autoflushes.
+    task_rows = []
+    row_assignee_ids = []
+    row_tag_ids = []
 
     for row_idx, row in enumerate(ws.iter_rows(min_row=2, values_only=True), 2):
         if not row or not any(row):
@@ -433,44 +514,49 @@ def process_excel_import(file_stream, current_user, area_id=None):
             else:
                 priority = 'Normal'
 
-            # Create Task
-            new_task = Task(
-                title=str(title),
-                description=str(description) if description else '',
-                priority=priority,
-                due_date=due_date,
-                planned_start_date=start_date,
-                creator_id=current_user.id,
-                status='Pending',
-                area_id=area_id or (current_user.areas[0].id if current_user.areas else None)
-            )
+            # Task row
+            new_task = {
+                'title': str(title),
+                'description': str(description) if description else '',
+                'priority': priority,
+                'due_date': due_date,
+                'planned_start_date': start_date,
+                'creator_id': current_user.id,
+                'status': 'Pending',
+                'area_id': default_area_id,
+                'process_id': None,
+                'completed_at': None,
+                'completed_by_id': None,
+            }
 
             # Process ID
             if process_id_raw:
                 try:
                     pid = int(process_id_raw)
-                    process = Process.query.get(pid)
+                    process = all_processes.get(pid)
                     if process:
-                        new_task.process_id = process.id
-                        new_task.area_id = process.area_id
+                        new_task['process_id'] = process.id
+                        new_task['area_id'] = process.area_id
                     else:
                         errors.append(f"Fila {row_idx}: Proceso ID {pid} no encontrado. Se creó sin proceso.")
                 except (ValueError, TypeError):
                     errors.append(f"Fila {row_idx}: ID de Proceso inválido.")
 
-            # Assignees
+            # Assignees (dict keeps order and drops duplicates, e.g. username + full name)
+            assignee_ids = {}
             if assignees_raw:
                 names = [n.strip().lower() for n in str(assignees_raw).split(',')]
                 for name in names:
                     if name in all_users:
-                        new_task.assignees.append(all_users[name])
+                        assignee_ids[all_users[name].id] = None
 
             # Tags
+            tag_ids = {}
             if tags_raw:
                 tag_names = [t.strip().lower() for t in str(tags_raw).split(',')]
                 for t_name in tag_names:
                     if t_name in all_tags:
-                        new_task.tags.append(all_tags[t_name])
+                        tag_ids[all_tags[t_name].id] = None
 
             # Status & Completion
             if status_raw:
@@ -482,26 +568,53 @@ def process_excel_import(file_stream, current_user, area_id=None):
                     'completada': 'Completed'
                 }
                 final_status = status_map.get(str(status_raw).strip().lower(), 'Pending')
-                new_task.status = final_status
+                new_task['status'] = final_status
 
                 if final_status == 'Completed':
-                    new_task.completed_at = datetime.utcnow()
-                    new_task.completed_by_id = current_user.id
+                    new_task['completed_at'] = datetime.utcnow()
+                    new_task['completed_by_id'] = current_user.id
 
                     if completed_by_raw:
                         c_name = str(completed_by_raw).strip().lower()
                         if c_name in all_users:
-                            new_task.completed_by_id = all_users[c_name].id
+                            new_task['completed_by_id'] = all_users[c_name].id
 
-            db.session.add(new_task)
+            task_rows.append(new_task)
+            row_assignee_ids.append(list(assignee_ids))
+            row_tag_ids.append(list(tag_ids))
             success_count += 1
 
         except Exception as e:
             errors.append(f"Fila {row_idx}: Error inesperado - {str(e)}")
             continue
 
+    wb.close()
+
     try:
-        if success_count > 0:
+        if task_rows:
+            # Bulk inserts skip ORM attribute events, so the status_code that
+            # the Task.status listener keeps in sync is filled in here
+            for task_row in task_rows:
+                task_row['status_code'] = STATUS_SORT_CODES[task_row['status']]
+
+            # return_defaults fills in the generated 'id' of every row
+            db.session.bulk_insert_mappings(Task, task_rows, return_defaults=True)
+
+            assignment_rows = [
+                {'task_id': task_row['id'], 'user_id': user_id}
+                for task_row, user_ids in zip(task_rows, row_assignee_ids)
+                for user_id in user_ids
+            ]
+            tag_rows = [
+                {'task_id': task_row['id'], 'tag_id': tag_id}
+                for task_row, tag_ids in zip(task_rows, row_tag_ids)
+                for tag_id in tag_ids
+            ]
+            if assignment_rows:
+                db.session.execute(task_assignments.insert(), assignment_rows)
+            if tag_rows:
+                db.session.execute(task_tags.insert(), tag_rows)
+
             db.session.commit()
     except Exception as e:
         db.session.rollback()
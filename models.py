@@ -2,15 +2,20 @@ from datetime import datetime
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from extensions import db, login_manager
+from sqlalchemy.orm import joinedload
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Areas come in the same query: almost every request reads
+    # current_user.areas (visibility and area filters)
+    return db.session.get(User, int(user_id), options=[joinedload(User.areas)])
 
 # Association table for Many-to-Many relationship between Users and Areas
 user_areas = db.Table('user_areas',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True),
-    db.Column('area_id', db.Integer, db.ForeignKey('area.id', ondelete='CASCADE'), primary_key=True)
+    db.Column('area_id', db.Integer, db.ForeignKey('area.id', ondelete='CASCADE'), primary_key=True),
+    # The PK covers lookups by user; this one covers "users of these areas"
+    db.Index('ix_user_areas_area_user', 'area_id', 'user_id')
 )
 
 class Area(db.Model):
@@ -37,9 +42,17 @@ task_assignments = db.Table('task_assignments',
 # Association table for Many-to-Many relationship between Tasks and Tags
 task_tags = db.Table('task_tags',
     db.Column('task_id', db.Integer, db.ForeignKey('task.id', ondelete='CASCADE'), primary_key=True),
-    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id', ondelete='CASCADE'), primary_key=True)
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id', ondelete='CASCADE'), primary_key=True),
+    # The PK leads with task_id; this one serves "tasks with tag X" filters
+    db.Index('ix_task_tags_tag_task', 'tag_id', 'task_id')
 )
 
+# Grupos de roles para los chequeos de permisos de User (pertenencia O(1))
+OWN_TASKS_ROLES = frozenset(('usuario', 'usuario_plus'))
+AREA_WIDE_ROLES = frozenset(('supervisor', 'gerente'))
+TASK_CREATOR_ROLES = frozenset(('usuario_plus', 'supervisor', 'gerente'))
+
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -75,19 +88,19 @@ class User(UserMixin, db.Model):
     
     def can_see_all_area_tasks(self):
         """Check if user can see all tasks from their areas (not just assigned)"""
-        return self.role in ['supervisor', 'gerente'] or self.is_admin
+        return self.role in AREA_WIDE_ROLES or self.is_admin
     
     def can_only_see_own_tasks(self):
         """Check if user can only see tasks assigned to them or created by them"""
-        return self.role in ['usuario', 'usuario_plus']
+        return self.role in OWN_TASKS_ROLES
     
     def can_create_tasks(self):
         """Check if user can create tasks"""
-        return self.role in ['usuario_plus', 'supervisor', 'gerente'] or self.is_admin
+        return self.role in TASK_CREATOR_ROLES or self.is_admin
     
     def can_see_reports(self):
         """Check if user can see reports - only supervisor, gerente, and admin"""
-        return self.role in ['supervisor', 'gerente'] or self.is_admin
+        return self.role in AREA_WIDE_ROLES or self.is_admin
 
 class Task(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -95,6 +108,8 @@ class Task(db.Model):
     description = db.Column(db.Text, nullable=True)
     priority = db.Column(db.String(20), nullable=False, default='Normal') # Normal, Media, Urgente
     status = db.Column(db.String(20), nullable=False, default='Pending') # Pending, In Progress, In Review, Completed, Anulado
+    # Clave de orden por estado (ver STATUS_SORT_CODES), se mantiene al asignar status
+    status_code = db.Column(db.SmallInteger, nullable=False, default=2, server_default='2')
     planned_start_date = db.Column(db.DateTime, nullable=True)  # Planned start date/time (default 8:00 AM)
     due_date = db.Column(db.DateTime, nullable=False)  # Due date/time (default 2:00 PM)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -125,6 +140,9 @@ class Task(db.Model):
     # Tracking edits
     last_edited_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     last_edited_at = db.Column(db.DateTime, nullable=True)
+    # Bumped on every UPDATE of the row (ORM and bulk query.update());
+    # used as change marker for the due-soon notifications ETag
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationship for completed_by
     completed_by = db.relationship('User', foreign_keys=[completed_by_id])
@@ -163,6 +181,31 @@ class Task(db.Model):
     process_id = db.Column(db.Integer, db.ForeignKey('process.id'), nullable=True)
     # Relationship defined in Process model with backref='tasks'
 
+    # Índices para los listados (dashboard, árbol, calendario)
+    __table_args__ = (
+        # Estado + rango de vencimiento (vencidas en reportes/notificaciones),
+        # con o sin filtro de área: area_id al final se filtra en el índice
+        db.Index('ix_task_status_due_date_area', 'status', 'due_date', 'area_id'),
+        # Dashboard/calendario: enabled + área + estado, ordenado por vencimiento
+        db.Index('ix_task_dashboard', 'enabled', 'area_id', 'status', 'due_date'),
+        # Árbol de tareas: raíces (parent_id IS NULL) por área, e hijos de un padre
+        db.Index('ix_task_parent_area', 'parent_id', 'area_id'),
+        # Visibilidad "mis tareas": creadas por el usuario
+        db.Index('ix_task_creator_id', 'creator_id'),
+        # Orden de listados: prioridad de estado y vencimiento
+        db.Index('ix_task_status_code_due_date', 'status_code', 'due_date'),
+        # Rangos de vencimiento sin filtro de estado (exportaciones por período)
+        db.Index('ix_task_due_date', 'due_date'),
+        # Reportes: completadas por rango de completed_at (tendencias, filtro Completed)
+        db.Index('ix_task_status_completed_at', 'status', 'completed_at'),
+        # FK task.area_id: conteo de tareas de delete_area (LEFT JOIN por
+        # area_id) y el chequeo de la FK al borrar un área en PostgreSQL
+        db.Index('ix_task_area_id', 'area_id'),
+        # Buscador de tarea padre: title ILIKE '%texto%' (trigramas, solo PostgreSQL)
+        db.Index('ix_task_title_trgm', 'title', postgresql_using='gin',
+                 postgresql_ops={'title': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
+
     def __repr__(self):
         return f'<Task {self.title}>'
 
@@ -468,6 +511,7 @@ class Expiration(db.Model):
     creator_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     completed = db.Column(db.Boolean, default=False)
     completed_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Area assignment - nullable for backward compatibility
     area_id = db.Column(db.Integer, db.ForeignKey('area.id'), nullable=True)
@@ -477,6 +521,14 @@ class Expiration(db.Model):
     creator = db.relationship('User', backref='expirations')
     tags = db.relationship('Tag', secondary=expiration_tags, backref=db.backref('expirations', lazy='dynamic'))
     
+    # Índices del calendario de vencimientos
+    __table_args__ = (
+        # Rangos de fecha sin filtro de área (admins, fechas con eventos)
+        db.Index('ix_expiration_due_date', 'due_date'),
+        # Visibilidad por área + rango de fechas
+        db.Index('ix_expiration_area_due_date', 'area_id', 'due_date'),
+    )
+    
     def __repr__(self):
         return f'<Expiration {self.title}>'
 
@@ -607,16 +659,36 @@ class StatusTransition(db.Model):
     def __repr__(self):
         return f'<StatusTransition {self.from_status} -> {self.to_status}>'
 
-# Event Listener for Cascading Annulment
+# Prioridad de cada estado en los listados (dashboard, árbol): en curso primero
+STATUS_SORT_CODES = {
+    'In Progress': 0,
+    'In Review': 1,
+    'Pending': 2,
+    'Completed': 3,
+}
+STATUS_SORT_DEFAULT = 4  # Anulado y cualquier otro estado
+
+
 from sqlalchemy import event
 
+# ix_task_title_trgm needs pg_trgm: create it with the task table (create_all)
+event.listen(
+    Task.__table__, 'before_create',
+    db.DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+
+# Event Listener for Cascading Annulment
+
 @event.listens_for(Task.status, 'set')
 def receive_set_status(target, value, oldvalue, initiator):
     """
-    Cascada automática para anulación de tareas.
+    Mantiene status_code sincronizado con el estado y aplica la
+    cascada automática para anulación de tareas.
     Si una tarea se marca como 'Anulado', todas sus subtareas (cargadas o no)
     se marcan también como 'Anulado' y 'disabled'.
     """
+    target.status_code = STATUS_SORT_CODES.get(value, STATUS_SORT_DEFAULT)
+
     if value == 'Anulado' and oldvalue != 'Anulado':
         target.enabled = False
         
@@ -1,8 +1,9 @@
 from fpdf import FPDF
 from datetime import datetime
-import matplotlib
-matplotlib.use('Agg') # Non-interactive backend
-import matplotlib.pyplot as plt
+# Charts use Figure objects, not pyplot: its global state is not thread-safe
+# and reports are also built on the background report pool
+from matplotlib.figure import Figure
+from matplotlib.patches import Circle
 import io
 import tempfile
 import os
@@ -20,6 +21,18 @@ def to_buenos_aires(dt):
         dt = pytz.utc.localize(dt)
     return dt.astimezone(BUENOS_AIRES_TZ)
 
+def pdf_to_bytes(pdf):
+    """
+    Return the rendered PDF document as bytes.
+    Legacy fpdf (1.x) keeps the document in a latin-1 str, so one encode is
+    unavoidable; fpdf2 already returns a bytearray. Callers hand the result
+    straight to the response instead of wrapping it in another buffer.
+    """
+    output = pdf.output(dest='S')
+    if isinstance(output, str):
+        return output.encode('latin-1')
+    return bytes(output)
+
 def sanitize_text(text):
     """
     Sanitize text for PDF generation by replacing Unicode characters
@@ -89,6 +102,12 @@ class PDFReport(FPDF):
         self.set_text_color(128, 128, 128)
         self.cell(0, 10, f'Página {self.page_no()}/{{nb}} - Generado el {to_buenos_aires(datetime.utcnow()).strftime("%d/%m/%Y %H:%M")}', 0, 0, 'C')
 
+def _rotate_xticks(ax):
+    """Same as plt.xticks(rotation=45, ha='right') for a given Axes."""
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_horizontalalignment('right')
+
 def generate_charts_for_pdf(data):
     paths = {}
     
@@ -102,17 +121,17 @@ def generate_charts_for_pdf(data):
         completed = [u['completed'] for u in user_stats]
         pending = [u['pending'] for u in user_stats]
         
-        plt.figure(figsize=(10, 6))
-        plt.bar(names, completed, label='Completadas', color='#10b981')
-        plt.bar(names, pending, bottom=completed, label='Pendientes', color='#f59e0b')
-        plt.xlabel('Usuarios')
-        plt.ylabel('Cantidad de Tareas')
-        plt.title('Progreso por Usuario')
-        plt.legend()
-        plt.xticks(rotation=45, ha='right')
-        plt.tight_layout()
-        plt.savefig(path, format='png', dpi=100)
-        plt.close()
+        fig = Figure(figsize=(10, 6))
+        ax = fig.subplots()
+        ax.bar(names, completed, label='Completadas', color='#10b981')
+        ax.bar(names, pending, bottom=completed, label='Pendientes', color='#f59e0b')
+        ax.set_xlabel('Usuarios')
+        ax.set_ylabel('Cantidad de Tareas')
+        ax.set_title('Progreso por Usuario')
+        ax.legend()
+        _rotate_xticks(ax)
+        fig.tight_layout()
+        fig.savefig(path, format='png', dpi=100)
         paths['user'] = path
     except Exception as e:
         print(f"Error generating user chart: {e}")
@@ -128,16 +147,15 @@ def generate_charts_for_pdf(data):
         sizes = [global_stats['completed'], global_stats['pending']]
         colors = ['#10b981', '#f59e0b']
         
-        plt.figure(figsize=(6, 6))
-        plt.pie(sizes, labels=labels, colors=colors, autopct='%1.1f%%', startangle=90, pctdistance=0.85)
+        fig = Figure(figsize=(6, 6))
+        ax = fig.subplots()
+        ax.pie(sizes, labels=labels, colors=colors, autopct='%1.1f%%', startangle=90, pctdistance=0.85)
         # Draw circle for doughnut
-        centre_circle = plt.Circle((0,0),0.70,fc='white')
-        fig = plt.gcf()
-        fig.gca().add_artist(centre_circle)
-        plt.title('Estado Global')
-        plt.tight_layout()
-        plt.savefig(path, format='png', dpi=100)
-        plt.close()
+        centre_circle = Circle((0,0),0.70,fc='white')
+        ax.add_artist(centre_circle)
+        ax.set_title('Estado Global')
+        fig.tight_layout()
+        fig.savefig(path, format='png', dpi=100)
         paths['status'] = path
     except Exception as e:
         print(f"Error generating status chart: {e}")
@@ -152,17 +170,17 @@ def generate_charts_for_pdf(data):
         dates = [datetime.strptime(d, '%Y-%m-%d').strftime('%d/%m') for d in trend['dates']]
         counts = trend['completed_counts']
         
-        plt.figure(figsize=(10, 6))
-        plt.plot(dates, counts, marker='o', linestyle='-', color='#3b82f6', linewidth=2)
-        plt.fill_between(dates, counts, color='#3b82f6', alpha=0.1)
-        plt.xlabel('Fecha')
-        plt.ylabel('Tareas Completadas')
-        plt.title('Tendencia de Finalización (Global)')
-        plt.grid(True, linestyle='--', alpha=0.7)
-        plt.xticks(rotation=45, ha='right')
-        plt.tight_layout()
-        plt.savefig(path, format='png', dpi=100)
-        plt.close()
+        fig = Figure(figsize=(10, 6))
+        ax = fig.subplots()
+        ax.plot(dates, counts, marker='o', linestyle='-', color='#3b82f6', linewidth=2)
+        ax.fill_between(dates, counts, color='#3b82f6', alpha=0.1)
+        ax.set_xlabel('Fecha')
+        ax.set_ylabel('Tareas Completadas')
+        ax.set_title('Tendencia de Finalización (Global)')
+        ax.grid(True, linestyle='--', alpha=0.7)
+        _rotate_xticks(ax)
+        fig.tight_layout()
+        fig.savefig(path, format='png', dpi=100)
         paths['trend'] = path
     except Exception as e:
         print(f"Error generating trend chart: {e}")
@@ -176,19 +194,19 @@ def generate_charts_for_pdf(data):
         emp_trends = data.get('employee_trend', [])
         dates = [datetime.strptime(d, '%Y-%m-%d').strftime('%d/%m') for d in data['trend']['dates']]
         
-        plt.figure(figsize=(10, 6))
+        fig = Figure(figsize=(10, 6))
+        ax = fig.subplots()
         for emp in emp_trends:
-            plt.plot(dates, emp['data'], marker='.', linestyle='-', label=emp['label'])
+            ax.plot(dates, emp['data'], marker='.', linestyle='-', label=emp['label'])
             
-        plt.xlabel('Fecha')
-        plt.ylabel('Tareas Completadas')
-        plt.title('Evolución por Empleado')
-        plt.legend()
-        plt.grid(True, linestyle='--', alpha=0.7)
-        plt.xticks(rotation=45, ha='right')
-        plt.tight_layout()
-        plt.savefig(path, format='png', dpi=100)
-        plt.close()
+        ax.set_xlabel('Fecha')
+        ax.set_ylabel('Tareas Completadas')
+        ax.set_title('Evolución por Empleado')
+        ax.legend()
+        ax.grid(True, linestyle='--', alpha=0.7)
+        _rotate_xticks(ax)
+        fig.tight_layout()
+        fig.savefig(path, format='png', dpi=100)
         paths['employee_trend'] = path
     except Exception as e:
         print(f"Error generating employee trend chart: {e}")
@@ -202,19 +220,19 @@ def generate_charts_for_pdf(data):
         tag_trends = data.get('tag_trend', [])
         dates = [datetime.strptime(d, '%Y-%m-%d').strftime('%d/%m') for d in data['trend']['dates']]
         
-        plt.figure(figsize=(10, 6))
+        fig = Figure(figsize=(10, 6))
+        ax = fig.subplots()
         for tag in tag_trends:
-            plt.plot(dates, tag['data'], marker='.', linestyle='-', label=tag['label'], color=tag['color'])
+            ax.plot(dates, tag['data'], marker='.', linestyle='-', label=tag['label'], color=tag['color'])
             
-        plt.xlabel('Fecha')
-        plt.ylabel('Tareas Completadas')
-        plt.title('Evolución por Etiqueta')
-        plt.legend()
-        plt.grid(True, linestyle='--', alpha=0.7)
-        plt.xticks(rotation=45, ha='right')
-        plt.tight_layout()
-        plt.savefig(path, format='png', dpi=100)
-        plt.close()
+        ax.set_xlabel('Fecha')
+        ax.set_ylabel('Tareas Completadas')
+        ax.set_title('Evolución por Etiqueta')
+        ax.legend()
+        ax.grid(True, linestyle='--', alpha=0.7)
+        _rotate_xticks(ax)
+        fig.tight_layout()
+        fig.savefig(path, format='png', dpi=100)
         paths['tag_trend'] = path
     except Exception as e:
         print(f"Error generating tag trend chart: {e}")
@@ -674,15 +692,22 @@ def generate_report_pdf(data):
 
     return pdf
 
-def generate_task_pdf(tasks, filters):
+def generate_task_pdf(tasks, filters, counts=None):
+    """
+    tasks can be any iterable (e.g. a yield_per query); in that case pass
+    counts=(total, completed) so the summary doesn't need the full list.
+    """
     area_name = filters.get('area_name', 'Todas las áreas')
     pdf = PDFReport(area_name=area_name)
     pdf.alias_nb_pages()
     pdf.add_page()
     
     # --- Summary Section ---
-    total_tasks = len(tasks)
-    completed_tasks = sum(1 for t in tasks if t.status == 'Completed')
+    if counts is None:
+        total_tasks = len(tasks)
+        completed_tasks = sum(1 for t in tasks if t.status == 'Completed')
+    else:
+        total_tasks, completed_tasks = counts
     pending_tasks = total_tasks - completed_tasks
     
     pdf.set_font('Arial', 'B', 14)
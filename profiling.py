@@ -0,0 +1,44 @@
+"""
+Optional request profiling, enabled with PROFILE=1.
+Logs wall time and SQL query count for every request, plus each query slower
+than PROFILE_SQL_THRESHOLD seconds, using Flask-SQLAlchemy's query recording.
+"""
+import logging
+import time
+
+from flask import g, request
+from flask.logging import default_handler
+from flask_sqlalchemy.record_queries import get_recorded_queries
+
+logger = logging.getLogger(__name__)
+
+
+def init_profiler(app):
+    """Register the timing hooks. SQLALCHEMY_RECORD_QUERIES must be on before db.init_app()."""
+    threshold = app.config.get('PROFILE_SQL_THRESHOLD', 0.05)
+
+    # Profiling was asked for explicitly: make the INFO lines visible, through
+    # Flask's handler (the WSGI error stream) unless logging is configured
+    logger.setLevel(logging.INFO)
+    if not logger.hasHandlers():
+        logger.addHandler(default_handler)
+
+    @app.before_request
+    def _profile_start():
+        g.profile_start = time.perf_counter()
+
+    @app.after_request
+    def _profile_log(response):
+        start = g.pop('profile_start', None)
+        if start is None or request.path.startswith('/static/'):
+            return response
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        queries = get_recorded_queries()
+        logger.info("%s %s %s %.1fms, %d queries", request.method, request.endpoint,
+                    response.status_code, elapsed_ms, len(queries))
+        for query in queries:
+            if query.duration >= threshold:
+                logger.warning("Slow query (%.1fms) in %s: %s %s", query.duration * 1000,
+                               request.endpoint, ' '.join(query.statement.split()), query.parameters)
+        return response
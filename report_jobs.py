@@ -0,0 +1,103 @@
+"""
+Background generation of PDF reports.
+Runs report builds on a small in-process thread pool so the request thread
+returns immediately. Rendered PDFs are stored in a temp directory (shared by
+all gunicorn workers on the host) and expire after REPORT_JOB_TTL seconds.
+A job still pending after REPORT_JOB_TIMEOUT seconds (e.g. its worker was
+restarted) is reported as failed.
+"""
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+REPORT_JOBS_DIR = os.path.join(tempfile.gettempdir(), 'tareas_report_jobs')
+REPORT_JOB_TTL = 15 * 60  # 15 minutes
+REPORT_JOB_TIMEOUT = 5 * 60  # 5 minutes
+
+_JOB_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='report-job')
+
+
+def _job_path(job_id, ext):
+    return os.path.join(REPORT_JOBS_DIR, f'{job_id}.{ext}')
+
+
+def _write_meta(job_id, meta):
+    """Write job metadata atomically so readers never see a partial file."""
+    tmp_path = _job_path(job_id, 'json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, _job_path(job_id, 'json'))
+
+
+def _cleanup_expired():
+    """Remove job files older than REPORT_JOB_TTL."""
+    cutoff = time.time() - REPORT_JOB_TTL
+    try:
+        entries = os.listdir(REPORT_JOBS_DIR)
+    except FileNotFoundError:
+        return
+    for name in entries:
+        path = os.path.join(REPORT_JOBS_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _run_job(app, job_id, user_id, build_fn, args):
+    with app.app_context():
+        try:
+            pdf_bytes, filename = build_fn(*args)
+            with open(_job_path(job_id, 'pdf'), 'wb') as f:
+                f.write(pdf_bytes)
+            _write_meta(job_id, {'status': 'done', 'user_id': user_id, 'filename': filename})
+        except Exception as e:
+            print(f"[REPORT JOB] Error generating report {job_id}: {e}")
+            _write_meta(job_id, {'status': 'error', 'user_id': user_id, 'error': str(e)})
+
+
+def submit_report_job(app, user_id, build_fn, *args):
+    """
+    Queue build_fn(*args) on the report pool.
+
+    build_fn must return a (pdf_bytes, filename) tuple and runs inside an
+    app context of `app`.
+
+    Returns:
+        str: job id to poll with get_report_job()
+    """
+    os.makedirs(REPORT_JOBS_DIR, exist_ok=True)
+    _cleanup_expired()
+
+    job_id = uuid.uuid4().hex
+    _write_meta(job_id, {'status': 'pending', 'user_id': user_id, 'submitted_at': time.time()})
+    _executor.submit(_run_job, app, job_id, user_id, build_fn, args)
+    return job_id
+
+
+def get_report_job(job_id):
+    """
+    Return the metadata dict of a job, or None if it does not exist/expired.
+    When status is 'done', the dict includes 'path' to the rendered PDF.
+    A pending job older than REPORT_JOB_TIMEOUT comes back as 'error'.
+    """
+    if not _JOB_ID_RE.match(job_id or ''):
+        return None
+    try:
+        with open(_job_path(job_id, 'json')) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if meta.get('status') == 'done':
+        meta['path'] = _job_path(job_id, 'pdf')
+    elif meta.get('status') == 'pending' and time.time() - meta.get('submitted_at', 0) > REPORT_JOB_TIMEOUT:
+        # The thread running it is gone (worker restart) or stuck
+        meta['status'] = 'error'
+        meta['error'] = 'timeout'
+    return meta
@@ -1,24 +1,258 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, make_response
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, make_response, send_file, current_app, g, abort
 from flask_login import login_user, logout_user, login_required, current_user
 from extensions import db
-from models import User, Task, Tag, TaskTemplate, SubtaskTemplate, Expiration, RecurringTask, ActivityLog, ProcessType, Process, StatusTransition, TaskAttachment
-from datetime import datetime, date, timedelta, time
-from pdf_utils import generate_task_pdf
+from models import User, Task, Tag, Area, TaskTemplate, SubtaskTemplate, Expiration, RecurringTask, ActivityLog, ProcessType, Process, StatusTransition, TaskAttachment, user_areas, task_assignments, task_tags, expiration_tags, recurring_task_assignments, recurring_task_tags, template_tags
+from datetime import datetime, date, timedelta, time, timezone
+from pdf_utils import generate_task_pdf, generate_report_pdf, pdf_to_bytes
 from excel_utils import generate_task_excel, generate_import_template, process_excel_import
+from report_jobs import submit_report_job, get_report_job
 from io import BytesIO
+import calendar as cal
+from functools import lru_cache
+from itertools import groupby
 from utils import calculate_business_days_until
-from sqlalchemy.orm import joinedload, subqueryload
-import pytz
+from sqlalchemy.orm import joinedload, subqueryload, selectinload, load_only
+from sqlalchemy.exc import IntegrityError
 from werkzeug.utils import secure_filename
 import storage
+import hashlib
 import json
+import logging
+import os
+import tempfile
+from openpyxl import load_workbook
 
-# Buenos Aires timezone (for reference, conversion is done in templates)
-BUENOS_AIRES_TZ = pytz.timezone('America/Argentina/Buenos_Aires')
+logger = logging.getLogger(__name__)
 
 def now_utc():
-    """Get current datetime in UTC (consistent with other datetimes in the app)."""
-    return datetime.utcnow()
+    """
+    Get current datetime in UTC (consistent with other datetimes in the app).
+    Naive on purpose: the DateTime columns are stored without time zone.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def get_user_area_ids(user=None):
+    """
+    Tuple with the ids of the user's areas. For current_user (user=None, or
+    the logged-in user passed explicitly) it is computed once per request
+    and kept on flask.g.
+    """
+    # current_user is None/anonymous outside a logged-in request (report jobs)
+    if user is not None and user.id != getattr(current_user, 'id', None):
+        return tuple(a.id for a in user.areas)
+    # Keyed by user id: g outlives the request when an app context is reused
+    cached = g.get('user_area_ids')
+    if cached is None or cached[0] != current_user.id:
+        cached = g.user_area_ids = (current_user.id, tuple(a.id for a in current_user.areas))
+    return cached[1]
+
+def users_in_areas(areas):
+    """
+    Query of the users that belong to at least one of the given areas
+    (Area objects or ids). The filter runs in SQL over user_areas, so callers
+    can still chain order_by() before .all().
+    """
+    area_ids = [a if isinstance(a, int) else a.id for a in areas if a is not None]
+    if not area_ids:
+        return User.query.filter(db.literal(False))
+    return User.query.filter(User.id.in_(
+        db.session.query(user_areas.c.user_id).filter(user_areas.c.area_id.in_(area_ids))
+    ))
+
+
+def apply_visibility(query, user=None):
+    """
+    Apply role-based task visibility to a Task query:
+    - usuario/usuario_plus: only tasks assigned to them OR created by them (within their areas)
+    - supervisor: all tasks in their areas
+    - gerente/admin: all tasks
+    `user` defaults to current_user.
+    """
+    user_area_ids = get_user_area_ids(user)
+    if user is None:
+        user = current_user
+    if user.can_only_see_own_tasks():
+        if not user_area_ids:
+            # No areas assigned - show no tasks
+            return query.filter(db.literal(False))
+        # Assigned OR created, as a UNION of two id lookups: each side uses
+        # its own index (task_assignments PK, ix_task_creator_id) instead of
+        # an OR that forces a scan of the task table
+        own_task_ids = db.select(task_assignments.c.task_id).where(
+            task_assignments.c.user_id == user.id
+        ).union(
+            db.select(Task.id).where(Task.creator_id == user.id)
+        )
+        return query.filter(Task.id.in_(own_task_ids)).filter(Task.area_id.in_(user_area_ids))
+    if user.can_see_all_areas():
+        return query
+    if not user_area_ids:
+        return query.filter(db.literal(False))
+    return query.filter(Task.area_id.in_(user_area_ids))
+
+
+def can_see_any_task(user=None):
+    """
+    False when apply_visibility() can only match nothing (a user without
+    areas who is not gerente/admin), so callers can skip the query entirely.
+    """
+    has_areas = bool(get_user_area_ids(user))
+    if user is None:
+        user = current_user
+    if user.can_only_see_own_tasks():
+        return has_areas
+    return user.can_see_all_areas() or has_areas
+
+def apply_area_filter(query, area_id, user=None, strict=False):
+    """
+    Narrow a Task query to a single area picked in the UI (an int id, read
+    with request.args.get('area', type=int)). Gerentes/admins can pick any
+    area; for everyone else an area outside their own is ignored, or with
+    strict=True (dashboard) matches nothing.
+    """
+    if not area_id:
+        return query
+    user_area_ids = get_user_area_ids(user)
+    if user is None:
+        user = current_user
+    if not user.can_see_all_areas() and area_id not in user_area_ids:
+        return query.filter(db.false()) if strict else query
+    return query.filter(Task.area_id == area_id)
+
+
+def _id_match(column, ids):
+    """column == id, or column IN ids when given a list/tuple/set of ids."""
+    if isinstance(ids, (list, tuple, set, frozenset)):
+        return column.in_([int(i) for i in ids])
+    return column == int(ids)
+
+
+def assigned_to(user_ids):
+    """
+    Task criterion "assigned to user_ids" (one id, or a list meaning any of
+    them). An uncorrelated IN over task_assignments (served by its
+    (user_id, task_id) PK) instead of the per-row EXISTS, joined to user,
+    that Task.assignees.any() compiles to.
+    """
+    return Task.id.in_(
+        db.select(task_assignments.c.task_id).where(_id_match(task_assignments.c.user_id, user_ids))
+    )
+
+
+def tagged_with(tag_ids):
+    """
+    Task criterion "has tag tag_ids" (one id, or a list meaning any of
+    them), same shape as assigned_to(); served by ix_task_tags_tag_task.
+    """
+    return Task.id.in_(
+        db.select(task_tags.c.task_id).where(_id_match(task_tags.c.tag_id, tag_ids))
+    )
+
+def is_task_assignee(task, user=None):
+    """
+    True if user (default current_user) is assigned to task. Unless
+    task.assignees is already loaded, it's one indexed lookup on
+    task_assignments instead of loading the whole collection.
+    """
+    user = user or current_user
+    if 'assignees' in task.__dict__:
+        return user in task.assignees
+    return db.session.query(
+        db.exists().where(
+            task_assignments.c.task_id == task.id,
+            task_assignments.c.user_id == user.id
+        )
+    ).scalar()
+
+
+def between_days(column, first_day, last_day=None):
+    """
+    Index-friendly version of func.date(column) BETWEEN first_day AND last_day:
+    a half-open datetime range [first_day 00:00, last_day + 1 day 00:00).
+    """
+    if last_day is None:
+        last_day = first_day
+    return db.and_(
+        column >= datetime.combine(first_day, time.min),
+        column < datetime.combine(last_day + timedelta(days=1), time.min)
+    )
+
+
+def month_bounds(day):
+    """(first, last) date of the month containing day."""
+    return day.replace(day=1), day.replace(day=cal.monthrange(day.year, day.month)[1])
+
+
+def before_day(column, day):
+    """Index-friendly version of func.date(column) < day."""
+    return column < datetime.combine(day, time.min)
+
+
+def seconds_between(start, end):
+    """SQL expression for end - start in seconds (PostgreSQL, or SQLite locally)."""
+    if db.engine.dialect.name == 'postgresql':
+        return db.func.extract('epoch', end - start)
+    return (db.func.julianday(end) - db.func.julianday(start)) * 86400
+
+
+@lru_cache(maxsize=128)
+def _parse_date(value):
+    """'YYYY-MM-DD' query-string value to a date, or None if empty/invalid."""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+    except ValueError:
+        return None
+
+
+def insert_links(owner_column, owner_id, target_column, target_pk, ids):
+    """
+    Add association rows (owner_id, id) for the given ids with a single
+    INSERT ... SELECT over the target table, so ids that don't exist are
+    skipped and duplicates collapse. The owner row must already be flushed.
+    """
+    if not ids:
+        return
+    db.session.execute(owner_column.table.insert().from_select(
+        [owner_column.name, target_column.name],
+        db.select(db.literal(owner_id, db.Integer), target_pk).where(target_pk.in_(ids))
+    ))
+
+
+def delete_links(owner_id, *columns):
+    """
+    DELETE the association rows whose column equals owner_id, one statement
+    per column. Needed after bulk DELETEs of the owner: SQLite (dev/tests)
+    does not enforce ON DELETE CASCADE, and it reuses freed ids.
+    """
+    for column in columns:
+        db.session.execute(db.delete(column.table).where(column == owner_id))
+
+
+def conditional_response(response):
+    """
+    Add an ETag of the body: a client that already has the same content
+    gets a 304 without it. no-cache keeps edits visible at once.
+    """
+    response.add_etag()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+
+def conditional_json(data):
+    """jsonify(data) answered through conditional_response()."""
+    return conditional_response(jsonify(data))
+
+
+def group_by_due_day(items):
+    """
+    Group items ordered by due_date into {'YYYY-MM-DD': [items]} (one
+    list per day, built by groupby instead of appending item by item).
+    """
+    return {
+        day: list(day_items)
+        for day, day_items in groupby(items, key=lambda item: item.due_date.date().isoformat())
+    }
 
 
 def create_subtasks_from_template(template, parent_task, assignees, creator, area_id):
@@ -101,7 +335,7 @@ def log_activity(user, action, description, target_type=None, target_id=None, ar
             target_id=target_id,
             area_id=area_id,
             details=details,
-            created_at=datetime.utcnow()
+            created_at=now_utc()
         )
         db.session.add(log)
         db.session.commit()
@@ -151,15 +385,12 @@ def login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
-        print(f"DEBUG: Login attempt for username='{username}', password='{password}'")
+        logger.debug("Login attempt for username=%r", username)
         
         user = User.query.filter_by(username=username).first()
-        print(f"DEBUG: User found: {user}")
         
         if user:
-            check = user.check_password(password)
-            print(f"DEBUG: Password check result: {check}")
-            if check:
+            if user.check_password(password):
                 login_user(user)
                 
                 # Log activity
@@ -172,7 +403,7 @@ def login():
                 
                 return redirect(url_for('main.scrum_board'))
         
-        print("DEBUG: Login failed")
+        logger.debug("Login failed for username=%r", username)
         flash('Usuario o contraseña incorrectos.', 'danger')
             
     return render_template('login.html')
@@ -193,24 +424,36 @@ def index():
 @main_bp.route('/dashboard')
 @login_required
 def dashboard():
-    # Import Area model
-    from models import Area
-    
     # Filter logic
     filter_assignee = request.args.get('assignee')
     filter_creator = request.args.get('creator')
     filter_status = request.args.get('status')
     filter_tag = request.args.get('tag_filter')
-    filter_area = request.args.get('area')  # NEW: Area filter
+    filter_area = request.args.get('area', type=int)  # NEW: Area filter
     show_blocked = request.args.get('show_blocked', 'true')  # NEW: Show blocked tasks (default: true)
     sort_order = request.args.get('sort', 'asc')
 
-    # Base query: Eager load assignees, tags, and area
+    # Base query: eager load everything the task cards render.
+    # Collections use selectinload (one IN query each) so they don't multiply
+    # the joined rows; single references are joined.
     tasks_query = Task.query.options(
-        joinedload(Task.assignees), 
-        joinedload(Task.tags),
+        # Only the columns the dashboard cards render (skips the audit
+        # timestamps, time tracking, etc.)
+        load_only(
+            Task.id, Task.title, Task.description, Task.priority, Task.status,
+            Task.due_date, Task.enabled, Task.parent_id, Task.area_id,
+            Task.creator_id, Task.process_id, Task.completed_by_id,
+            Task.approved_by_id, Task.completion_comment, Task.recurring_task_id
+        ),
+        selectinload(Task.assignees),
+        selectinload(Task.tags),
+        # Subtask progress: only the status of each child is needed
+        selectinload(Task.children).load_only(Task.id, Task.parent_id, Task.status),
         joinedload(Task.area),  # NEW: Load area relationship
-        joinedload(Task.parent)  # Load parent for blocked tasks
+        joinedload(Task.parent).load_only(Task.id),  # Load parent for blocked tasks
+        joinedload(Task.completed_by),
+        joinedload(Task.approved_by),
+        joinedload(Task.process).joinedload(Process.process_type)
     )
     
     # Filter by enabled status (show blocked tasks if filter is on)
@@ -221,38 +464,15 @@ def dashboard():
         # Only show enabled tasks
         tasks_query = tasks_query.filter(Task.enabled == True)
     
-    # NEW: Role-based visibility filtering
-    # - usuario/usuario_plus: only see tasks assigned to them OR created by them (within their areas)
-    # - supervisor: see ALL tasks in their area
-    # - gerente/admin: see ALL tasks
-    if current_user.can_only_see_own_tasks():
-        # Users can only see tasks they are assigned to OR tasks they created
-        user_area_ids = [area.id for area in current_user.areas]
-        if user_area_ids:
-            tasks_query = tasks_query.filter(
-                db.or_(
-                    Task.assignees.any(id=current_user.id),
-                    Task.creator_id == current_user.id
-                )
-            ).filter(Task.area_id.in_(user_area_ids))
-        else:
-            # User has no areas assigned - show no tasks
-            tasks_query = tasks_query.filter(Task.area_id == -1)
-    elif not current_user.can_see_all_areas():
-        # Supervisors see all tasks in their area
-        user_area_ids = [area.id for area in current_user.areas]
-        if user_area_ids:
-            tasks_query = tasks_query.filter(Task.area_id.in_(user_area_ids))
-        else:
-            tasks_query = tasks_query.filter(Task.area_id == -1)
-    # Gerentes and admins see all tasks (no additional filter)
+    # Role-based visibility filtering
+    tasks_query = apply_visibility(tasks_query)
     
-    # Additional area filter (for gerentes/supervisors filtering specific area)
-    if filter_area:
-        tasks_query = tasks_query.filter(Task.area_id == int(filter_area))
+    # Additional area filter (for gerentes/supervisors filtering specific area);
+    # an area the user can't see gives an empty list, not every task
+    tasks_query = apply_area_filter(tasks_query, filter_area, strict=True)
     
     if filter_assignee:
-        tasks_query = tasks_query.filter(Task.assignees.any(id=filter_assignee))
+        tasks_query = tasks_query.filter(assigned_to(filter_assignee))
     
     if filter_creator:
         tasks_query = tasks_query.filter(Task.creator_id == filter_creator)
@@ -264,15 +484,15 @@ def dashboard():
             # Include Pending, In Progress, and In Review tasks that are overdue
             tasks_query = tasks_query.filter(
                 Task.status.in_(['Pending', 'In Progress', 'In Review']),
-                db.func.date(Task.due_date) < today_date
+                before_day(Task.due_date, today_date)
             )
         elif filter_status in ['Pending', 'In Progress', 'In Review', 'Completed', 'Anulado', 'Scheduled']:
             tasks_query = tasks_query.filter(Task.status == filter_status)
     else:
-        tasks_query = tasks_query.filter(Task.status != 'Anulado')
+        tasks_query = tasks_query.filter(Task.status.in_(ACTIVE_STATUSES))
 
     if filter_tag:
-        tasks_query = tasks_query.filter(Task.tags.any(id=int(filter_tag)))
+        tasks_query = tasks_query.filter(tagged_with(filter_tag))
 
     # Search filter
     search_query = request.args.get('q')
@@ -296,19 +516,19 @@ def dashboard():
     # Overdue condition: Pending/InProgress/Review tasks past due date
     # These should ALWAYS be shown regardless of date filter (unless completed)
     overdue_condition = db.and_(
-        db.func.date(Task.due_date) < today,
+        before_day(Task.due_date, today),
         Task.status.in_(['Pending', 'In Progress', 'In Review'])
     )
     
     if filter_period == 'today':
         tasks_query = tasks_query.filter(
             db.or_(
-                db.func.date(Task.due_date) == today,
-                db.func.date(Task.planned_start_date) == today,
+                between_days(Task.due_date, today),
+                between_days(Task.planned_start_date, today),
                 Task.status.in_(['In Progress', 'In Review']), # Always show active work
                 overdue_condition,
                 # Show completed tasks if completed TODAY
-                db.and_(Task.status == 'Completed', db.func.date(Task.completed_at) == today)
+                db.and_(Task.status == 'Completed', between_days(Task.completed_at, today))
             )
         )
     elif filter_period == 'week':
@@ -316,44 +536,34 @@ def dashboard():
         week_end = week_start + timedelta(days=6)
         tasks_query = tasks_query.filter(
             db.or_(
-                db.and_(db.func.date(Task.due_date) >= week_start, db.func.date(Task.due_date) <= week_end),
-                db.and_(db.func.date(Task.planned_start_date) >= week_start, db.func.date(Task.planned_start_date) <= week_end),
+                between_days(Task.due_date, week_start, week_end),
+                between_days(Task.planned_start_date, week_start, week_end),
                 Task.status.in_(['In Progress', 'In Review']),
                 overdue_condition,
                 # Show completed tasks if completed THIS WEEK
-                db.and_(Task.status == 'Completed', db.func.date(Task.completed_at) >= week_start, db.func.date(Task.completed_at) <= week_end)
+                db.and_(Task.status == 'Completed', between_days(Task.completed_at, week_start, week_end))
             )
         )
     elif filter_period == 'month':
-        month_start = today.replace(day=1)
-        if today.month == 12:
-            month_end = today.replace(day=31)
-        else:
-            month_end = (today.replace(month=today.month + 1, day=1) - timedelta(days=1))
+        month_start, month_end = month_bounds(today)
         tasks_query = tasks_query.filter(
             db.or_(
-                db.and_(db.func.date(Task.due_date) >= month_start, db.func.date(Task.due_date) <= month_end),
-                db.and_(db.func.date(Task.planned_start_date) >= month_start, db.func.date(Task.planned_start_date) <= month_end),
+                between_days(Task.due_date, month_start, month_end),
+                between_days(Task.planned_start_date, month_start, month_end),
                 Task.status.in_(['In Progress', 'In Review']),
                 overdue_condition,
                 # Show completed tasks if completed THIS MONTH
-                db.and_(Task.status == 'Completed', db.func.date(Task.completed_at) >= month_start, db.func.date(Task.completed_at) <= month_end)
+                db.and_(Task.status == 'Completed', between_days(Task.completed_at, month_start, month_end))
             )
         )
     elif filter_period == 'custom':
         custom_conditions = [overdue_condition]
-        if filter_date_from:
-            try:
-                date_from_obj = datetime.strptime(filter_date_from, '%Y-%m-%d').date()
-                custom_conditions.append(db.func.date(Task.due_date) >= date_from_obj)
-            except ValueError:
-                pass
-        if filter_date_to:
-            try:
-                date_to_obj = datetime.strptime(filter_date_to, '%Y-%m-%d').date()
-                custom_conditions.append(db.func.date(Task.due_date) <= date_to_obj)
-            except ValueError:
-                pass
+        date_from_obj = _parse_date(filter_date_from)
+        if date_from_obj:
+            custom_conditions.append(Task.due_date >= datetime.combine(date_from_obj, time.min))
+        date_to_obj = _parse_date(filter_date_to)
+        if date_to_obj:
+            custom_conditions.append(before_day(Task.due_date, date_to_obj + timedelta(days=1)))
         
         # Combine conditions: (Overdue) OR (Range Match)
         if len(custom_conditions) > 1:
@@ -363,26 +573,27 @@ def dashboard():
         else:
             # Only overdue condition remains if dates were invalid
             tasks_query = tasks_query.filter(overdue_condition)
-    status_order = db.case(
-        (Task.status == 'In Progress', 0),
-        (Task.status == 'In Review', 1),
-        (Task.status == 'Pending', 2),
-        (Task.status == 'Completed', 3),
-        else_=4
-    )
-    
-    # Pagination: limit initial load for performance
+    # Pagination: limit initial load for performance. "Load more" grows
+    # ?limit by one page per click; capped so a large value can't load
+    # every task at once
     TASKS_PER_PAGE = 30
-    limit = int(request.args.get('limit', TASKS_PER_PAGE))
+    MAX_TASKS = 200
+    limit = request.args.get('limit', TASKS_PER_PAGE, type=int)
+    limit = min(max(limit, 1), MAX_TASKS)
     
     if sort_order == 'desc':
-        tasks_query = tasks_query.order_by(status_order, Task.due_date.desc())
+        tasks_query = tasks_query.order_by(Task.status_code, Task.due_date.desc())
     else:
-        tasks_query = tasks_query.order_by(status_order, Task.due_date.asc())
+        tasks_query = tasks_query.order_by(Task.status_code, Task.due_date.asc())
     
     # Get total count before pagination
-    total_tasks = tasks_query.count()
-    tasks = tasks_query.limit(limit).all()
+    if can_see_any_task():
+        total_tasks = tasks_query.count()
+        tasks = tasks_query.limit(limit).all()
+    else:
+        # No areas assigned: nothing is visible, skip the queries
+        total_tasks = 0
+        tasks = []
     has_more = limit < total_tasks
     
     today = date.today()
@@ -395,9 +606,9 @@ def dashboard():
         all_tags = Tag.query.order_by(Tag.name).all()
     else:
         # Non-admins see only users and tags in their areas
-        users = [u for u in User.query.all() if any(area in u.areas for area in current_user.areas)]
+        users = users_in_areas(get_user_area_ids()).all()
         all_areas = current_user.areas
-        user_area_ids = [a.id for a in current_user.areas]
+        user_area_ids = get_user_area_ids()
         if user_area_ids:
             # Strict area filter - only show tags from user's areas
             all_tags = Tag.query.filter(Tag.area_id.in_(user_area_ids)).order_by(Tag.name).all()
@@ -424,6 +635,7 @@ def dashboard():
         filter_creator=filter_creator,
         # Pagination
         has_more=has_more,
+        limit_reached=has_more and limit >= MAX_TASKS,
         total_tasks=total_tasks,
         current_limit=limit,
     )
@@ -431,9 +643,6 @@ def dashboard():
 @main_bp.route('/task/new', methods=['GET', 'POST'])
 @login_required
 def create_task():
-    # Import Area model
-    from models import Area
-    
     # --- CHECK PERMISSION TO CREATE TASKS ---
     if not current_user.can_create_tasks():
         flash('No tienes permiso para crear tareas. Usa el calendario de vencimientos para crear recordatorios.', 'danger')
@@ -469,7 +678,7 @@ def create_task():
         available_areas = current_user.areas if current_user.areas else []
         # Only see users in their areas
         if available_areas:
-            users = [u for u in User.query.all() if any(area in u.areas for area in available_areas)]
+            users = users_in_areas(available_areas).all()
             # Filter tags and templates by area
             user_area_ids = [a.id for a in available_areas]
             available_tags = Tag.query.filter(Tag.area_id.in_(user_area_ids)).order_by(Tag.name).all()
@@ -573,18 +782,14 @@ def create_task():
             except (ValueError, TypeError):
                 pass
         
-        # Add assignees
-        for user_id in assignee_ids:
-            user = User.query.get(int(user_id))
-            if user:
-                new_task.assignees.append(user)
-
-        # Add tags
+        # Add assignees and tags (one IN query each; unknown ids are skipped).
+        # new_task is not in the session yet, so don't autoflush it here.
         tag_ids = request.form.getlist('tags')
-        for tag_id in tag_ids:
-            tag = Tag.query.get(int(tag_id))
-            if tag:
-                new_task.tags.append(tag)
+        with db.session.no_autoflush:
+            if assignee_ids:
+                new_task.assignees = User.query.filter(User.id.in_([int(uid) for uid in assignee_ids])).all()
+            if tag_ids:
+                new_task.tags = Tag.query.filter(Tag.id.in_([int(tid) for tid in tag_ids])).all()
         
         # Handle parent task selection and dependency blocking
         parent_id_str = request.form.get('parent_id')
@@ -635,6 +840,17 @@ def create_task():
         index_to_subtask = {}
         subtasks_created = 0
         
+        # Load every subtask assignee up front instead of one query per subtask
+        subtask_assignee_ids = set()
+        for uid in subtask_assignees:
+            try:
+                subtask_assignee_ids.add(int(uid))
+            except (ValueError, TypeError):
+                pass
+        subtask_assignee_map = {
+            u.id: u for u in User.query.filter(User.id.in_(subtask_assignee_ids)).all()
+        } if subtask_assignee_ids else {}
+        
         for i, title in enumerate(subtask_titles):
             if title.strip():  # Only create if title is not empty
                 # Get description (or default)
@@ -690,7 +906,7 @@ def create_task():
                 # Assign user if specified
                 if i < len(subtask_assignees) and subtask_assignees[i]:
                     try:
-                        assignee = User.query.get(int(subtask_assignees[i]))
+                        assignee = subtask_assignee_map.get(int(subtask_assignees[i]))
                         if assignee:
                             subtask.assignees.append(assignee)
                     except (ValueError, TypeError):
@@ -754,7 +970,7 @@ def create_task():
         return redirect(url_for('main.dashboard'))
         
     # Get available processes for the user
-    user_area_ids = [a.id for a in current_user.areas]
+    user_area_ids = get_user_area_ids()
     if current_user.is_admin:
         available_processes = Process.query.filter_by(status='Active').order_by(Process.name).all()
     elif user_area_ids:
@@ -770,8 +986,6 @@ def create_task():
 @main_bp.route('/task/<int:task_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_task(task_id):
-    from models import Area
-    
     task = Task.query.get_or_404(task_id)
     
     # Verify user has access to this task (either creator or assignee)
@@ -788,10 +1002,10 @@ def edit_task(task_id):
         available_areas = Area.query.order_by(Area.name).all()
     else:
         # Filter users by area (assignees)
-        users = [u for u in User.query.all() if any(area in u.areas for area in current_user.areas)]
+        users = users_in_areas(get_user_area_ids()).all()
         
         # Filter tags by area
-        user_area_ids = [a.id for a in current_user.areas]
+        user_area_ids = get_user_area_ids()
         if user_area_ids:
              available_tags = Tag.query.filter(Tag.area_id.in_(user_area_ids)).order_by(Tag.name).all()
         else:
@@ -884,11 +1098,10 @@ def edit_task(task_id):
         # Update assignees - Admin and Supervisors
         if current_user.is_admin or current_user.role == 'supervisor':
             assignee_ids = request.form.getlist('assignees')
-            task.assignees = [] # Clear current assignees
-            for user_id in assignee_ids:
-                user = User.query.get(int(user_id))
-                if user:
-                    task.assignees.append(user)
+            # Replace current assignees (one IN query; unknown ids are skipped)
+            task.assignees = User.query.filter(
+                User.id.in_([int(uid) for uid in assignee_ids])
+            ).all() if assignee_ids else []
         
         # Update area - ONLY if user is admin
         if current_user.is_admin:
@@ -901,11 +1114,9 @@ def edit_task(task_id):
 
         # Update tags
         tag_ids = request.form.getlist('tags')
-        task.tags = [] # Clear current tags
-        for tag_id in tag_ids:
-            tag = Tag.query.get(int(tag_id))
-            if tag:
-                task.tags.append(tag)
+        task.tags = Tag.query.filter(
+            Tag.id.in_([int(tid) for tid in tag_ids])
+        ).all() if tag_ids else []
         
         # Handle parent task selection (with circular reference prevention)
         parent_id_str = request.form.get('parent_id')
@@ -915,7 +1126,7 @@ def edit_task(task_id):
                 # Prevent circular reference: task cannot be its own parent
                 if parent_id != task.id:
                     # Prevent circular reference: parent cannot be a descendant
-                    if not is_descendant(task.id, parent_id):
+                    if parent_id not in get_descendant_ids(task.id):
                         parent_task = Task.query.get(parent_id)
                         if parent_task:
                             task.parent_id = parent_id
@@ -947,38 +1158,36 @@ def edit_task(task_id):
         task.last_edited_at = now_utc()
         
         # Handle child tasks assignment
+        # Children are re-parented with set-based UPDATEs (one per direction)
         child_ids_str = request.form.get('child_ids', '')
-        if child_ids_str:
-            try:
-                child_ids = [int(id.strip()) for id in child_ids_str.split(',') if id.strip()]
-                # Get current children IDs
-                current_child_ids = [c.id for c in task.children]
-                
-                # Update children - set parent_id for new children
-                for child_id in child_ids:
-                    if child_id != task.id and child_id not in current_child_ids:
-                        child_task = Task.query.get(child_id)
-                        if child_task and not is_descendant(child_id, task.id):
-                            child_task.parent_id = task.id
-                
-                # Remove parent_id from children that were removed
-                for current_child_id in current_child_ids:
-                    if current_child_id not in child_ids:
-                        child_task = Task.query.get(current_child_id)
-                        if child_task:
-                            child_task.parent_id = None
-            except (ValueError, TypeError):
-                pass  # Invalid child_ids, ignore
-        else:
-            # Clear all children if no child_ids provided
-            for child in task.children:
-                child.parent_id = None
+        try:
+            child_ids = {int(id.strip()) for id in child_ids_str.split(',') if id.strip()}
+        except (ValueError, TypeError):
+            child_ids = None  # Invalid child_ids, ignore
+        if child_ids is not None:
+            current_child_ids = {c.id for c in task.children}
+            
+            # Set parent_id for new children. A task's ancestors can't become
+            # its children (would create a cycle)
+            to_add = child_ids - current_child_ids - {task.id}
+            if to_add:
+                to_add -= get_ancestor_ids(task.id)
+            if to_add:
+                Task.query.filter(Task.id.in_(to_add)).update(
+                    {Task.parent_id: task.id}, synchronize_session=False
+                )
+            
+            # Remove parent_id from children that were removed
+            to_remove = current_child_ids - child_ids
+            if to_remove:
+                Task.query.filter(Task.id.in_(to_remove)).update(
+                    {Task.parent_id: None}, synchronize_session=False
+                )
 
         db.session.commit()
         
         # Log activity
         # Log activity with diff
-        import json
         changes = []
         
         if old_state['title'] != task.title:
@@ -1031,7 +1240,9 @@ def edit_task(task_id):
         
         return redirect(url_for('main.dashboard'))
         
-    return render_template('edit_task.html', task=task, users=users, available_tags=available_tags, available_areas=available_areas)
+    # Id sets so the template's "checked" tests are O(1) per user/tag
+    return render_template('edit_task.html', task=task, users=users, available_tags=available_tags, available_areas=available_areas,
+                           assignee_ids={u.id for u in task.assignees}, task_tag_ids={t.id for t in task.tags})
 
 @main_bp.route('/task/<int:task_id>')
 @login_required
@@ -1074,7 +1285,6 @@ def task_details(task_id):
         action='task_edited'
     ).all()
     
-    import json
     for log in edit_logs:
         details = {}
         if log.details:
@@ -1192,14 +1402,12 @@ def task_details(task_id):
 @login_required
 def task_tree():
     """Display all tasks in a hierarchical tree view"""
-    from models import Area
-    
     # Get filter parameters (same as dashboard)
     filter_assignee = request.args.get('assignee')
     filter_creator = request.args.get('creator')
     filter_status = request.args.get('status', '')
     filter_tag = request.args.get('tag_filter')
-    filter_area = request.args.get('area')
+    filter_area = request.args.get('area', type=int)
     sort_order = request.args.get('sort', 'asc')
     search_query = request.args.get('q', '')
     
@@ -1211,42 +1419,25 @@ def task_tree():
     ).filter(Task.parent_id == None)
     
     # --- ROLE-BASED VISIBILITY FILTERING ---
-    user_area_ids = [a.id for a in current_user.areas]
-    
+    user_area_ids = get_user_area_ids()
+    query = apply_visibility(query)
     if current_user.can_only_see_own_tasks():
-        # Users can only see tasks they are assigned to OR created
-        if user_area_ids:
-            query = query.filter(
-                db.or_(
-                    Task.assignees.any(id=current_user.id),
-                    Task.creator_id == current_user.id
-                )
-            ).filter(Task.area_id.in_(user_area_ids))
-        else:
-            query = query.filter(Task.area_id == -1)
         available_areas = current_user.areas
         show_area_filter = False
     elif current_user.can_see_all_areas():
         # Gerentes/admins see all tasks
-        if filter_area:
-            query = query.filter(Task.area_id == int(filter_area))
+        query = apply_area_filter(query, filter_area)
         available_areas = Area.query.order_by(Area.name).all()
         show_area_filter = True
     else:
-        # Supervisors see all tasks in their areas
-        if user_area_ids:
-            query = query.filter(Task.area_id.in_(user_area_ids))
-            # Allow supervisor to filter by specific area if they have multiple
-            if filter_area and int(filter_area) in user_area_ids:
-                query = query.filter(Task.area_id == int(filter_area))
-        else:
-            query = query.filter(Task.area_id == -1)
+        # Supervisors see all tasks in their areas, optionally narrowed to one
+        query = apply_area_filter(query, filter_area)
         available_areas = current_user.areas
         show_area_filter = len(current_user.areas) > 1
 
     # Apply assignee filter
     if filter_assignee:
-        query = query.filter(Task.assignees.any(id=filter_assignee))
+        query = query.filter(assigned_to(filter_assignee))
     
     # Apply creator filter
     if filter_creator:
@@ -1257,11 +1448,11 @@ def task_tree():
         if filter_status in ['Pending', 'Completed', 'Anulado']:
             query = query.filter(Task.status == filter_status)
     else:
-        query = query.filter(Task.status != 'Anulado')
+        query = query.filter(Task.status.in_(ACTIVE_STATUSES))
     
     # Apply tag filter
     if filter_tag:
-        query = query.filter(Task.tags.any(id=int(filter_tag)))
+        query = query.filter(tagged_with(filter_tag))
     
     # Apply search filter
     if search_query:
@@ -1271,36 +1462,52 @@ def task_tree():
             (Task.description.ilike(search_term))
         )
     
-    # Sort by status first (Pending before Completed), then by due_date
-    status_order = db.case(
-        (Task.status == 'Pending', 0),
-        (Task.status == 'Completed', 1),
-        else_=2
-    )
+    # Pagination: limit root tasks loaded (same "load more" scheme as dashboard)
+    # "Load more" grows ?limit by one page per click; capped so a large
+    # value can't load the whole tree at once
+    ROOT_TASKS_PER_PAGE = 30
+    MAX_ROOT_TASKS = 200
+    limit = request.args.get('limit', ROOT_TASKS_PER_PAGE, type=int)
+    limit = min(max(limit, 1), MAX_ROOT_TASKS)
     
+    # Sort by status first (precomputed status_code), then by due_date
     if sort_order == 'desc':
-        root_tasks = query.order_by(status_order, Task.due_date.desc()).all()
+        query = query.order_by(Task.status_code, Task.due_date.desc(), Task.id)
     else:
-        root_tasks = query.order_by(status_order, Task.due_date.asc()).all()
+        query = query.order_by(Task.status_code, Task.due_date.asc(), Task.id)
+    
+    if not can_see_any_task():
+        # No areas assigned: nothing is visible, skip the query
+        root_tasks = []
+    else:
+        # One extra row tells whether there is a next page, without a COUNT
+        root_tasks = query.limit(limit + 1).all()
+    has_more = len(root_tasks) > limit
+    root_tasks = root_tasks[:limit]
     
     # Get counts for stats - FILTERED BY AREA
-    stats_query_base = Task.query.filter(Task.status != 'Anulado')
+    # All three come from a single scan with conditional counts
+    child = db.aliased(Task)
+    parent_ids = db.select(child.parent_id).where(child.parent_id.isnot(None))
+    stats_query = db.session.query(
+        db.func.count(Task.id),
+        db.func.count(db.case((Task.id.in_(parent_ids), 1))),
+        db.func.count(db.case((Task.parent_id.isnot(None), 1)))
+    ).filter(Task.status.in_(ACTIVE_STATUSES))
     if not current_user.is_admin:
-        if user_area_ids:
-            stats_query_base = stats_query_base.filter(Task.area_id.in_(user_area_ids))
-        else:
-            stats_query_base = stats_query_base.filter(Task.area_id == -1)
+        stats_query = stats_query.filter(Task.area_id.in_(user_area_ids))
     
-    total_tasks = stats_query_base.count()
-    tasks_with_children = stats_query_base.filter(Task.children.any()).count()
-    tasks_with_parent = stats_query_base.filter(Task.parent_id != None).count()
+    if current_user.is_admin or user_area_ids:
+        total_tasks, tasks_with_children, tasks_with_parent = stats_query.one()
+    else:
+        total_tasks = tasks_with_children = tasks_with_parent = 0
     
     # Get users and tags for filter dropdowns - FILTERED BY AREA
     if current_user.is_admin:
         users = User.query.all()
         all_tags = Tag.query.order_by(Tag.name).all()
     else:
-        users = [u for u in User.query.all() if any(area in u.areas for area in current_user.areas)]
+        users = users_in_areas(get_user_area_ids()).all()
         # Strict filter - only tags from user's areas
         if user_area_ids:
             all_tags = Tag.query.filter(Tag.area_id.in_(user_area_ids)).order_by(Tag.name).all()
@@ -1309,6 +1516,8 @@ def task_tree():
     
     return render_template('task_tree.html', 
                            root_tasks=root_tasks,
+                           has_more=has_more,
+                           limit_reached=has_more and limit >= MAX_ROOT_TASKS,
                            filter_status=filter_status,
                            filter_assignee=filter_assignee,
                            filter_creator=filter_creator,
@@ -1324,142 +1533,92 @@ def task_tree():
                            all_areas=available_areas,
                            show_area_filter=show_area_filter)
 
+# Month names in Spanish, indexed by month number (used by both calendars)
+_MONTH_NAMES_ES = ('', 'Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio',
+                   'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre')
+# Month grid builder shared by both calendars (weeks start on Monday); it
+# holds no per-call state, so one instance serves every request
+_CALENDAR_GRID = cal.Calendar(firstweekday=0)
+
+
+@lru_cache(maxsize=512)
+def _month_grid(year, month):
+    """
+    Weeks (7 dates each, Monday first) shown for year/month. Pure, so it's
+    memoized across requests; tuples so the cached grid can't be mutated.
+    """
+    return tuple(tuple(week) for week in _CALENDAR_GRID.monthdatescalendar(year, month))
+
+
 @main_bp.route('/calendar')
 @login_required
 def calendar():
-    from models import Area
-    
     # Get filter parameters
     period = request.args.get('period', 'all')  # today, week, month, all
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
     filter_user = request.args.get('creator')  # Keep 'creator' param name for backward compatibility
-    filter_area = request.args.get('area')
+    filter_area = request.args.get('area', type=int)
     
     # Base query: show ALL tasks by default (matching dashboard behavior)
     # Only show ENABLED tasks (not blocked by parent dependency)
     query = Task.query.options(joinedload(Task.assignees), joinedload(Task.tags)).filter(Task.enabled == True)
     
     # Exclude 'Anulado' tasks by default
-    query = query.filter(Task.status != 'Anulado')
+    query = query.filter(Task.status.in_(ACTIVE_STATUSES))
     
     # --- ROLE-BASED VISIBILITY FILTERING ---
-    user_area_ids = [a.id for a in current_user.areas]
-    
+    query = apply_visibility(query)
     if current_user.can_only_see_own_tasks():
-        # Users can only see tasks they are assigned to OR created
-        if user_area_ids:
-            query = query.filter(
-                db.or_(
-                    Task.assignees.any(id=current_user.id),
-                    Task.creator_id == current_user.id
-                )
-            ).filter(Task.area_id.in_(user_area_ids))
-        else:
-            query = query.filter(Task.area_id == -1)
         available_areas = current_user.areas
         show_area_filter = False
     elif current_user.can_see_all_areas():
         # Gerentes/admins see all tasks
-        if filter_area:
-            query = query.filter(Task.area_id == int(filter_area))
+        query = apply_area_filter(query, filter_area)
         available_areas = Area.query.order_by(Area.name).all()
         show_area_filter = True
     else:
-        # Supervisors see all tasks in their areas
-        if user_area_ids:
-            query = query.filter(Task.area_id.in_(user_area_ids))
-            # Allow supervisor to filter by specific area if they have multiple
-            if filter_area and int(filter_area) in user_area_ids:
-                query = query.filter(Task.area_id == int(filter_area))
-        else:
-            query = query.filter(Task.area_id == -1)
+        # Supervisors see all tasks in their areas, optionally narrowed to one
+        query = apply_area_filter(query, filter_area)
         available_areas = current_user.areas
         show_area_filter = len(current_user.areas) > 1
 
     # Filter by user (assignee) if selected
     if filter_user:
-        query = query.filter(Task.assignees.any(id=filter_user))
+        query = query.filter(assigned_to(filter_user))
     
     # Apply date filters
     today = date.today()
     
+    # Date range of the task list (None = no date filter)
+    list_start = list_end = None
     if period == 'today':
-        query = query.filter(db.func.date(Task.due_date) == today)
+        list_start = list_end = today
     elif period == 'week':
-        week_start = today - timedelta(days=today.weekday())
-        week_end = week_start + timedelta(days=6)
-        query = query.filter(db.func.date(Task.due_date) >= week_start,
-                           db.func.date(Task.due_date) <= week_end)
+        list_start = today - timedelta(days=today.weekday())
+        list_end = list_start + timedelta(days=6)
     elif period == 'month':
-        month_start = today.replace(day=1)
-        # Get last day of month
-        if today.month == 12:
-            month_end = today.replace(day=31)
-        else:
-            month_end = (today.replace(month=today.month + 1, day=1) - timedelta(days=1))
-        query = query.filter(db.func.date(Task.due_date) >= month_start,
-                           db.func.date(Task.due_date) <= month_end)
+        list_start, list_end = month_bounds(today)
     elif start_date_str and end_date_str:
         # Custom date range
-        start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
-        end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-        query = query.filter(db.func.date(Task.due_date) >= start_date,
-                           db.func.date(Task.due_date) <= end_date)
+        list_start = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        list_end = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+    if list_start:
+        query = query.filter(between_days(Task.due_date, list_start, list_end))
     # Only load the task list when a specific filter is active (not default 'all')
     # This avoids loading ALL tasks on every calendar page load
     show_task_list = period != 'all' or (start_date_str and end_date_str)
-    
-    if show_task_list:
-        tasks = query.order_by(Task.due_date.asc()).all()
-    else:
-        tasks = []
+    # Users without areas can't see anything: skip every task query below
+    sees_tasks = can_see_any_task()
     
     # Filter users by area (same logic as dashboard)
     if current_user.can_see_all_areas():
         users = User.query.all()
     else:
         # Non-admins see only users in their areas
-        users = [u for u in User.query.all() if any(area in u.areas for area in current_user.areas)]
-    
-    # Get event dates for calendar widget (dates with tasks the user can see)
-    month_start = today.replace(day=1)
-    if today.month == 12:
-        month_end = today.replace(day=31)
-    else:
-        month_end = (today.replace(month=today.month + 1, day=1) - timedelta(days=1))
-    
-    # Build event_dates query with same visibility rules as main query
-    event_dates_query = db.session.query(db.func.date(Task.due_date)).filter(
-        Task.enabled == True,
-        Task.status != 'Anulado',
-        db.func.date(Task.due_date) >= month_start,
-        db.func.date(Task.due_date) <= month_end
-    )
-    
-    # Apply same visibility filtering to event_dates
-    if current_user.can_only_see_own_tasks():
-        if user_area_ids:
-            event_dates_query = event_dates_query.filter(
-                db.or_(
-                    Task.assignees.any(id=current_user.id),
-                    Task.creator_id == current_user.id
-                )
-            ).filter(Task.area_id.in_(user_area_ids))
-        else:
-            event_dates_query = event_dates_query.filter(Task.area_id == -1)
-    elif not current_user.can_see_all_areas():
-        # Supervisors see all tasks in their area
-        if user_area_ids:
-            event_dates_query = event_dates_query.filter(Task.area_id.in_(user_area_ids))
-        else:
-            event_dates_query = event_dates_query.filter(Task.area_id == -1)
-    
-    event_dates = [d[0].strftime('%Y-%m-%d') for d in event_dates_query.distinct().all() if d[0]]
+        users = users_in_areas(get_user_area_ids()).all()
     
     # --- CALENDAR GRID GENERATION ---
-    import calendar as cal
-    
     # Get month/year from query params or use current month
     view_year = int(request.args.get('year', today.year))
     view_month = int(request.args.get('month', today.month))
@@ -1476,54 +1635,73 @@ def calendar():
         next_month, next_year = view_month + 1, view_year
     
     # Generate calendar weeks (list of 7-day lists)
-    cal_obj = cal.Calendar(firstweekday=0)  # Monday = 0
-    month_days = cal_obj.monthdatescalendar(view_year, view_month)
+    month_days = _month_grid(view_year, view_month)
     
     # Get tasks for the visible calendar range (includes prev/next month day spillover)
-    if month_days:
+    if month_days and sees_tasks:
         cal_start = month_days[0][0]
         cal_end = month_days[-1][-1]
         
         # Query tasks within calendar view range
         cal_tasks_query = Task.query.options(joinedload(Task.assignees), joinedload(Task.tags)).filter(
             Task.enabled == True,
-            Task.status != 'Anulado',
-            db.func.date(Task.due_date) >= cal_start,
-            db.func.date(Task.due_date) <= cal_end
+            Task.status.in_(ACTIVE_STATUSES),
+            between_days(Task.due_date, cal_start, cal_end)
         )
         
         # Apply same visibility filters
-        if current_user.can_only_see_own_tasks():
-            if user_area_ids:
-                cal_tasks_query = cal_tasks_query.filter(
-                    db.or_(
-                        Task.assignees.any(id=current_user.id),
-                        Task.creator_id == current_user.id
-                    )
-                ).filter(Task.area_id.in_(user_area_ids))
-            else:
-                cal_tasks_query = cal_tasks_query.filter(Task.area_id == -1)
-        elif not current_user.can_see_all_areas():
-            if user_area_ids:
-                cal_tasks_query = cal_tasks_query.filter(Task.area_id.in_(user_area_ids))
-            else:
-                cal_tasks_query = cal_tasks_query.filter(Task.area_id == -1)
+        cal_tasks_query = apply_visibility(cal_tasks_query)
         
-        cal_tasks = cal_tasks_query.all()
+        cal_tasks = cal_tasks_query.order_by(Task.due_date).all()
     else:
         cal_tasks = []
     
-    # Group tasks by date
-    tasks_by_date = {}
-    for task in cal_tasks:
-        date_key = task.due_date.date().isoformat()
-        if date_key not in tasks_by_date:
-            tasks_by_date[date_key] = []
-        tasks_by_date[date_key].append(task)
+    # The grid query uses the same base filters as the list (enabled, active,
+    # visibility). Without area/user filters and with the list range inside
+    # the grid range, the list is a subset of cal_tasks: reuse those rows.
+    grid_covers_list = (
+        month_days and list_start is not None
+        and not filter_user and not filter_area
+        and month_days[0][0] <= list_start and list_end <= month_days[-1][-1]
+    )
+    if not (show_task_list and sees_tasks):
+        tasks = []
+    elif grid_covers_list:
+        # cal_tasks is already ordered by due_date
+        tasks = [t for t in cal_tasks if list_start <= t.due_date.date() <= list_end]
+    else:
+        tasks = query.order_by(Task.due_date.asc()).all()
     
-    # Month names in Spanish
-    month_names = ['', 'Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio',
-                   'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre']
+    # Get event dates for calendar widget (dates with tasks the user can see)
+    month_start, month_end = month_bounds(today)
+    
+    if not sees_tasks:
+        event_dates = []
+    elif month_days and month_days[0][0] <= month_start and month_end <= month_days[-1][-1]:
+        # The grid already loaded every visible task of the current month
+        # (same filters): derive the dates from it instead of querying again
+        event_dates = sorted({
+            t.due_date.date().isoformat() for t in cal_tasks
+            if month_start <= t.due_date.date() <= month_end
+        })
+    else:
+        # Build event_dates query with same visibility rules as main query.
+        # One DISTINCT day per row; the range filter stays on the bare
+        # due_date so the index can still be used
+        event_day = db.func.date(Task.due_date, type_=db.Date)
+        event_dates_query = db.session.query(event_day).filter(
+            Task.enabled == True,
+            Task.status.in_(ACTIVE_STATUSES),
+            between_days(Task.due_date, month_start, month_end)
+        )
+        
+        # Apply same visibility filtering to event_dates
+        event_dates_query = apply_visibility(event_dates_query)
+        
+        event_dates = [d.isoformat() for (d,) in event_dates_query.distinct().order_by(event_day)]
+    
+    # Group tasks by date
+    tasks_by_date = group_by_due_day(cal_tasks)
     
     return render_template('calendar.html', 
                           tasks=tasks, 
@@ -1538,7 +1716,7 @@ def calendar():
                           calendar_weeks=month_days,
                           view_month=view_month,
                           view_year=view_year,
-                          month_name=month_names[view_month],
+                          month_name=_MONTH_NAMES_ES[view_month],
                           prev_month=prev_month,
                           prev_year=prev_year,
                           next_month=next_month,
@@ -1546,6 +1724,32 @@ def calendar():
                           tasks_by_date=tasks_by_date)
 
 
+def enable_children(task, now=None):
+    """
+    Unblock the disabled children of a completed task, with set-based
+    UPDATEs instead of loading and modifying each child.
+    Children whose due_date already passed are moved to now (keeping
+    original_due_date). Pass now to share the caller's timestamp.
+    Returns (enabled_count, adjusted_dates_count).
+    """
+    now = now or now_utc()
+    blocked_children = Task.query.filter(Task.parent_id == task.id, Task.enabled == False)
+    
+    # Adjust overdue dates first, while the children are still disabled
+    adjusted_dates_count = blocked_children.filter(before_day(Task.due_date, date.today())).update(
+        {Task.original_due_date: Task.due_date, Task.due_date: now},
+        synchronize_session=False
+    )
+    enabled_count = blocked_children.update(
+        {Task.enabled: True, Task.enabled_at: now, Task.enabled_by_task_id: task.id},
+        synchronize_session=False
+    )
+    # Children already loaded in the session must not keep stale values
+    for child in task.__dict__.get('children', ()):
+        db.session.expire(child)
+    return enabled_count, adjusted_dates_count
+
+
 @main_bp.route('/task/<int:task_id>/toggle', methods=['POST'])
 @login_required
 def toggle_task_status(task_id):
@@ -1553,36 +1757,24 @@ def toggle_task_status(task_id):
     old_status = task.status
     
     # Verify user has access to this task (admin, creator, or assignee)
-    if not current_user.is_admin and task.creator_id != current_user.id and current_user not in task.assignees:
+    if not current_user.is_admin and task.creator_id != current_user.id and not is_task_assignee(task):
         return jsonify({'success': False, 'error': 'Acceso denegado'}), 403
     
     # Get optional completion comment from request body
-    data = request.get_json(silent=True) or {}
-    completion_comment = data.get('comment', '').strip() if data else ''
+    completion_comment = ((request.get_json(silent=True) or {}).get('comment') or '').strip()
     
     # Toggle status and track completion
     if task.status != 'Completed':
         task.status = 'Completed'
         task.completed_by_id = current_user.id
-        task.completed_at = now_utc()
+        now = now_utc()
+        task.completed_at = now
         task.completion_comment = completion_comment if completion_comment else None
         
         # Enable child tasks when parent is completed
-        enabled_children_count = 0
-        adjusted_dates_count = 0
-        for child in task.children:
-            if not child.enabled:
-                child.enabled = True
-                child.enabled_at = now_utc()
-                child.enabled_by_task_id = task.id
-                enabled_children_count += 1
-                
-                # If the child's due_date has already passed, adjust it to today
-                if child.due_date.date() < date.today():
-                    child.original_due_date = child.due_date  # Save original date before adjustment
-                    child.due_date = now_utc()
-                    adjusted_dates_count += 1
-        
+        enabled_children_count, adjusted_dates_count = enable_children(task, now)
+        if enabled_children_count > 0:
+            msg = f'Se habilitaron {enabled_children_count} subtarea(s).'
             if adjusted_dates_count > 0:
                 msg += f' Se ajustó la fecha de vencimiento de {adjusted_dates_count} tarea(s) que ya habían vencido.'
             flash(msg, 'info')
@@ -1672,6 +1864,9 @@ def anular_task(task_id):
 
 # Valid status values and transitions
 VALID_STATUSES = ['Pending', 'In Progress', 'In Review', 'Completed', 'Anulado', 'Scheduled']
+# Every status except 'Anulado'. Filtering with IN on this list (instead of
+# status != 'Anulado') lets the database use the status index.
+ACTIVE_STATUSES = tuple(s for s in VALID_STATUSES if s != 'Anulado')
 STATUS_LABELS = {
     'Pending': 'Pendiente',
     'In Progress': 'En Proceso',
@@ -1694,14 +1889,13 @@ def can_change_task_status(user, task, new_status):
     
     # Supervisor can change any task in their area
     if user.role == 'supervisor':
-        user_area_ids = [a.id for a in user.areas]
-        if task.area_id in user_area_ids:
+        if task.area_id in get_user_area_ids(user):
             return True, None
         return False, "Solo puedes modificar tareas de tu área"
     
     # Usuario+ can change status on their own tasks
     if user.role == 'usuario_plus':
-        if user in task.assignees or task.creator_id == user.id:
+        if task.creator_id == user.id or is_task_assignee(task, user):
             # Can move to any active status
             if new_status in ['Pending', 'In Progress', 'In Review', 'Completed']:
                 return True, None
@@ -1710,7 +1904,7 @@ def can_change_task_status(user, task, new_status):
 
     # Usuario can change status on their own tasks
     if user.role == 'usuario':
-        if user in task.assignees or task.creator_id == user.id:
+        if task.creator_id == user.id or is_task_assignee(task, user):
             # Can move to any active status
             if new_status in ['Pending', 'In Progress', 'In Review', 'Completed']:
                 return True, None
@@ -1728,7 +1922,8 @@ def update_task_status(task_id):
     Expects JSON: { "status": "In Progress" }
     """
     task = Task.query.get_or_404(task_id)
-    data = request.get_json() or {}
+    # silent: malformed JSON falls through to the 'Estado invalido' response
+    data = request.get_json(silent=True) or {}
     new_status = data.get('status')
     
     if not new_status or new_status not in VALID_STATUSES:
@@ -1751,18 +1946,20 @@ def update_task_status(task_id):
         return jsonify({'success': False, 'error': error_msg}), 403
     
     old_status = task.status
+    # One timestamp for every field touched by this change
+    now = now_utc()
     
     # Update status and tracking fields
     task.status = new_status
     
     if new_status == 'In Progress' and not task.started_at:
-        task.started_at = now_utc()
+        task.started_at = now
         task.started_by_id = current_user.id
     elif new_status == 'In Review' and not task.in_review_at:
-        task.in_review_at = now_utc()
+        task.in_review_at = now
         task.in_review_by_id = current_user.id
     elif new_status == 'Completed' and not task.completed_at:
-        task.completed_at = now_utc()
+        task.completed_at = now
         
         # If completing from "In Review", credit goes to the person who did the work
         # and the current user (supervisor) is tracked as the approver
@@ -1771,7 +1968,7 @@ def update_task_status(task_id):
             task.completed_by_id = task.in_review_by_id
             # The current user (supervisor) approved it
             task.approved_by_id = current_user.id
-            task.approved_at = now_utc()
+            task.approved_at = now
         else:
             # Direct completion (not from review) - current user gets credit
             task.completed_by_id = current_user.id
@@ -1790,14 +1987,7 @@ def update_task_status(task_id):
             )
             
         # Enable child tasks when parent is completed
-        for child in task.children:
-            if not child.enabled:
-                child.enabled = True
-                child.enabled_at = now_utc()
-                child.enabled_by_task_id = task.id
-                if child.due_date.date() < date.today():
-                    child.original_due_date = child.due_date
-                    child.due_date = now_utc()
+        enable_children(task, now)
     elif new_status == 'Pending':
         # Reset all tracking when moving back to Pending
         task.started_at = None
@@ -1812,10 +2002,10 @@ def update_task_status(task_id):
         # 1. Update current task first
         task.status = 'Anulado'
         task.enabled = False
-        task.completed_at = now_utc()
+        task.completed_at = now
         task.completed_by_id = current_user.id
         task.last_edited_by_id = current_user.id
-        task.last_edited_at = now_utc()
+        task.last_edited_at = now
         
         # 2. Robust Cascade: Propagate to all descendants iteratively
         # We use flush() to make sure the DB sees the parent's generic state
@@ -1838,16 +2028,16 @@ def update_task_status(task_id):
             for child in orphans:
                 child.status = 'Anulado'
                 child.enabled = False
-                child.completed_at = now_utc()
+                child.completed_at = now
                 child.completed_by_id = current_user.id
                 child.last_edited_by_id = current_user.id
-                child.last_edited_at = now_utc()
+                child.last_edited_at = now
             
             # Flush changes so next iteration sees these as annulled parents
             db.session.flush()
     
     task.last_edited_by_id = current_user.id
-    task.last_edited_at = now_utc()
+    task.last_edited_at = now
     
     # Record status change
     from models import StatusTransition
@@ -1902,13 +2092,11 @@ def update_task_status(task_id):
 @login_required
 def scrum_board():
     """Scrum/Kanban board view with 4 status columns - OPTIMIZED"""
-    from models import Area
-    
     # Limit for completed tasks (performance optimization)
     COMPLETED_LIMIT = 10
     
     # Get filter parameters
-    filter_area = request.args.get('area')
+    filter_area = request.args.get('area', type=int)
     filter_assignee = request.args.get('assignee')
     filter_period = request.args.get('period', 'week')  # DEFAULT CHANGED TO 'week' for performance
     filter_date_from = request.args.get('date_from')
@@ -1956,11 +2144,7 @@ def scrum_board():
                 )
             )
         elif filter_period == 'month':
-            month_start = today.replace(day=1)
-            if today.month == 12:
-                month_end = today.replace(day=31)
-            else:
-                month_end = (today.replace(month=today.month + 1, day=1) - timedelta(days=1))
+            month_start, month_end = month_bounds(today)
             return query.filter(
                 db.or_(
                     db.and_(db.func.date(Task.due_date) >= month_start, db.func.date(Task.due_date) <= month_end),
@@ -1971,18 +2155,12 @@ def scrum_board():
             )
         elif filter_period == 'custom':
             custom_conditions = [overdue_condition]
-            if filter_date_from:
-                try:
-                    date_from_obj = datetime.strptime(filter_date_from, '%Y-%m-%d').date()
-                    custom_conditions.append(db.func.date(Task.due_date) >= date_from_obj)
-                except ValueError:
-                    pass
-            if filter_date_to:
-                try:
-                    date_to_obj = datetime.strptime(filter_date_to, '%Y-%m-%d').date()
-                    custom_conditions.append(db.func.date(Task.due_date) <= date_to_obj)
-                except ValueError:
-                    pass
+            date_from_obj = _parse_date(filter_date_from)
+            if date_from_obj:
+                custom_conditions.append(db.func.date(Task.due_date) >= date_from_obj)
+            date_to_obj = _parse_date(filter_date_to)
+            if date_to_obj:
+                custom_conditions.append(db.func.date(Task.due_date) <= date_to_obj)
             if custom_conditions:
                 return query.filter(db.or_(*custom_conditions))
         # 'all' - no date filter
@@ -1990,35 +2168,13 @@ def scrum_board():
     
     def apply_role_filter(query):
         """Apply role-based visibility filter"""
-        user_area_ids = [a.id for a in current_user.areas]
-        
+        query = apply_visibility(query)
         if current_user.can_only_see_own_tasks():
-            if user_area_ids:
-                return query.filter(
-                    db.or_(
-                        Task.assignees.any(id=current_user.id),
-                        Task.creator_id == current_user.id
-                    )
-                ).filter(Task.area_id.in_(user_area_ids))
-            else:
-                return query.filter(Task.area_id == -1)
-        elif current_user.can_see_all_areas():
-            if filter_area:
-                return query.filter(Task.area_id == int(filter_area))
             return query
-        else:
-            # Supervisor: filter by their areas, optionally narrowed to one area
-            if user_area_ids:
-                q = query.filter(Task.area_id.in_(user_area_ids))
-                if filter_area and int(filter_area) in user_area_ids:
-                    q = q.filter(Task.area_id == int(filter_area))
-                return q
-            else:
-                return query.filter(Task.area_id == -1)
-        return query
+        return apply_area_filter(query, filter_area)
     
     # Determine available areas based on role
-    user_area_ids = [a.id for a in current_user.areas]
+    user_area_ids = get_user_area_ids()
     if current_user.can_only_see_own_tasks():
         available_areas = current_user.areas
         show_area_filter = False
@@ -2038,7 +2194,7 @@ def scrum_board():
         q = apply_date_filter(q)
         q = apply_role_filter(q)
         if filter_assignee:
-            q = q.filter(Task.assignees.any(id=int(filter_assignee)))
+            q = q.filter(assigned_to(filter_assignee))
         return q
     
     # === QUERY FOR EACH COLUMN (with load more support) ===
@@ -2069,7 +2225,7 @@ def scrum_board():
     completed_query = Task.query.options(*query_options).filter(Task.status == 'Completed')
     completed_query = apply_role_filter(completed_query)
     if filter_assignee:
-        completed_query = completed_query.filter(Task.assignees.any(id=int(filter_assignee)))
+        completed_query = completed_query.filter(assigned_to(filter_assignee))
     
     # Apply date filter based on completed_at (not due_date) for completed tasks
     if filter_period == 'today':
@@ -2082,28 +2238,18 @@ def scrum_board():
             db.func.date(Task.completed_at) <= week_end
         )
     elif filter_period == 'month':
-        month_start = today.replace(day=1)
-        if today.month == 12:
-            month_end = today.replace(day=31)
-        else:
-            month_end = (today.replace(month=today.month + 1, day=1) - timedelta(days=1))
+        month_start, month_end = month_bounds(today)
         completed_query = completed_query.filter(
             db.func.date(Task.completed_at) >= month_start,
             db.func.date(Task.completed_at) <= month_end
         )
     elif filter_period == 'custom':
-        if filter_date_from:
-            try:
-                date_from_obj = datetime.strptime(filter_date_from, '%Y-%m-%d').date()
-                completed_query = completed_query.filter(db.func.date(Task.completed_at) >= date_from_obj)
-            except ValueError:
-                pass
-        if filter_date_to:
-            try:
-                date_to_obj = datetime.strptime(filter_date_to, '%Y-%m-%d').date()
-                completed_query = completed_query.filter(db.func.date(Task.completed_at) <= date_to_obj)
-            except ValueError:
-                pass
+        date_from_obj = _parse_date(filter_date_from)
+        if date_from_obj:
+            completed_query = completed_query.filter(db.func.date(Task.completed_at) >= date_from_obj)
+        date_to_obj = _parse_date(filter_date_to)
+        if date_to_obj:
+            completed_query = completed_query.filter(db.func.date(Task.completed_at) <= date_to_obj)
     # 'all' - no date filter
     
     completed_total = completed_query.count()
@@ -2129,7 +2275,7 @@ def scrum_board():
     if current_user.can_see_all_areas():
         users = User.query.order_by(User.full_name).all()
     else:
-        users = [u for u in User.query.all() if any(a in u.areas for a in current_user.areas)]
+        users = users_in_areas(get_user_area_ids()).all()
     
     return render_template('scrum_board.html',
                            tasks_by_status=tasks_by_status,
@@ -2146,59 +2292,64 @@ def scrum_board():
                            status_labels=STATUS_LABELS,
                            today=today)
 
-@main_bp.route('/export_pdf')
-@login_required
-def export_pdf():
-    from models import Area
+EXPORT_BATCH_SIZE = 500
 
-    # Re-use filter logic from dashboard
-    filter_assignee = request.args.get('assignee')
-    filter_creator = request.args.get('creator')
-    filter_status = request.args.get('status')
-    filter_area = request.args.get('area')
 
-    # Calendar specific filters
-    period = request.args.get('period')
-    start_date_str = request.args.get('start_date')
-    end_date_str = request.args.get('end_date')
+def export_counts(query):
+    """(total, completed) for the export summary, computed in SQL."""
+    return query.with_entities(
+        db.func.count(Task.id),
+        db.func.count(db.case((Task.status == 'Completed', 1)))
+    ).one()
 
-    filters = {}
 
-    # Start query
-    query = Task.query.options(joinedload(Task.assignees), joinedload(Task.tags))
+def export_rows(query):
+    """
+    Iterate the export rows in due_date order, fetched in batches of
+    EXPORT_BATCH_SIZE so the whole result is never held in memory at once.
+    Relations are loaded per batch with selectinload (joinedload collections
+    can't be combined with yield_per).
+    """
+    return query.options(
+        selectinload(Task.assignees),
+        selectinload(Task.creator),
+        selectinload(Task.completed_by)
+    ).order_by(Task.due_date.asc(), Task.id).yield_per(EXPORT_BATCH_SIZE)
+
 
-    # Apply role-based visibility filtering (same logic as dashboard)
-    if current_user.can_only_see_own_tasks():
-        user_area_ids = [area.id for area in current_user.areas]
-        if user_area_ids:
-            query = query.filter(
-                db.or_(
-                    Task.assignees.any(id=current_user.id),
-                    Task.creator_id == current_user.id
-                )
-            ).filter(Task.area_id.in_(user_area_ids))
-        else:
-            query = query.filter(Task.area_id == -1)
-    elif not current_user.can_see_all_areas():
-        # Supervisors see all tasks in their area
-        user_area_ids = [area.id for area in current_user.areas]
-        if user_area_ids:
-            query = query.filter(Task.area_id.in_(user_area_ids))
-        else:
-            query = query.filter(Task.area_id == -1)
-    # Gerentes and admins see all tasks (no additional filter)
+def _apply_task_filters(query, args, filters):
+    """
+    Apply the dashboard/calendar filter params in args to a Task query
+    (assignee, creator, area, status, period/date range, tag, search).
+    Labels for the report header are written into the filters dict.
+    Returns the filtered query.
+    """
+    filter_assignee = args.get('assignee')
+    filter_creator = args.get('creator')
+    filter_status = args.get('status')
+    filter_area = args.get('area')
+
+    # Calendar specific filters
+    period = args.get('period')
+    start_date_str = args.get('start_date')
+    end_date_str = args.get('end_date')
+
+    # Names for the report header: assignee and creator in a single query
+    user_ids = {int(uid) for uid in (filter_assignee, filter_creator) if uid and uid.isdigit()}
+    user_names = {
+        str(user_id): full_name
+        for user_id, full_name in db.session.query(User.id, User.full_name).filter(User.id.in_(user_ids))
+    } if user_ids else {}
 
     # Apply Assignee Filter (works for both calendar and dashboard)
     if filter_assignee:
-        query = query.filter(Task.assignees.any(id=filter_assignee))
-        assignee = User.query.get(filter_assignee)
-        filters['assignee_name'] = assignee.full_name if assignee else 'Desconocido'
+        query = query.filter(assigned_to(filter_assignee))
+        filters['assignee_name'] = user_names.get(filter_assignee, 'Desconocido')
 
     # Apply Creator Filter
     if filter_creator:
         query = query.filter(Task.creator_id == filter_creator)
-        creator = User.query.get(filter_creator)
-        filters['creator_name'] = creator.full_name if creator else 'Desconocido'
+        filters['creator_name'] = user_names.get(filter_creator, 'Desconocido')
         filters['creator'] = filter_creator
 
     # Apply Area Filter
@@ -2219,42 +2370,33 @@ def export_pdf():
     # Apply Date/Period Filters
     today = date.today()
     if period == 'today':
-        query = query.filter(db.func.date(Task.due_date) == today)
+        query = query.filter(between_days(Task.due_date, today))
         filters['date_range'] = f'Hoy ({today.strftime("%d/%m/%Y")})'
     elif period == 'week':
         week_start = today - timedelta(days=today.weekday())
         week_end = week_start + timedelta(days=6)
-        query = query.filter(db.func.date(Task.due_date) >= week_start,
-                           db.func.date(Task.due_date) <= week_end)
+        query = query.filter(between_days(Task.due_date, week_start, week_end))
         filters['date_range'] = 'Esta Semana'
     elif period == 'month':
-        month_start = today.replace(day=1)
-        if today.month == 12:
-            month_end = today.replace(day=31)
-        else:
-            month_end = (today.replace(month=today.month + 1, day=1) - timedelta(days=1))
-        query = query.filter(db.func.date(Task.due_date) >= month_start,
-                           db.func.date(Task.due_date) <= month_end)
+        month_start, month_end = month_bounds(today)
+        query = query.filter(between_days(Task.due_date, month_start, month_end))
         filters['date_range'] = 'Este Mes'
-    elif start_date_str and end_date_str:
-        try:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-            query = query.filter(db.func.date(Task.due_date) >= start_date,
-                               db.func.date(Task.due_date) <= end_date)
+    else:
+        start_date = _parse_date(start_date_str)
+        end_date = _parse_date(end_date_str)
+        if start_date and end_date:
+            query = query.filter(between_days(Task.due_date, start_date, end_date))
             filters['date_range'] = f"{start_date_str} a {end_date_str}"
-        except ValueError:
-            pass
-            
+
     # Tag filter
-    filter_tag = request.args.get('tag_filter')
+    filter_tag = args.get('tag_filter')
     if filter_tag:
-        query = query.filter(Task.tags.any(id=int(filter_tag)))
+        query = query.filter(tagged_with(filter_tag))
         tag = Tag.query.get(int(filter_tag))
         filters['tag'] = tag.name if tag else ''
 
     # Search filter
-    search_query = request.args.get('q')
+    search_query = args.get('q')
     if search_query:
         search_term = f"%{search_query}%"
         query = query.filter(
@@ -2262,162 +2404,67 @@ def export_pdf():
             (Task.description.ilike(search_term))
         )
         filters['search'] = search_query
-        
-    tasks = query.order_by(Task.due_date.asc()).all()
-    
-    pdf = generate_task_pdf(tasks, filters)
-    
-    response = make_response(pdf.output(dest='S').encode('latin-1'))
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename=reporte_tareas_{date.today()}.pdf'
-    
-    return response
-
-@main_bp.route('/export_excel')
-@login_required
-def export_excel():
-    from models import Area
 
-    # Re-use filter logic from dashboard (same as export_pdf)
-    filter_assignee = request.args.get('assignee')
-    filter_creator = request.args.get('creator')
-    filter_status = request.args.get('status')
-    filter_area = request.args.get('area')
+    return query
 
-    # Calendar specific filters
-    period = request.args.get('period')
-    start_date_str = request.args.get('start_date')
-    end_date_str = request.args.get('end_date')
 
+def _build_export_query(args):
+    """Visible tasks matching args, for export_pdf/export_excel. Returns (query, filters)."""
     filters = {}
+    # Loader options are added when iterating the rows (export_rows)
+    query = _apply_task_filters(apply_visibility(Task.query), args, filters)
+    return query, filters
 
-    # Start query
-    query = Task.query.options(joinedload(Task.assignees), joinedload(Task.tags))
-
-    # Apply role-based visibility filtering (same logic as dashboard)
-    if current_user.can_only_see_own_tasks():
-        user_area_ids = [area.id for area in current_user.areas]
-        if user_area_ids:
-            query = query.filter(
-                db.or_(
-                    Task.assignees.any(id=current_user.id),
-                    Task.creator_id == current_user.id
-                )
-            ).filter(Task.area_id.in_(user_area_ids))
-        else:
-            query = query.filter(Task.area_id == -1)
-    elif not current_user.can_see_all_areas():
-        user_area_ids = [area.id for area in current_user.areas]
-        if user_area_ids:
-            query = query.filter(Task.area_id.in_(user_area_ids))
-        else:
-            query = query.filter(Task.area_id == -1)
-    # Gerentes and admins see all tasks (no additional filter)
 
-    # Apply Assignee Filter (works for both calendar and dashboard)
-    if filter_assignee:
-        query = query.filter(Task.assignees.any(id=filter_assignee))
-        assignee = User.query.get(filter_assignee)
-        filters['assignee_name'] = assignee.full_name if assignee else 'Desconocido'
+def _pdf_response(pdf_bytes, filename):
+    """Attachment response over the rendered bytes (no BytesIO/send_file copy)."""
+    response = make_response(pdf_bytes)
+    response.headers['Content-Type'] = 'application/pdf'
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
 
-    # Apply Creator Filter
-    if filter_creator:
-        query = query.filter(Task.creator_id == filter_creator)
-        creator = User.query.get(filter_creator)
-        filters['creator_name'] = creator.full_name if creator else 'Desconocido'
-        filters['creator'] = filter_creator
 
-    # Apply Area Filter
-    if filter_area:
-        query = query.filter(Task.area_id == int(filter_area))
-        area = Area.query.get(int(filter_area))
-        filters['area_name'] = area.name if area else 'Desconocida'
+@main_bp.route('/export_pdf')
+@login_required
+def export_pdf():
+    query, filters = _build_export_query(request.args)
 
-    # Apply Status Filter - exclude 'Anulado' by default like dashboard
-    if filter_status:
-        if filter_status in ['Pending', 'Completed', 'Anulado']:
-            query = query.filter(Task.status == filter_status)
-            filters['status'] = filter_status
-    else:
-        # By default, exclude 'Anulado' tasks (matching dashboard behavior)
-        query = query.filter(Task.status != 'Anulado')
+    counts = export_counts(query)
+    pdf = generate_task_pdf(export_rows(query), filters, counts=counts)
+    
+    return _pdf_response(pdf_to_bytes(pdf), f'reporte_tareas_{date.today()}.pdf')
 
-    # Apply Date/Period Filters
-    today = date.today()
-    if period == 'today':
-        query = query.filter(db.func.date(Task.due_date) == today)
-        filters['date_range'] = f'Hoy ({today.strftime("%d/%m/%Y")})'
-    elif period == 'week':
-        week_start = today - timedelta(days=today.weekday())
-        week_end = week_start + timedelta(days=6)
-        query = query.filter(db.func.date(Task.due_date) >= week_start,
-                           db.func.date(Task.due_date) <= week_end)
-        filters['date_range'] = 'Esta Semana'
-    elif period == 'month':
-        month_start = today.replace(day=1)
-        if today.month == 12:
-            month_end = today.replace(day=31)
-        else:
-            month_end = (today.replace(month=today.month + 1, day=1) - timedelta(days=1))
-        query = query.filter(db.func.date(Task.due_date) >= month_start,
-                           db.func.date(Task.due_date) <= month_end)
-        filters['date_range'] = 'Este Mes'
-    elif start_date_str and end_date_str:
-        try:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-            query = query.filter(db.func.date(Task.due_date) >= start_date,
-                               db.func.date(Task.due_date) <= end_date)
-            filters['date_range'] = f"{start_date_str} a {end_date_str}"
-        except ValueError:
-            pass
-            
-    # Tag filter
-    filter_tag = request.args.get('tag_filter')
-    if filter_tag:
-        query = query.filter(Task.tags.any(id=int(filter_tag)))
-        tag = Tag.query.get(int(filter_tag))
-        filters['tag'] = tag.name if tag else ''
+@main_bp.route('/export_excel')
+@login_required
+def export_excel():
+    query, filters = _build_export_query(request.args)
 
-    # Search filter
-    search_query = request.args.get('q')
-    if search_query:
-        search_term = f"%{search_query}%"
-        query = query.filter(
-            (Task.title.ilike(search_term)) | 
-            (Task.description.ilike(search_term))
-        )
-        filters['search'] = search_query
-        
-    tasks = query.order_by(Task.due_date.asc()).all()
-    
-    wb = generate_task_excel(tasks, filters)
+    counts = export_counts(query)
+    wb = generate_task_excel(export_rows(query), filters, counts=counts)
     
-    # Save to BytesIO
-    excel_file = BytesIO()
+    # Save to an anonymous temp file (removed when send_file closes it)
+    # instead of holding the whole .xlsx in memory
+    excel_file = tempfile.TemporaryFile()
     wb.save(excel_file)
     excel_file.seek(0)
     
-    response = make_response(excel_file.read())
-    response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    response.headers['Content-Disposition'] = f'attachment; filename=reporte_tareas_{date.today()}.xlsx'
-    
     # Log activity
     log_activity(
         user=current_user,
         action='export_excel',
-        description=f'exportó {len(tasks)} tareas a Excel',
+        description=f'exportó {counts[0]} tareas a Excel',
         area_id=current_user.areas[0].id if current_user.areas else None
     )
     
-    return response
+    # send_file streams the file in chunks instead of copying it into the response body
+    return send_file(excel_file,
+                     mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                     as_attachment=True, download_name=f'reporte_tareas_{date.today()}.xlsx')
 
 # --- Admin Routes ---
 @admin_bp.route('/users', methods=['GET', 'POST'])
 @login_required
 def manage_users():
-    from models import Area
-    
     # Allow both admins and supervisors to manage users
     is_supervisor = current_user.role == 'supervisor'
     
@@ -2464,11 +2511,9 @@ def manage_users():
             )
             new_user.set_password(password)
             
-            # Assign areas
-            for area_id in area_ids:
-                area = Area.query.get(int(area_id))
-                if area:
-                    new_user.areas.append(area)
+            # Assign areas (one IN query; unknown ids are ignored)
+            if area_ids:
+                new_user.areas = Area.query.filter(Area.id.in_([int(a) for a in area_ids])).all()
             
             db.session.add(new_user)
             db.session.commit()
@@ -2485,12 +2530,12 @@ def manage_users():
             
             flash('Usuario creado exitosamente.', 'success')
     
-    # Get users to display
+    # Get users to display (the table lists each user's areas: load them in one query)
     if is_supervisor:
         # Supervisors only see users in their area
-        users = [u for u in User.query.all() if supervisor_area in u.areas]
+        users = users_in_areas([supervisor_area]).options(selectinload(User.areas)).all()
     else:
-        users = User.query.all()
+        users = User.query.options(selectinload(User.areas)).all()
     
     return render_template('users.html', users=users, all_areas=all_areas, is_supervisor=is_supervisor)
 
@@ -2499,8 +2544,6 @@ def manage_users():
 @login_required
 def manage_areas():
     """Manage areas (departments) - Admin only"""
-    from models import Area
-    
     if not current_user.is_admin:
         flash('Acceso denegado.', 'danger')
         return redirect(url_for('main.dashboard'))
@@ -2512,8 +2555,6 @@ def manage_areas():
         
         if not name:
             flash('El nombre del área es requerido.', 'warning')
-        elif Area.query.filter_by(name=name).first():
-            flash('Ya existe un área con ese nombre.', 'warning')
         else:
             new_area = Area(
                 name=name,
@@ -2521,8 +2562,13 @@ def manage_areas():
                 color=color
             )
             db.session.add(new_area)
-            db.session.commit()
-            flash(f'Área "{name}" creada exitosamente.', 'success')
+            # Area.name is unique: the INSERT itself detects duplicates
+            try:
+                db.session.commit()
+                flash(f'Área "{name}" creada exitosamente.', 'success')
+            except IntegrityError:
+                db.session.rollback()
+                flash('Ya existe un área con ese nombre.', 'warning')
     
     areas = Area.query.order_by(Area.name).all()
     return render_template('manage_areas.html', areas=areas)
@@ -2531,16 +2577,19 @@ def manage_areas():
 @login_required
 def delete_area(area_id):
     """Delete an area - Admin only"""
-    from models import Area
-    
     if not current_user.is_admin:
         flash('Acceso denegado.', 'danger')
         return redirect(url_for('main.dashboard'))
     
-    area = Area.query.get_or_404(area_id)
+    # Area and its task count in one query
+    row = db.session.query(Area, db.func.count(Task.id)).outerjoin(
+        Task, Task.area_id == Area.id
+    ).filter(Area.id == area_id).group_by(Area.id).first()
+    if row is None:
+        abort(404)
+    area, task_count = row
     
     # Check if area has tasks
-    task_count = area.tasks.count()
     if task_count > 0:
         flash(f'No se puede eliminar el área "{area.name}" porque tiene {task_count} tareas asignadas.', 'danger')
         return redirect(url_for('admin.manage_areas'))
@@ -2555,8 +2604,6 @@ def delete_area(area_id):
 @login_required
 def edit_user(user_id):
     """Edit user - update role and areas - Admin only"""
-    from models import Area
-    
     if not current_user.is_admin:
         flash('Acceso denegado.', 'danger')
         return redirect(url_for('main.dashboard'))
@@ -2577,11 +2624,8 @@ def edit_user(user_id):
         # Update areas
         area_ids = request.form.getlist('areas')
         
-        user.areas.clear()
-        for area_id in area_ids:
-            area = Area.query.get(int(area_id))
-            if area:
-                user.areas.append(area)
+        # One IN query; unknown ids are ignored
+        user.areas = Area.query.filter(Area.id.in_([int(a) for a in area_ids])).all() if area_ids else []
         
         db.session.commit()
         
@@ -2608,29 +2652,76 @@ def api_tasks_due_soon():
     """
     Return tasks and expirations that are due soon or already overdue.
     Used for popup notifications.
+    
+    Responses carry an ETag built from the ids (tasks) or count
+    (expirations) and MAX(updated_at) of the matching rows, so unchanged
+    polls get a 304 after two small queries.
     """
     if not current_user.notifications_enabled:
         return jsonify({'tasks': [], 'expirations': [], 'overdue_tasks': [], 'overdue_expirations': []})
     
     # Get all pending/active AND enabled tasks assigned to current user (exclude blocked tasks)
     # Include 'Scheduled' to show reminders for future tasks based on due_date
-    active_tasks = Task.query.filter(
-        Task.assignees.any(id=current_user.id),
+    # assigned_to() reads the user's task ids straight from the
+    # task_assignments PK (user_id, task_id); tasks are then fetched by id.
+    task_filters = (
+        assigned_to(current_user.id),
         Task.status.in_(['Pending', 'In Progress', 'In Review', 'Scheduled']),
         Task.enabled == True  # Only show enabled tasks (not blocked by parent)
-    ).all()
+    )
+    
+    # Gerentes and admins see all expirations; others only see expirations from their own areas
+    if current_user.can_see_all_areas():
+        expiration_filters = (Expiration.completed == False,)
+    else:
+        user_area_ids = get_user_area_ids()
+        expiration_filters = (
+            Expiration.completed == False,
+            Expiration.area_id.in_(user_area_ids)
+        ) if user_area_ids else None
+    
+    # Change marker: days_remaining depends on today, the rest on the rows.
+    # Task ids, not just a count: (un)assigning rewrites task_assignments
+    # without touching the task rows, so a swap keeps count and max equal.
+    # The expiration count catches rows that stop matching (deleted, ...)
+    today = date.today()
+    task_rows = db.session.query(Task.id, Task.updated_at).filter(*task_filters).all()
+    task_stamp = (
+        tuple(sorted(task_id for task_id, _ in task_rows)),
+        max((updated for _, updated in task_rows if updated), default=None)
+    )
+    expiration_stamp = db.session.query(
+        db.func.count(Expiration.id), db.func.max(Expiration.updated_at)
+    ).filter(*expiration_filters).one() if expiration_filters else None
+    etag = hashlib.sha1(repr((
+        current_user.id, today.isoformat(), get_user_area_ids(),
+        task_stamp, tuple(expiration_stamp) if expiration_stamp else None
+    )).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    
+    # Only the columns of the payload are selected (plain rows, no Task
+    # objects) and the description is truncated by the database
+    active_tasks = db.session.query(
+        Task.id, Task.title, Task.due_date, Task.priority,
+        db.func.substr(Task.description, 1, 100).label('description'),
+        Task.enabled_at
+    ).filter(*task_filters).all()
     
     # Separate tasks into due soon and overdue
     due_soon_tasks = []
     overdue_tasks = []
     for task in active_tasks:
-        business_days = calculate_business_days_until(task.due_date)
+        business_days = calculate_business_days_until(task.due_date, today)
         task_data = {
             'id': task.id,
             'title': task.title,
             'due_date': task.due_date.strftime('%d/%m/%Y'),
             'priority': task.priority,
-            'description': task.description[:100] if task.description else '',
+            'description': task.description or '',
             'days_remaining': business_days,
             'type': 'task',
             'enabled_at': task.enabled_at.strftime('%d/%m/%Y') if task.enabled_at else None
@@ -2642,34 +2733,30 @@ def api_tasks_due_soon():
             due_soon_tasks.append(task_data)
     
     # Get pending expirations filtered by area
-    # Gerentes and admins see all expirations; others only see expirations from their own areas
-    if current_user.can_see_all_areas():
-        pending_expirations = Expiration.query.filter(
-            Expiration.completed == False
-        ).all()
+    # Same projection; the creator name comes from a join instead of one
+    # lazy load per expiration
+    if expiration_filters:
+        pending_expirations = db.session.query(
+            Expiration.id, Expiration.title, Expiration.due_date,
+            db.func.substr(Expiration.description, 1, 100).label('description'),
+            User.full_name.label('creator_name')
+        ).join(User, Expiration.creator_id == User.id).filter(*expiration_filters).all()
     else:
-        user_area_ids = [area.id for area in current_user.areas]
-        if user_area_ids:
-            pending_expirations = Expiration.query.filter(
-                Expiration.completed == False,
-                Expiration.area_id.in_(user_area_ids)
-            ).all()
-        else:
-            pending_expirations = []
+        pending_expirations = []
     
     # Separate expirations into due soon and overdue
     due_soon_expirations = []
     overdue_expirations = []
     for exp in pending_expirations:
-        business_days = calculate_business_days_until(exp.due_date)
+        business_days = calculate_business_days_until(exp.due_date, today)
         exp_data = {
             'id': exp.id,
             'title': exp.title,
             'due_date': exp.due_date.strftime('%d/%m/%Y'),
-            'description': exp.description[:100] if exp.description else '',
+            'description': exp.description or '',
             'days_remaining': business_days,
             'type': 'expiration',
-            'creator': exp.creator.full_name
+            'creator': exp.creator_name
         }
         if business_days < 0:  # Overdue
             exp_data['days_overdue'] = abs(business_days)
@@ -2683,8 +2770,10 @@ def api_tasks_due_soon():
         'overdue_tasks': overdue_tasks,
         'overdue_expirations': overdue_expirations
     })
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-    response.headers['Pragma'] = 'no-cache'
+    response.set_etag(etag)
+    # no-cache (not no-store): the browser keeps the copy but revalidates
+    # it with If-None-Match on every poll
+    response.headers['Cache-Control'] = 'no-cache'
     return response
 
 @main_bp.route('/api/user/toggle_notifications', methods=['POST'])
@@ -2715,12 +2804,11 @@ def api_postpone_task(task_id):
     task = Task.query.get_or_404(task_id)
     
     # Validar que el usuario tiene permiso (es asignado, creador, admin o supervisor del área)
-    is_assignee = current_user in task.assignees
     is_creator = task.creator_id == current_user.id
     is_admin = current_user.is_admin
-    is_supervisor = current_user.role == 'supervisor' and task.area_id in [a.id for a in current_user.areas]
+    is_supervisor = current_user.role == 'supervisor' and task.area_id in get_user_area_ids()
     
-    if not (is_assignee or is_creator or is_admin or is_supervisor):
+    if not (is_creator or is_admin or is_supervisor or is_task_assignee(task)):
         return jsonify({'success': False, 'message': 'No tienes permiso para posponer esta tarea'}), 403
     
     data = request.get_json()
@@ -2765,7 +2853,7 @@ def api_postpone_task(task_id):
     # Actualizar la tarea
     task.due_date = new_due_date
     task.last_edited_by_id = current_user.id
-    task.last_edited_at = datetime.utcnow()
+    task.last_edited_at = now_utc()
     
     new_due_date_str = new_due_date.strftime('%d/%m/%Y')
     
@@ -2814,7 +2902,7 @@ def api_transfer_task(task_id):
     is_assignee = current_user in task.assignees
     is_creator = task.creator_id == current_user.id
     is_admin = current_user.is_admin
-    is_supervisor = current_user.role == 'supervisor' and task.area_id in [a.id for a in current_user.areas]
+    is_supervisor = current_user.role == 'supervisor' and task.area_id in get_user_area_ids()
     
     if not (is_assignee or is_creator or is_admin or is_supervisor):
         return jsonify({'success': False, 'message': 'No tienes permiso para pasar esta tarea'}), 403
@@ -2858,7 +2946,7 @@ def api_transfer_task(task_id):
     
     # Actualizar último editor
     task.last_edited_by_id = current_user.id
-    task.last_edited_at = datetime.utcnow()
+    task.last_edited_at = now_utc()
     
     # Registrar transición de estado si cambió
     if old_status != 'Pending':
@@ -2925,7 +3013,6 @@ def api_get_areas():
     """
     Obtener lista de áreas para el selector de pase de tareas.
     """
-    from models import Area
     areas = Area.query.order_by(Area.name).all()
     
     areas_data = [{
@@ -2949,7 +3036,7 @@ def tags():
     if current_user.is_admin:
         all_tags = Tag.query.order_by(Tag.name).all()
     else:
-        user_area_ids = [a.id for a in current_user.areas]
+        user_area_ids = get_user_area_ids()
         if user_area_ids:
             all_tags = Tag.query.filter(Tag.area_id.in_(user_area_ids)).order_by(Tag.name).all()
         else:
@@ -2963,7 +3050,7 @@ def api_get_tags():
     if current_user.is_admin:
         tags = Tag.query.order_by(Tag.name).all()
     else:
-        user_area_ids = [a.id for a in current_user.areas]
+        user_area_ids = get_user_area_ids()
         if user_area_ids:
             tags = Tag.query.filter(Tag.area_id.in_(user_area_ids)).order_by(Tag.name).all()
         else:
@@ -2988,11 +3075,6 @@ def api_create_tag():
     if not name:
         return jsonify({'success': False, 'message': 'El nombre es requerido'}), 400
     
-    # Check if tag already exists
-    existing = Tag.query.filter_by(name=name).first()
-    if existing:
-        return jsonify({'success': False, 'message': 'Este tag ya existe'}), 400
-    
     # Determine area_id based on user
     # Non-admins get their first area automatically
     area_id = None
@@ -3007,7 +3089,12 @@ def api_create_tag():
     )
     
     db.session.add(new_tag)
-    db.session.commit()
+    # Tag.name is unique: the INSERT itself detects duplicates
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Este tag ya existe'}), 400
     
     return jsonify({
         'success': True,
@@ -3030,16 +3117,17 @@ def api_update_tag(tag_id):
     color = data.get('color')
     
     if name:
-        # Check if new name conflicts with another tag
-        existing = Tag.query.filter(Tag.name == name, Tag.id != tag_id).first()
-        if existing:
-            return jsonify({'success': False, 'message': 'Este nombre ya está en uso'}), 400
         tag.name = name
     
     if color:
         tag.color = color
     
-    db.session.commit()
+    # A name used by another tag violates the unique constraint
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Este nombre ya está en uso'}), 400
     
     return jsonify({
         'success': True,
@@ -3055,9 +3143,14 @@ def api_update_tag(tag_id):
 def api_delete_tag(tag_id):
     """Delete a tag - accessible to all users"""
     
-    tag = Tag.query.get_or_404(tag_id)
-    
-    db.session.delete(tag)
+    # Single DELETE of the tag, then its task/template/expiration/recurring
+    # links in the same transaction
+    deleted = Tag.query.filter_by(id=tag_id).delete(synchronize_session=False)
+    if not deleted:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Tag no encontrado'}), 404
+    delete_links(tag_id, task_tags.c.tag_id, template_tags.c.tag_id,
+                 expiration_tags.c.tag_id, recurring_task_tags.c.tag_id)
     db.session.commit()
     
     return jsonify({'success': True})
@@ -3066,8 +3159,6 @@ def api_delete_tag(tag_id):
 @main_bp.route('/reports')
 @login_required
 def reports():
-    from models import Area
-    
     # --- CHECK PERMISSION TO VIEW REPORTS ---
     if not current_user.can_see_reports():
         flash('No tienes acceso a los reportes.', 'danger')
@@ -3081,11 +3172,10 @@ def reports():
         tags = Tag.query.order_by(Tag.name).all()
         show_area_filter = True
     else:
-        user_area_ids = [a.id for a in current_user.areas]
+        user_area_ids = get_user_area_ids()
         if user_area_ids:
             # Users who share at least one area with the current user
-            users = [u for u in User.query.order_by(User.full_name).all() 
-                     if any(a.id in user_area_ids for a in u.areas)]
+            users = users_in_areas(user_area_ids).order_by(User.full_name).all()
             tags = Tag.query.filter(Tag.area_id.in_(user_area_ids)).order_by(Tag.name).all()
         else:
             users = []
@@ -3100,68 +3190,69 @@ def reports():
                           show_area_filter=show_area_filter)
 
 
-def _apply_area_security(query):
+def _apply_area_security(query, user=None):
     """Apply area-based security filter to a task query.
-    Admins see everything; non-admins only see tasks from their areas."""
-    if current_user.is_admin:
+    Admins see everything; non-admins only see tasks from their areas.
+    `user` defaults to current_user (pass it explicitly outside a request)."""
+    user_area_ids = get_user_area_ids(user)
+    if user is None:
+        user = current_user
+    if user.is_admin:
         return query
-    user_area_ids = [a.id for a in current_user.areas]
     if user_area_ids:
         return query.filter(Task.area_id.in_(user_area_ids))
     else:
         return query.filter(db.literal(False))
 
 
-@main_bp.route('/api/reports/data', methods=['POST'])
-@login_required
-def reports_data():
-    from models import Area, Process, ProcessType
-
-    # --- CHECK PERMISSION TO VIEW REPORTS ---
-    if not current_user.can_see_reports():
-        print(f"[REPORTS] User {current_user.username} tried to access reports but doesn't have permission")
-        return jsonify({'error': 'No tienes acceso a los reportes'}), 403
-
-    print(f"[REPORTS] Loading reports for user: {current_user.username}, is_admin: {current_user.is_admin}")
+def _build_report_payload(filters, user, with_tasks=True):
+    """
+    Shared data layer for the reports dashboard (reports_data) and the PDF
+    export (build_report_pdf): filtered tasks, per-user stats, global
+    status counts, completion trends and optionally KPIs.
     
-    data = request.get_json()
-
-    user_ids = data.get('user_ids', [])
-    tag_ids = data.get('tag_ids', [])
-    status_filter = data.get('status')
-    area_filter = data.get('area')
-    start_date_str = data.get('start_date')
-    end_date_str = data.get('end_date')
+    `filters` keys: user_ids, tag_ids, status, area, start_date, end_date,
+    include_kpis. `user` is whose area security applies.
+    
+    Only the PDF lists individual tasks; with with_tasks=False the rows are
+    not loaded and callers aggregate over payload['query'] instead.
+    """
+    user_ids = filters.get('user_ids') or []
+    tag_ids = filters.get('tag_ids') or []
+    status_filter = filters.get('status')
+    area_filter = filters.get('area')
+    start_date_str = filters.get('start_date')
+    end_date_str = filters.get('end_date')
     
     # Base query - ALWAYS exclude 'Anulado' and blocked tasks
-    query = Task.query.options(joinedload(Task.assignees), joinedload(Task.tags)).filter(
+    query = Task.query.filter(
         Task.status != 'Anulado',
         Task.enabled == True
     )
     
     # --- AREA SECURITY (always applied) ---
-    query = _apply_area_security(query)
+    query = _apply_area_security(query, user)
     
     # Additional area filter for admins who want to drill into a specific area
-    if current_user.is_admin and area_filter and area_filter != 'all':
+    if user.is_admin and area_filter and area_filter != 'all':
         query = query.filter(Task.area_id == int(area_filter))
     
     # Filter by users if provided
     if user_ids:
-        query = query.filter(Task.assignees.any(User.id.in_(user_ids)))
+        query = query.filter(assigned_to(user_ids))
         
     # Filter by tags if provided
     if tag_ids:
-        query = query.filter(Task.tags.any(Tag.id.in_(tag_ids)))
+        query = query.filter(tagged_with(tag_ids))
         
     # Filter by status if provided
     if status_filter and status_filter != 'All':
         if status_filter == 'Overdue':
             # Overdue = any non-completed task with due_date < today
-            today_date = date.today()
+            # Raw due_date compared to today 00:00 so (status, due_date) can be used
             query = query.filter(
                 Task.status.in_(['Pending', 'In Progress', 'In Review']),
-                db.func.date(Task.due_date) < today_date
+                before_day(Task.due_date, date.today())
             )
         else:
             query = query.filter(Task.status == status_filter)
@@ -3190,40 +3281,215 @@ def reports_data():
                 )
             )
         
-    tasks = query.all()
+    # (creator/completed_by are read by the PDF task table)
+    tasks = query.options(
+        selectinload(Task.assignees),
+        selectinload(Task.tags),
+        joinedload(Task.creator),
+        joinedload(Task.completed_by)
+    ).order_by(Task.due_date).all() if with_tasks else None
     
     # --- 1. Stats per User ---
+    # (total, completed) per assignee of the filtered tasks, counted by the
+    # database with a GROUP BY over task_assignments
     user_stats = []
+    user_counts = {
+        user_id: (total, completed)
+        for user_id, total, completed in query.with_entities(
+            task_assignments.c.user_id,
+            db.func.count(Task.id),
+            db.func.count(db.case((Task.status == 'Completed', 1)))
+        ).join(task_assignments, task_assignments.c.task_id == Task.id).group_by(task_assignments.c.user_id)
+    }
     if user_ids:
         # Specific users selected — show only those
         target_users = User.query.filter(User.id.in_(user_ids)).all()
     else:
-        # No user filter — show only users who appear in the filtered tasks
-        user_ids_in_tasks = set()
-        for t in tasks:
-            for a in t.assignees:
-                user_ids_in_tasks.add(a.id)
-        target_users = User.query.filter(User.id.in_(list(user_ids_in_tasks))).order_by(User.full_name).all() if user_ids_in_tasks else []
-    
-    for user in target_users:
-        user_tasks = [t for t in tasks if user in t.assignees]
-        completed = sum(1 for t in user_tasks if t.status == 'Completed')
-        pending = len(user_tasks) - completed
+        # No user filter — show only users who appear in the filtered tasks,
+        # taken from the assignees already loaded with them (no extra query)
+        if tasks is not None:
+            involved_users = {u.id: u for t in tasks for u in t.assignees}
+            target_users = sorted(involved_users.values(), key=lambda u: u.full_name)
+        else:
+            target_users = User.query.filter(User.id.in_(list(user_counts))).order_by(User.full_name).all() if user_counts else []
+    
+    for u in target_users:
+        total, completed = user_counts.get(u.id, (0, 0))
+        pending = total - completed
         user_stats.append({
-            'name': user.full_name,
+            'name': u.full_name,
             'completed': completed,
             'pending': pending
         })
         
     # --- 2. Global Status (3 categories) ---
-    global_completed = sum(1 for t in tasks if t.status == 'Completed')
-    global_in_progress = sum(1 for t in tasks if t.status == 'In Progress')
-    global_pending = sum(1 for t in tasks if t.status == 'Pending')
+    # Status and overdue counts of the filtered tasks in one aggregate
+    # (overdue = any non-completed task past its due date, for the KPIs)
+    now = datetime.now()
+    timed_completed = db.and_(
+        Task.status == 'Completed', Task.started_at.isnot(None), Task.completed_at.isnot(None)
+    )
+    status_counts = query.with_entities(
+        db.func.count(Task.id).label('total'),
+        db.func.count(db.case((Task.status == 'Completed', 1))).label('completed'),
+        db.func.count(db.case((Task.status == 'In Progress', 1))).label('in_progress'),
+        db.func.count(db.case((Task.status == 'Pending', 1))).label('pending'),
+        db.func.count(db.case((db.and_(
+            Task.status.in_(['Pending', 'In Progress', 'In Review']),
+            Task.due_date < now
+        ), 1))).label('overdue'),
+        # Average completion time (KPIs): completed tasks with both timestamps
+        db.func.count(db.case((timed_completed, 1))).label('timed_completed'),
+        db.func.sum(db.case((timed_completed, seconds_between(Task.started_at, Task.completed_at)))).label('completion_seconds')
+    ).one()._asdict()
+    global_completed = status_counts['completed']
+    global_in_progress = status_counts['in_progress']
+    global_pending = status_counts['pending']
+    
+    # --- Trends (Time-based) ---
+    t_start = datetime.strptime(start_date_str, '%Y-%m-%d') if start_date_str else datetime.now() - timedelta(days=30)
+    if end_date_str:
+        t_end = datetime.strptime(end_date_str, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
+    else:
+        t_end = datetime.now()
+    
+    # One slot per day of the window; series are filled by position
+    first_day = t_start.date()
+    n_days = max((t_end.date() - first_day).days + 1, 0)
+    trend_days = [first_day + timedelta(days=i) for i in range(n_days)]
+    day_index = {d: i for i, d in enumerate(trend_days)}
+    date_labels = [d.isoformat() for d in trend_days]
+
+    # Trends are counted in SQL: completed tasks per day, per (assignee, day)
+    # and per (tag, day), grouped by the database instead of scanning the
+    # tasks once per user/tag in Python
+    completed_day = db.func.date(Task.completed_at, type_=db.Date)
+
+    def trend_counts(*columns):
+        """Query columns + count over the completed tasks of the trend window."""
+        trend_query = db.session.query(*columns, db.func.count(Task.id)).select_from(Task).filter(
+            Task.status == 'Completed',
+            Task.completed_at.isnot(None),
+            Task.completed_at >= t_start,
+            Task.completed_at <= t_end
+        )
+        trend_query = _apply_area_security(trend_query, user)  # SECURITY FIX
+        if user.is_admin and area_filter and area_filter != 'all':
+            trend_query = trend_query.filter(Task.area_id == int(area_filter))
+        if user_ids:
+            trend_query = trend_query.filter(assigned_to(user_ids))
+        if tag_ids:
+            trend_query = trend_query.filter(tagged_with(tag_ids))
+        return trend_query
+
+    # Global Trend (with area security applied!)
+    global_counts = [0] * n_days
+    for day, count in trend_counts(completed_day).group_by(completed_day):
+        if day in day_index:
+            global_counts[day_index[day]] = count
+            
+    global_trend_data = {
+        'dates': date_labels,
+        'completed_counts': global_counts
+    }
+
+    def series_by_key(grouped_rows):
+        """{key: [count per day]} from (key, day, count) rows."""
+        series = {}
+        for key, day, count in grouped_rows:
+            if day in day_index:
+                if key not in series:
+                    series[key] = [0] * n_days
+                series[key][day_index[day]] = count
+        return series
+
+    # {user_id: [count per day]} / {tag_id: [count per day]}
+    user_date_counts = series_by_key(trend_counts(task_assignments.c.user_id, completed_day).join(
+        task_assignments, task_assignments.c.task_id == Task.id
+    ).group_by(task_assignments.c.user_id, completed_day))
+    tag_date_counts = series_by_key(trend_counts(task_tags.c.tag_id, completed_day).join(
+        task_tags, task_tags.c.task_id == Task.id
+    ).group_by(task_tags.c.tag_id, completed_day))
+
+    # Only users/tags that appear in the trend tasks can have data; when no
+    # explicit filter is set, skip the rest instead of building empty series.
+    active_user_ids = set(user_date_counts)
+    active_tag_ids = set(tag_date_counts)
+
+    # Employee Trend
+    trend_users = target_users if user_ids else [u for u in target_users if u.id in active_user_ids]
+    employee_trend_datasets = [{
+        'label': u.full_name,
+        'data': user_date_counts.get(u.id) or [0] * n_days
+    } for u in trend_users]
+
+    # Tag Trend
+    if tag_ids:
+        target_tags = Tag.query.filter(Tag.id.in_(tag_ids)).all()
+    elif active_tag_ids:
+        target_tags = Tag.query.filter(Tag.id.in_(active_tag_ids)).all()
+    else:
+        target_tags = []
+    
+    tag_trend_datasets = [{
+        'label': tag.name,
+        'color': tag.color,
+        'data': tag_date_counts.get(tag.id) or [0] * n_days
+    } for tag in target_tags]
+
+    payload = {
+        'query': query,
+        'tasks': tasks,
+        'target_users': target_users,
+        'target_tags': target_tags,
+        'user_stats': user_stats,
+        'global_stats': {
+            'completed': global_completed,
+            'in_progress': global_in_progress,
+            'pending': global_pending
+        },
+        'trend': global_trend_data,
+        'employee_trend': employee_trend_datasets,
+        'tag_trend': tag_trend_datasets
+    }
+    
+    # KPIs
+    if filters.get('include_kpis'):
+        payload['kpis'] = calculate_kpis(status_counts, start_date_str, end_date_str)
+    
+    return payload
+
+
+@main_bp.route('/api/reports/data', methods=['POST'])
+@login_required
+def reports_data():
+    # --- CHECK PERMISSION TO VIEW REPORTS ---
+    if not current_user.can_see_reports():
+        print(f"[REPORTS] User {current_user.username} tried to access reports but doesn't have permission")
+        return jsonify({'error': 'No tienes acceso a los reportes'}), 403
+
+    print(f"[REPORTS] Loading reports for user: {current_user.username}, is_admin: {current_user.is_admin}")
+    
+    data = request.get_json()
+
+    payload = _build_report_payload({
+        'user_ids': data.get('user_ids', []),
+        'tag_ids': data.get('tag_ids', []),
+        'status': data.get('status'),
+        'area': data.get('area'),
+        'start_date': data.get('start_date'),
+        'end_date': data.get('end_date'),
+        'include_kpis': True,
+    }, current_user, with_tasks=False)
+    query = payload['query']
     
     # --- 3. Priority Distribution ---
-    priority_normal = sum(1 for t in tasks if t.priority == 'Normal')
-    priority_media = sum(1 for t in tasks if t.priority == 'Media')
-    priority_urgente = sum(1 for t in tasks if t.priority == 'Urgente')
+    priority_counts = dict(
+        query.with_entities(Task.priority, db.func.count(Task.id)).group_by(Task.priority).all()
+    )
+    priority_normal = priority_counts.get('Normal', 0)
+    priority_media = priority_counts.get('Media', 0)
+    priority_urgente = priority_counts.get('Urgente', 0)
     
     # --- 4. Area Stats ---
     area_stats = []
@@ -3232,128 +3498,76 @@ def reports_data():
     else:
         report_areas = list(current_user.areas)
     
+    # (total, completed) per area of the filtered tasks
+    area_counts = {
+        area_id: (total, completed)
+        for area_id, total, completed in query.with_entities(
+            Task.area_id,
+            db.func.count(Task.id),
+            db.func.count(db.case((Task.status == 'Completed', 1)))
+        ).group_by(Task.area_id)
+    }
     for area in report_areas:
-        area_tasks = [t for t in tasks if t.area_id == area.id]
-        a_completed = sum(1 for t in area_tasks if t.status == 'Completed')
-        a_pending = len(area_tasks) - a_completed
-        if len(area_tasks) > 0:
+        a_total, a_completed = area_counts.get(area.id, (0, 0))
+        if a_total > 0:
             area_stats.append({
                 'name': area.name,
                 'color': area.color,
                 'completed': a_completed,
-                'pending': a_pending,
-                'total': len(area_tasks)
+                'pending': a_total - a_completed,
+                'total': a_total
             })
     
     # --- 5. Process Stats (active processes visible to user) ---
     process_stats = []
-    proc_query = Process.query.filter(Process.status == 'Active')
+    proc_query = Process.query.options(joinedload(Process.process_type)).filter(Process.status == 'Active')
     if not current_user.is_admin:
-        user_area_ids = [a.id for a in current_user.areas]
+        user_area_ids = get_user_area_ids()
         if user_area_ids:
             proc_query = proc_query.filter(Process.area_id.in_(user_area_ids))
         else:
             proc_query = proc_query.filter(db.literal(False))
     
     active_processes = proc_query.order_by(Process.due_date).limit(20).all()
+    # Task counts of all listed processes in one GROUP BY (same rules as
+    # Process.total_tasks_count / completed_tasks_count)
+    process_counts = {}
+    if active_processes:
+        process_counts = {
+            process_id: (total, completed)
+            for process_id, total, completed in db.session.query(
+                Task.process_id,
+                db.func.count(db.case((Task.status != 'Anulado', 1))),
+                db.func.count(db.case((Task.status == 'Completed', 1)))
+            ).filter(
+                Task.process_id.in_([proc.id for proc in active_processes])
+            ).group_by(Task.process_id)
+        }
     for proc in active_processes:
+        total_tasks, completed_tasks = process_counts.get(proc.id, (0, 0))
         process_stats.append({
             'name': proc.name,
             'type': proc.process_type.name if proc.process_type else '-',
-            'progress': proc.progress_percentage,
-            'total_tasks': proc.total_tasks_count,
-            'completed_tasks': proc.completed_tasks_count,
+            'progress': int((completed_tasks / total_tasks) * 100) if total_tasks else 0,
+            'total_tasks': total_tasks,
+            'completed_tasks': completed_tasks,
             'due_date': proc.due_date.strftime('%d/%m/%Y') if proc.due_date else '-',
             'status': proc.status
         })
     
-    # --- Trends (Time-based) ---
-    t_start = datetime.strptime(start_date_str, '%Y-%m-%d') if start_date_str else datetime.now() - timedelta(days=30)
-    if end_date_str:
-        t_end = datetime.strptime(end_date_str, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
-    else:
-        t_end = datetime.now()
-    
-    date_labels = []
-    current_d = t_start
-    while current_d <= t_end:
-        date_labels.append(current_d.strftime('%Y-%m-%d'))
-        current_d += timedelta(days=1)
-        
-    # 6. Global Trend (with area security applied!)
-    trend_query = Task.query.filter(Task.status == 'Completed', Task.completed_at.isnot(None))
-    trend_query = _apply_area_security(trend_query)  # SECURITY FIX
-    
-    if current_user.is_admin and area_filter and area_filter != 'all':
-        trend_query = trend_query.filter(Task.area_id == int(area_filter))
-    if user_ids:
-        trend_query = trend_query.filter(Task.assignees.any(User.id.in_(user_ids)))
-    if tag_ids:
-        trend_query = trend_query.filter(Task.tags.any(Tag.id.in_(tag_ids)))
-        
-    trend_query = trend_query.filter(Task.completed_at >= t_start, Task.completed_at <= t_end)
-    completed_tasks_trend = trend_query.all()
-    
-    global_date_counts = {d: 0 for d in date_labels}
-    for t in completed_tasks_trend:
-        d_str = t.completed_at.strftime('%Y-%m-%d')
-        if d_str in global_date_counts:
-            global_date_counts[d_str] += 1
-            
-    global_trend_data = {
-        'dates': date_labels,
-        'completed_counts': [global_date_counts[d] for d in date_labels]
-    }
-
-    # 7. Employee Trend
-    employee_trend_datasets = []
-    for user in target_users:
-        user_trend_tasks = [t for t in completed_tasks_trend if user in t.assignees]
-        u_date_counts = {d: 0 for d in date_labels}
-        for t in user_trend_tasks:
-            d_str = t.completed_at.strftime('%Y-%m-%d')
-            if d_str in u_date_counts:
-                u_date_counts[d_str] += 1
-        
-        if sum(u_date_counts.values()) > 0 or user_ids:
-             employee_trend_datasets.append({
-                'label': user.full_name,
-                'data': [u_date_counts[d] for d in date_labels],
-                'fill': False
-             })
-
-    # 8. Tag Trend
-    tag_trend_datasets = []
-    target_tags = Tag.query.filter(Tag.id.in_(tag_ids)).all() if tag_ids else Tag.query.all()
-    
-    for tag in target_tags:
-        tag_trend_tasks = [t for t in completed_tasks_trend if tag in t.tags]
-        t_date_counts = {d: 0 for d in date_labels}
-        for t in tag_trend_tasks:
-            d_str = t.completed_at.strftime('%Y-%m-%d')
-            if d_str in t_date_counts:
-                t_date_counts[d_str] += 1
-                
-        if sum(t_date_counts.values()) > 0 or tag_ids:
-            tag_trend_datasets.append({
-                'label': tag.name,
-                'borderColor': tag.color,
-                'data': [t_date_counts[d] for d in date_labels],
-                'fill': False
-            })
-
-    # 9. KPIs
-    kpis = calculate_kpis(tasks, global_completed, start_date_str, end_date_str)
+    # Chart.js dataset shape for the trend series
+    employee_trend_datasets = [dict(ds, fill=False) for ds in payload['employee_trend']]
+    tag_trend_datasets = [
+        {'label': ds['label'], 'borderColor': ds['color'], 'data': ds['data'], 'fill': False}
+        for ds in payload['tag_trend']
+    ]
+    kpis = payload['kpis']
 
-    print(f"[REPORTS] Returning data: {len(tasks)} tasks, KPIs: {kpis}")
+    print(f"[REPORTS] Returning data: {kpis['total']} tasks, KPIs: {kpis}")
 
     return jsonify({
-        'user_stats': user_stats,
-        'global_stats': {
-            'completed': global_completed,
-            'in_progress': global_in_progress,
-            'pending': global_pending
-        },
+        'user_stats': payload['user_stats'],
+        'global_stats': payload['global_stats'],
         'priority_stats': {
             'normal': priority_normal,
             'media': priority_media,
@@ -3361,12 +3575,42 @@ def reports_data():
         },
         'area_stats': area_stats,
         'process_stats': process_stats,
-        'trend': global_trend_data,
+        'trend': payload['trend'],
         'employee_trend': employee_trend_datasets,
         'tag_trend': tag_trend_datasets,
         'kpis': kpis
     })
 
+def _tag_group_times(tag_a_ids, tag_b_ids, start_date_str=None, end_date_str=None, user=None):
+    """
+    Sum time_spent (minutes) of the tasks tagged with any tag of group A and
+    of group B in a single query, using conditional aggregation.
+    Each task is one row, so a task carrying several tags of the same group
+    is only counted once.
+    
+    Returns:
+        tuple: (time_a, time_b)
+    """
+    in_group_a = tagged_with(list(tag_a_ids or []))
+    in_group_b = tagged_with(list(tag_b_ids or []))
+    q = db.session.query(
+        db.func.coalesce(db.func.sum(db.case((in_group_a, Task.time_spent), else_=0)), 0),
+        db.func.coalesce(db.func.sum(db.case((in_group_b, Task.time_spent), else_=0)), 0)
+    ).filter(Task.status != 'Anulado', db.or_(in_group_a, in_group_b))
+    q = _apply_area_security(q, user)
+    
+    if start_date_str and end_date_str:
+        try:
+            s_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+            e_date = datetime.strptime(end_date_str, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
+            q = q.filter(Task.due_date >= s_date, Task.due_date <= e_date)
+        except ValueError:
+            pass
+    
+    time_a, time_b = q.one()
+    return int(time_a), int(time_b)
+
+
 @main_bp.route('/api/reports/calculate_difference', methods=['POST'])
 @login_required
 def api_calculate_difference():
@@ -3385,26 +3629,8 @@ def api_calculate_difference():
     start_date_str = data.get('start_date')
     end_date_str = data.get('end_date')
     
-    def get_group_time(t_ids):
-        if not t_ids: return 0
-        q = Task.query.filter(Task.status != 'Anulado')
-        q = _apply_area_security(q)  # SECURITY FIX
-        q = q.filter(Task.tags.any(Tag.id.in_(t_ids)))
-        
-        if start_date_str and end_date_str:
-            try:
-                s_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-                e_date = datetime.strptime(end_date_str, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
-                q = q.filter(Task.due_date >= s_date, Task.due_date <= e_date)
-            except ValueError:
-                pass
-                
-        found_tasks = q.all()
-        total = sum(t.time_spent for t in found_tasks if t.time_spent)
-        return total
-
-    time_a = get_group_time(tag_a_ids)
-    time_b = get_group_time(tag_b_ids)
+    # Both sums in one SQL aggregate (no Task rows are loaded)
+    time_a, time_b = _tag_group_times(tag_a_ids, tag_b_ids, start_date_str, end_date_str)
     
     diff = time_a - time_b
     abs_diff = abs(diff)
@@ -3431,170 +3657,122 @@ def export_report():
     # Get filters from form data
     user_ids_str = request.form.get('user_ids')
     tag_ids_str = request.form.get('tag_ids')
-    status_filter = request.form.get('status')
-    start_date_str = request.form.get('start_date')
-    end_date_str = request.form.get('end_date')
-    include_kpis_str = request.form.get('include_kpis')
-    include_kpis = include_kpis_str == 'true'
-    
-    import json
-    user_ids = json.loads(user_ids_str) if user_ids_str else []
-    tag_ids = json.loads(tag_ids_str) if tag_ids_str else []
+    filters = {
+        'user_ids': json.loads(user_ids_str) if user_ids_str else [],
+        'tag_ids': json.loads(tag_ids_str) if tag_ids_str else [],
+        'status': request.form.get('status'),
+        'area': request.form.get('area'),
+        'start_date': request.form.get('start_date'),
+        'end_date': request.form.get('end_date'),
+        'include_kpis': request.form.get('include_kpis') == 'true',
+        'diff_tag_a': request.form.get('diff_tag_a'),
+        'diff_tag_b': request.form.get('diff_tag_b'),
+    }
     
-    # Fetch data - exclude 'Anulado' and blocked tasks
-    query = Task.query.filter(Task.status != 'Anulado', Task.enabled == True)
-    query = _apply_area_security(query)  # SECURITY FIX
+    # Async mode: queue the PDF build and let the client poll for the result
+    if request.form.get('async') == 'true':
+        job_id = submit_report_job(current_app._get_current_object(), current_user.id,
+                                   build_report_pdf, filters, current_user.id)
+        return jsonify({
+            'job_id': job_id,
+            'status_url': url_for('main.export_report_result', job_id=job_id)
+        }), 202
     
-    if user_ids:
-        query = query.filter(Task.assignees.any(User.id.in_(user_ids)))
-    if tag_ids:
-        query = query.filter(Task.tags.any(Tag.id.in_(tag_ids)))
-    if status_filter and status_filter != 'All':
-        query = query.filter(Task.status == status_filter)
-    if start_date_str and end_date_str:
-        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-        end_date = datetime.strptime(end_date_str, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
-        # Apply same date filter logic as in reports_data
-        if status_filter == 'Completed':
-            query = query.filter(Task.completed_at >= start_date, Task.completed_at <= end_date)
-        elif status_filter and status_filter != 'All':
-            # Show tasks due on or before end_date (all pending work until that date)
-            query = query.filter(Task.due_date <= end_date)
-        else:
-            query = query.filter(
-                db.or_(
-                    db.and_(Task.status == 'Completed', Task.completed_at >= start_date, Task.completed_at <= end_date),
-                    db.and_(Task.status != 'Completed', Task.due_date <= end_date)
-                )
-            )
-        
-    tasks = query.order_by(Task.due_date).all()
+    pdf_bytes, filename = build_report_pdf(filters, current_user.id)
     
-    from pdf_utils import generate_report_pdf
+    return _pdf_response(pdf_bytes, filename)
+
+
+@main_bp.route('/reports/export/<job_id>')
+@login_required
+def export_report_result(job_id):
+    """Poll an async report job; returns the PDF once it is ready."""
+    job = get_report_job(job_id)
+    if not job or job.get('user_id') != current_user.id:
+        return jsonify({'error': 'Reporte no encontrado o expirado'}), 404
     
-    # Stats calculation
-    target_users = User.query.filter(User.id.in_(user_ids)).all() if user_ids else User.query.all()
-    user_stats = []
-    for user in target_users:
-        u_tasks = [t for t in tasks if user in t.assignees]
-        completed = sum(1 for t in u_tasks if t.status == 'Completed')
-        user_stats.append({'name': user.full_name, 'completed': completed, 'pending': len(u_tasks)-completed})
-        
-    global_completed = sum(1 for t in tasks if t.status == 'Completed')
-    global_pending = len(tasks) - global_completed
+    if job['status'] == 'pending':
+        return jsonify({'status': 'pending'}), 202
+    if job['status'] == 'error':
+        return jsonify({'status': 'error', 'error': 'Error al generar el reporte'}), 500
+    if request.args.get('poll'):
+        return jsonify({'status': 'done'})
     
-    # Trend Data
-    t_start = datetime.strptime(start_date_str, '%Y-%m-%d') if start_date_str else datetime.now() - timedelta(days=30)
-    if end_date_str:
-        t_end = datetime.strptime(end_date_str, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
-    else:
-        t_end = datetime.now()
+    return send_file(job['path'], mimetype='application/pdf',
+                     as_attachment=True, download_name=job['filename'])
+
+
+def build_report_pdf(filters, user_id):
+    """
+    Build the advanced report PDF for the given filters.
+    Runs either inside the request or on the background report pool, so it
+    must not rely on current_user.
     
-    completed_tasks_trend = [t for t in tasks if t.status == 'Completed' and t.completed_at and t_start <= t.completed_at <= t_end]
+    Returns:
+        tuple: (pdf_bytes, filename)
+    """
+    user = User.query.get(user_id)
     
-    date_counts = {}
-    current_d = t_start
-    while current_d <= t_end:
-        date_str = current_d.strftime('%Y-%m-%d')
-        date_counts[date_str] = 0
-        current_d += timedelta(days=1)
-        
-    for t in completed_tasks_trend:
-        d_str = t.completed_at.strftime('%Y-%m-%d')
-        if d_str in date_counts:
-            date_counts[d_str] += 1
-            
-    trend_data = {
-        'dates': list(date_counts.keys()),
-        'completed_counts': list(date_counts.values())
-    }
+    start_date_str = filters.get('start_date')
+    end_date_str = filters.get('end_date')
+    status_filter = filters.get('status')
+    tag_ids = filters.get('tag_ids') or []
     
-    # Employee Trend (for PDF)
-    employee_trend_datasets = []
-    for user in target_users:
-        user_trend_tasks = [t for t in completed_tasks_trend if user in t.assignees]
-        u_date_counts = {d: 0 for d in date_counts.keys()}
-        for t in user_trend_tasks:
-            d_str = t.completed_at.strftime('%Y-%m-%d')
-            if d_str in u_date_counts:
-                u_date_counts[d_str] += 1
-        if sum(u_date_counts.values()) > 0 or user_ids:
-             employee_trend_datasets.append({
-                'label': user.full_name,
-                'data': [u_date_counts[d] for d in date_counts.keys()]
-             })
-
-    # Tag Trend (for PDF)
-    tag_trend_datasets = []
-    target_tags = Tag.query.filter(Tag.id.in_(tag_ids)).all() if tag_ids else Tag.query.all()
-    for tag in target_tags:
-        tag_trend_tasks = [t for t in completed_tasks_trend if tag in t.tags]
-        t_date_counts = {d: 0 for d in date_counts.keys()}
-        for t in tag_trend_tasks:
-            d_str = t.completed_at.strftime('%Y-%m-%d')
-            if d_str in t_date_counts:
-                t_date_counts[d_str] += 1
-        if sum(t_date_counts.values()) > 0 or tag_ids:
-            tag_trend_datasets.append({
-                'label': tag.name,
-                'color': tag.color,
-                'data': [t_date_counts[d] for d in date_counts.keys()]
-            })
+    payload = _build_report_payload(filters, user)
+    tasks = payload['tasks']
+    global_completed = payload['global_stats']['completed']
     
     filter_info = {
-        'users': [u.full_name for u in target_users] if user_ids else ['Todos'],
-        'tags': [t.name for t in Tag.query.filter(Tag.id.in_(tag_ids)).all()] if tag_ids else ['Todas'],
+        'users': [u.full_name for u in payload['target_users']] if filters.get('user_ids') else ['Todos'],
+        # With a tag filter, target_tags are exactly the filtered tags
+        'tags': [t.name for t in payload['target_tags']] if tag_ids else ['Todas'],
         'status': status_filter if status_filter and status_filter != 'All' else 'Todos'
     }
         
     report_data = {
         'tasks': tasks,
-        'user_stats': user_stats,
-        'global_stats': {'completed': global_completed, 'pending': global_pending},
-        'trend': trend_data,
-        'employee_trend': employee_trend_datasets,
-        'tag_trend': tag_trend_datasets,
+        'user_stats': payload['user_stats'],
+        # The PDF groups everything not completed as pending
+        'global_stats': {'completed': global_completed, 'pending': len(tasks) - global_completed},
+        'trend': payload['trend'],
+        'employee_trend': payload['employee_trend'],
+        'tag_trend': payload['tag_trend'],
         'start_date': start_date_str,
         'end_date': end_date_str,
         'filters': filter_info
     }
     
-    if include_kpis:
-        report_data['kpis'] = calculate_kpis(tasks, global_completed, start_date_str, end_date_str)
+    if 'kpis' in payload:
+        report_data['kpis'] = payload['kpis']
         
     # Calculate difference if tags provided
-    import json
-    diff_tag_a_json = request.form.get('diff_tag_a')
-    diff_tag_b_json = request.form.get('diff_tag_b')
+    diff_tag_a_json = filters.get('diff_tag_a')
+    diff_tag_b_json = filters.get('diff_tag_b')
     
     if diff_tag_a_json and diff_tag_b_json:
         try:
             tag_a_ids = json.loads(diff_tag_a_json)
             tag_b_ids = json.loads(diff_tag_b_json)
             
-            def get_group_time_export(t_ids):
-                if not t_ids: return 0, "0h 0m"
-                q = Task.query.filter(Task.status != 'Anulado')
-                q = _apply_area_security(q)  # SECURITY FIX
-                q = q.filter(Task.tags.any(Tag.id.in_(t_ids)))
-                if start_date_str and end_date_str:
-                    s_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-                    e_date = datetime.strptime(end_date_str, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
-                    q = q.filter(Task.due_date >= s_date, Task.due_date <= e_date)
-                ts = q.all()
-                total_min = sum(t.time_spent for t in ts if t.time_spent)
+            def format_minutes(total_min):
                 h = int(total_min / 60)
                 m = int(total_min % 60)
-                return total_min, f"{h}h {m}m"
-
-            tags_a = Tag.query.filter(Tag.id.in_(tag_a_ids)).all()
-            tags_b = Tag.query.filter(Tag.id.in_(tag_b_ids)).all()
+                return f"{h}h {m}m"
+
+            # Names of both groups in one query (a tag may be in both)
+            group_a = {int(tag_id) for tag_id in tag_a_ids}
+            group_b = {int(tag_id) for tag_id in tag_b_ids}
+            group_tags = Tag.query.filter(Tag.id.in_(group_a | group_b)).all()
+            tags_a = [t for t in group_tags if t.id in group_a]
+            tags_b = [t for t in group_tags if t.id in group_b]
             name_a = ", ".join([t.name for t in tags_a])
             name_b = ", ".join([t.name for t in tags_b])
             
             if tags_a and tags_b:
-                time_a, str_a = get_group_time_export(tag_a_ids)
-                time_b, str_b = get_group_time_export(tag_b_ids)
+                # Both totals come from one conditional-aggregate query
+                time_a, time_b = _tag_group_times(tag_a_ids, tag_b_ids, start_date_str, end_date_str, user)
+                str_a = format_minutes(time_a)
+                str_b = format_minutes(time_b)
                 diff = time_a - time_b
                 abs_diff = abs(diff)
                 d_h = int(abs_diff / 60)
@@ -3621,37 +3799,31 @@ def export_report():
     else:
         filename = f'reporte_avanzado_{date.today().strftime("%d-%m-%Y")}.pdf'
 
-    response = make_response(pdf.output(dest='S').encode('latin-1'))
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
-    
-    return response
+    return pdf_to_bytes(pdf), filename
 
-def calculate_kpis(tasks, global_completed, start_date_str=None, end_date_str=None):
-    kpi_total = len(tasks)
-    kpi_completion_rate = round((global_completed / kpi_total * 100), 1) if kpi_total > 0 else 0
+def calculate_kpis(status_counts, start_date_str=None, end_date_str=None):
+    """
+    KPI block of the reports. `status_counts` is the aggregate computed by
+    _build_report_payload (total, completed, in_progress, overdue,
+    timed_completed, completion_seconds, ...).
+    """
+    kpi_total = status_counts['total']
+    kpi_completed = status_counts['completed']
+    kpi_completion_rate = round((kpi_completed / kpi_total * 100), 1) if kpi_total > 0 else 0
 
     # Overdue: any non-completed task past due date
-    now = datetime.now()
-    kpi_overdue = sum(1 for t in tasks if t.status in ['Pending', 'In Progress', 'In Review'] and t.due_date < now)
+    kpi_overdue = status_counts['overdue']
 
     # Status counts
-    kpi_in_progress = sum(1 for t in tasks if t.status == 'In Progress')
-
-    # Completed count
-    kpi_completed = global_completed
+    kpi_in_progress = status_counts['in_progress']
 
     # Pending count (includes overdue - all non-completed tasks)
     kpi_pending = kpi_total - kpi_completed
 
     # Average completion time: calculate average time from started_at to completed_at
-    completed_with_times = [t for t in tasks if t.status == 'Completed' and t.started_at and t.completed_at]
-    if completed_with_times:
-        total_seconds = 0
-        for t in completed_with_times:
-            delta = t.completed_at - t.started_at
-            total_seconds += delta.total_seconds()
-        avg_seconds = total_seconds / len(completed_with_times)
+    if status_counts['timed_completed']:
+        # round() absorbs float noise from the SQL date arithmetic
+        avg_seconds = round(float(status_counts['completion_seconds']) / status_counts['timed_completed'], 3)
         hours = int(avg_seconds // 3600)
         minutes = int((avg_seconds % 3600) // 60)
         seconds = int(avg_seconds % 60)
@@ -3691,7 +3863,6 @@ def download_import_template():
         flash('No tienes permiso para importar tareas.', 'danger')
         return redirect(url_for('main.dashboard'))
     
-    import os
     template_path = os.path.join(os.path.dirname(__file__), 'static', 'plantilla_tareas.xlsx')
     
     if not os.path.exists(template_path):
@@ -3725,8 +3896,6 @@ def import_tasks():
             flash('No tienes un área asignada. Contacta a un administrador.', 'danger')
             return redirect(url_for('main.dashboard'))
     
-    from openpyxl import load_workbook
-    
     if 'file' not in request.files:
         flash('No se seleccionó ningún archivo.', 'danger')
         return redirect(url_for('main.dashboard'))
@@ -4015,11 +4184,10 @@ def manage_templates():
             start_time=start_time
         )
         
-        # Add tags
-        for tag_id in tag_ids:
-            tag = Tag.query.get(int(tag_id))
-            if tag:
-                template.tags.append(tag)
+        # Add tags (single IN query instead of one SELECT per tag)
+        if tag_ids:
+            tag_id_ints = [int(t) for t in tag_ids]
+            template.tags.extend(Tag.query.filter(Tag.id.in_(tag_id_ints)).all())
         
         db.session.add(template)
         db.session.commit()
@@ -4125,7 +4293,7 @@ def manage_templates():
         templates = TaskTemplate.query.order_by(TaskTemplate.name).all()
         available_tags = Tag.query.order_by(Tag.name).all()
     else:
-        user_area_ids = [a.id for a in current_user.areas]
+        user_area_ids = get_user_area_ids()
         if user_area_ids:
             # Strict filter - only from user's areas
             templates = TaskTemplate.query.filter(TaskTemplate.area_id.in_(user_area_ids)).order_by(TaskTemplate.name).all()
@@ -4179,7 +4347,7 @@ def edit_template(template_id):
     if current_user.is_admin:
         available_tags = Tag.query.order_by(Tag.name).all()
     else:
-        user_area_ids = [a.id for a in current_user.areas]
+        user_area_ids = get_user_area_ids()
         available_tags = Tag.query.filter(Tag.area_id.in_(user_area_ids)).order_by(Tag.name).all() if user_area_ids else []
     
     if request.method == 'POST':
@@ -4204,10 +4372,9 @@ def edit_template(template_id):
         # Update tags
         template.tags.clear()
         tag_ids = request.form.getlist('tags')
-        for tag_id in tag_ids:
-            tag = Tag.query.get(int(tag_id))
-            if tag:
-                template.tags.append(tag)
+        if tag_ids:
+            tag_id_ints = [int(t) for t in tag_ids]
+            template.tags.extend(Tag.query.filter(Tag.id.in_(tag_id_ints)).all())
         
         # Clear existing subtask templates
         SubtaskTemplate.query.filter_by(template_id=template.id).delete()
@@ -4350,7 +4517,7 @@ def get_template_data(template_id):
             'parent_id': st.parent_id
         })
     
-    return jsonify({
+    return conditional_json({
         'title': template.title,
         'description': template.description or '',
         'priority': template.priority,
@@ -4364,20 +4531,50 @@ def get_template_data(template_id):
 
 
 # --- Task Hierarchy Helper Functions ---
+def get_descendant_ids(task_id):
+    """
+    Return the set of ids of every task below task_id in the hierarchy,
+    resolved with a single recursive CTE.
+    """
+    tree = db.select(Task.id).where(Task.parent_id == task_id).cte('task_descendants', recursive=True)
+    child = db.aliased(Task)
+    # UNION (not UNION ALL) so a corrupted cycle still terminates
+    tree = tree.union(db.select(child.id).where(child.parent_id == tree.c.id))
+    return {row[0] for row in db.session.execute(db.select(tree.c.id))}
+
+
+def _ancestor_cte(task_id):
+    """Recursive CTE (column `id`) with every task above task_id."""
+    chain = db.select(Task.parent_id.label('id')).where(
+        Task.id == task_id, Task.parent_id.isnot(None)
+    ).cte('task_ancestors', recursive=True)
+    parent = db.aliased(Task)
+    return chain.union(
+        db.select(parent.parent_id).where(parent.id == chain.c.id, parent.parent_id.isnot(None))
+    )
+
+
+def get_ancestor_ids(task_id):
+    """
+    Return the set of ids of every task above task_id in the hierarchy,
+    resolved with a single recursive CTE.
+    """
+    chain = _ancestor_cte(task_id)
+    return {row[0] for row in db.session.execute(db.select(chain.c.id))}
+
+
 def is_descendant(parent_id, potential_child_id):
     """
     Check if potential_child_id is a descendant of parent_id.
     This prevents circular references in the task hierarchy.
+    One EXISTS over the ancestor CTE: only a boolean comes back.
     """
     if parent_id == potential_child_id:
         return True
-    
-    task = Task.query.get(potential_child_id)
-    if not task or not task.parent_id:
-        return False
-    
-    # Recursively check if parent_id is an ancestor
-    return is_descendant(parent_id, task.parent_id)
+    chain = _ancestor_cte(potential_child_id)
+    return db.session.execute(
+        db.select(db.exists().where(chain.c.id == parent_id))
+    ).scalar()
 
 
 # --- Task Hierarchy API Routes ---
@@ -4391,14 +4588,19 @@ def api_search_tasks():
     if not query:
         return jsonify({'tasks': []})
     
-    search_query = Task.query.filter(Task.status != 'Anulado')
+    search_query = Task.query.options(selectinload(Task.assignees)).filter(Task.status != 'Anulado')
     
+    # Title matches need 3+ characters: shorter patterns can't use the
+    # trigram index (ix_task_title_trgm) and match most of the table anyway.
+    # Short numbers still find a task by id.
+    title_match = Task.title.ilike(f'%{query}%') if len(query) >= 3 else None
     if query.isdigit():
-        search_query = search_query.filter(
-            (Task.id == int(query)) | (Task.title.ilike(f'%{query}%'))
-        )
+        id_match = Task.id == int(query)
+        search_query = search_query.filter(id_match if title_match is None else id_match | title_match)
+    elif title_match is not None:
+        search_query = search_query.filter(title_match)
     else:
-        search_query = search_query.filter(Task.title.ilike(f'%{query}%'))
+        return jsonify({'tasks': []})
     
     if exclude_id:
         try:
@@ -4441,8 +4643,6 @@ def api_validate_parent(task_id, parent_id):
 @login_required
 def expiration_calendar():
     """Calendario de vencimientos - filtrado por área"""
-    from models import Area
-    
     period = request.args.get('period', 'all')
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
@@ -4461,7 +4661,7 @@ def expiration_calendar():
         show_area_filter = True
     else:
         # Non-admins see only expirations from their specific areas (NOT including NULL areas)
-        user_area_ids = [a.id for a in current_user.areas]
+        user_area_ids = get_user_area_ids()
         if user_area_ids:
             query = query.filter(Expiration.area_id.in_(user_area_ids))
             if filter_area and int(filter_area) in user_area_ids:
@@ -4476,26 +4676,19 @@ def expiration_calendar():
     today = date.today()
     
     if period == 'today':
-        query = query.filter(db.func.date(Expiration.due_date) == today)
+        query = query.filter(between_days(Expiration.due_date, today))
     elif period == 'week':
         week_start = today - timedelta(days=today.weekday())
         week_end = week_start + timedelta(days=6)
-        query = query.filter(db.func.date(Expiration.due_date) >= week_start,
-                           db.func.date(Expiration.due_date) <= week_end)
+        query = query.filter(between_days(Expiration.due_date, week_start, week_end))
     elif period == 'month':
-        month_start = today.replace(day=1)
-        if today.month == 12:
-            month_end = today.replace(day=31)
-        else:
-            month_end = (today.replace(month=today.month + 1, day=1) - timedelta(days=1))
-        query = query.filter(db.func.date(Expiration.due_date) >= month_start,
-                           db.func.date(Expiration.due_date) <= month_end)
+        month_start, month_end = month_bounds(today)
+        query = query.filter(between_days(Expiration.due_date, month_start, month_end))
     elif start_date_str and end_date_str:
         try:
             start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
             end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-            query = query.filter(db.func.date(Expiration.due_date) >= start_date,
-                               db.func.date(Expiration.due_date) <= end_date)
+            query = query.filter(between_days(Expiration.due_date, start_date, end_date))
         except ValueError:
             pass
     
@@ -4506,22 +4699,7 @@ def expiration_calendar():
     expirations = query.order_by(Expiration.due_date.asc()).all()
     available_tags = Tag.query.order_by(Tag.name).all()
     
-    # Get event dates for calendar widget (all dates with expirations in current month)
-    month_start = today.replace(day=1)
-    if today.month == 12:
-        month_end = today.replace(day=31)
-    else:
-        month_end = (today.replace(month=today.month + 1, day=1) - timedelta(days=1))
-    
-    event_dates_query = db.session.query(db.func.date(Expiration.due_date)).filter(
-        db.func.date(Expiration.due_date) >= month_start,
-        db.func.date(Expiration.due_date) <= month_end
-    ).distinct().all()
-    event_dates = [d[0].strftime('%Y-%m-%d') for d in event_dates_query if d[0]]
-    
     # --- CALENDAR GRID GENERATION ---
-    import calendar as cal
-    
     # Get month/year from query params or use current month
     view_year = int(request.args.get('year', today.year))
     view_month = int(request.args.get('month', today.month))
@@ -4538,62 +4716,62 @@ def expiration_calendar():
         next_month, next_year = view_month + 1, view_year
     
     # Generate calendar weeks (list of 7-day lists)
-    cal_obj = cal.Calendar(firstweekday=0)  # Monday = 0
-    month_days = cal_obj.monthdatescalendar(view_year, view_month)
+    month_days = _month_grid(view_year, view_month)
     
     # Get expirations for the visible calendar range
     if month_days:
         cal_start = month_days[0][0]
         cal_end = month_days[-1][-1]
         
-        # Query expirations within calendar view range
-        cal_exp_query = Expiration.query.options(joinedload(Expiration.tags)).filter(
-            db.func.date(Expiration.due_date) >= cal_start,
-            db.func.date(Expiration.due_date) <= cal_end
-        )
-        
-        # Apply same visibility filters
-        if not current_user.is_admin:
-            user_area_ids = [a.id for a in current_user.areas]
-            if user_area_ids:
-                cal_exp_query = cal_exp_query.filter(Expiration.area_id.in_(user_area_ids))
-            else:
-                cal_exp_query = cal_exp_query.filter(Expiration.area_id == -1)
-        
-        cal_expirations = cal_exp_query.all()
+        if period == 'all' and not (start_date_str and end_date_str) and not filter_tag and not filter_area:
+            # Unfiltered list (default view): it already holds every visible
+            # expiration, so the grid is a slice of it instead of another query
+            cal_expirations = [e for e in expirations if cal_start <= e.due_date.date() <= cal_end]
+        else:
+            # Query expirations within calendar view range. The grid only
+            # shows title/completed per day, so plain column rows are
+            # enough (no ORM entities, identity map or relationships)
+            cal_exp_query = db.session.query(
+                Expiration.title, Expiration.due_date, Expiration.completed
+            ).filter(
+                between_days(Expiration.due_date, cal_start, cal_end)
+            )
+            
+            # Apply same visibility filters
+            if not current_user.is_admin:
+                user_area_ids = get_user_area_ids()
+                if user_area_ids:
+                    cal_exp_query = cal_exp_query.filter(Expiration.area_id.in_(user_area_ids))
+                else:
+                    cal_exp_query = cal_exp_query.filter(Expiration.area_id == -1)
+            
+            cal_expirations = cal_exp_query.order_by(Expiration.due_date).all()
     else:
         cal_expirations = []
     
     # Group expirations by date
-    expirations_by_date = {}
-    for exp in cal_expirations:
-        date_key = exp.due_date.date().isoformat()
-        if date_key not in expirations_by_date:
-            expirations_by_date[date_key] = []
-        expirations_by_date[date_key].append(exp)
-    
-    # Month names in Spanish
-    month_names = ['', 'Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio',
-                   'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre']
-    
-    return render_template('expiration_calendar.html', 
+    expirations_by_date = group_by_due_day(cal_expirations)
+    
+    # The page is large (inline styles/scripts): revisits with nothing new
+    # get a 304. The ETag is over the rendered HTML, since flash messages,
+    # tag names and the user's menu are part of it too
+    return conditional_response(make_response(render_template('expiration_calendar.html', 
                           expirations=expirations, 
                           current_period=period, 
                           today=today,
                           available_tags=available_tags,
-                          event_dates=event_dates,
                           all_areas=available_areas,
                           show_area_filter=show_area_filter,
                           # New calendar grid data
                           calendar_weeks=month_days,
                           view_month=view_month,
                           view_year=view_year,
-                          month_name=month_names[view_month],
+                          month_name=_MONTH_NAMES_ES[view_month],
                           prev_month=prev_month,
                           prev_year=prev_year,
                           next_month=next_month,
                           next_year=next_year,
-                          expirations_by_date=expirations_by_date)
+                          expirations_by_date=expirations_by_date)))
 
 
 @main_bp.route('/expirations/create', methods=['POST'])
@@ -4628,14 +4806,13 @@ def create_expiration():
         area_id=area_id
     )
     
-    # Add tags
-    tag_ids = request.form.getlist('tags')
-    for tag_id in tag_ids:
-        tag = Tag.query.get(int(tag_id))
-        if tag:
-            new_expiration.tags.append(tag)
-    
     db.session.add(new_expiration)
+    db.session.flush()  # Get expiration ID
+    
+    # Add tags straight into the association table (unknown ids are skipped)
+    tag_ids = request.form.getlist('tags')
+    insert_links(expiration_tags.c.expiration_id, new_expiration.id,
+                 expiration_tags.c.tag_id, Tag.id, [int(tid) for tid in tag_ids])
     db.session.commit()
     
     # Log activity
@@ -4683,11 +4860,9 @@ def edit_expiration(expiration_id):
     
     # Update tags
     tag_ids = request.form.getlist('tags')
-    expiration.tags = []
-    for tag_id in tag_ids:
-        tag = Tag.query.get(int(tag_id))
-        if tag:
-            expiration.tags.append(tag)
+    expiration.tags = Tag.query.filter(
+        Tag.id.in_([int(tid) for tid in tag_ids])
+    ).all() if tag_ids else []
     
     db.session.commit()
     
@@ -4709,15 +4884,17 @@ def edit_expiration(expiration_id):
 @login_required
 def toggle_expiration(expiration_id):
     """Marcar vencimiento como completado/pendiente"""
-    expiration = Expiration.query.get_or_404(expiration_id)
-    
-    if expiration.completed:
-        expiration.completed = False
-        expiration.completed_at = None
-    else:
-        expiration.completed = True
-        expiration.completed_at = now_utc()
-    
+    # One UPDATE ... RETURNING flips the flag (SET sees the old value) and
+    # hands back what the activity log needs
+    was_completed = Expiration.completed == True
+    expiration = db.session.execute(
+        db.update(Expiration).where(Expiration.id == expiration_id).values(
+            completed=db.case((was_completed, False), else_=True),
+            completed_at=db.case((was_completed, None), else_=now_utc())
+        ).returning(Expiration.completed, Expiration.title, Expiration.area_id)
+    ).one_or_none()
+    if expiration is None:
+        abort(404)
     db.session.commit()
     
     # Log activity
@@ -4728,13 +4905,13 @@ def toggle_expiration(expiration_id):
         action=action,
         description=description,
         target_type='expiration',
-        target_id=expiration.id,
+        target_id=expiration_id,
         area_id=expiration.area_id
     )
     
     return jsonify({
         'success': True,
-        'expiration_id': expiration.id,
+        'expiration_id': expiration_id,
         'completed': expiration.completed
     })
 
@@ -4743,15 +4920,21 @@ def toggle_expiration(expiration_id):
 @login_required
 def delete_expiration(expiration_id):
     """Eliminar un vencimiento"""
-    expiration = Expiration.query.get_or_404(expiration_id)
-    
-    # Only creator or admin can delete
-    if expiration.creator_id != current_user.id and not current_user.is_admin:
+    # Only creator or admin can delete: checked in the DELETE itself. The tag
+    # links are removed in the same transaction
+    delete_query = Expiration.query.filter_by(id=expiration_id)
+    if not current_user.is_admin:
+        delete_query = delete_query.filter(Expiration.creator_id == current_user.id)
+    deleted = delete_query.delete(synchronize_session=False)
+    if deleted:
+        delete_links(expiration_id, expiration_tags.c.expiration_id)
+        db.session.commit()
+    else:
+        db.session.rollback()
+        if db.session.get(Expiration, expiration_id) is None:
+            abort(404)
         return jsonify({'success': False, 'error': 'No tienes permiso para eliminar este vencimiento.'}), 403
     
-    db.session.delete(expiration)
-    db.session.commit()
-    
     return jsonify({'success': True})
 
 
@@ -4761,7 +4944,7 @@ def api_get_expiration(expiration_id):
     """API para obtener datos de un vencimiento para edición"""
     expiration = Expiration.query.get_or_404(expiration_id)
     
-    return jsonify({
+    return conditional_json({
         'id': expiration.id,
         'title': expiration.title,
         'description': expiration.description or '',
@@ -4790,12 +4973,12 @@ def manage_recurring_tasks():
         templates = TaskTemplate.query.order_by(TaskTemplate.name).all()
     else:
         # Supervisor/usuario_plus: only see recurring tasks from their area
-        user_area_ids = [a.id for a in current_user.areas]
+        user_area_ids = get_user_area_ids()
         if user_area_ids:
             # Strict filter - only from user's areas
             recurring_tasks = RecurringTask.query.filter(RecurringTask.area_id.in_(user_area_ids)).order_by(RecurringTask.created_at.desc()).all()
             # Only show users from their areas
-            users = [u for u in User.query.order_by(User.full_name).all() if any(area in u.areas for area in current_user.areas)]
+            users = users_in_areas(get_user_area_ids()).order_by(User.full_name).all()
             available_tags = Tag.query.filter(Tag.area_id.in_(user_area_ids)).order_by(Tag.name).all()
             templates = TaskTemplate.query.filter(TaskTemplate.area_id.in_(user_area_ids)).order_by(TaskTemplate.name).all()
         else:
@@ -4927,19 +5110,15 @@ def create_recurring_task():
         template_id=template_id  # NEW: Link to template
     )
     
-    # Add assignees
-    for uid in assignee_ids:
-        user = User.query.get(int(uid))
-        if user:
-            new_recurring.assignees.append(user)
-    
-    # Add tags
-    for tid in tag_ids:
-        tag = Tag.query.get(int(tid))
-        if tag:
-            new_recurring.tags.append(tag)
-    
     db.session.add(new_recurring)
+    db.session.flush()  # Get recurring task ID
+    
+    # Add assignees and tags straight into the association tables (unknown
+    # ids are skipped)
+    insert_links(recurring_task_assignments.c.recurring_task_id, new_recurring.id,
+                 recurring_task_assignments.c.user_id, User.id, [int(uid) for uid in assignee_ids])
+    insert_links(recurring_task_tags.c.recurring_task_id, new_recurring.id,
+                 recurring_task_tags.c.tag_id, Tag.id, [int(tid) for tid in tag_ids])
     db.session.commit()
     
     # Log activity
@@ -4969,7 +5148,7 @@ def edit_recurring_task(rt_id):
     
     # Non-admins can only edit recurring tasks from their area
     if not current_user.can_see_all_areas():
-        user_area_ids = [a.id for a in current_user.areas]
+        user_area_ids = get_user_area_ids()
         if rt.area_id not in user_area_ids and rt.area_id is not None:
             flash('No tienes permiso para editar esta tarea recurrente.', 'danger')
             return redirect(url_for('main.manage_recurring_tasks'))
@@ -5020,19 +5199,15 @@ def edit_recurring_task(rt_id):
         
         # Update assignees
         assignee_ids = request.form.getlist('assignees')
-        rt.assignees = []
-        for uid in assignee_ids:
-            user = User.query.get(int(uid))
-            if user:
-                rt.assignees.append(user)
+        rt.assignees = User.query.filter(
+            User.id.in_([int(uid) for uid in assignee_ids])
+        ).all() if assignee_ids else []
         
         # Update tags
         tag_ids = request.form.getlist('tags')
-        rt.tags = []
-        for tid in tag_ids:
-            tag = Tag.query.get(int(tid))
-            if tag:
-                rt.tags.append(tag)
+        rt.tags = Tag.query.filter(
+            Tag.id.in_([int(tid) for tid in tag_ids])
+        ).all() if tag_ids else []
         
         db.session.commit()
         
@@ -5063,15 +5238,23 @@ def toggle_recurring_task(rt_id):
     if not current_user.can_create_tasks():
         return jsonify({'success': False, 'error': 'No autorizado'}), 403
     
-    rt = RecurringTask.query.get_or_404(rt_id)
-    
-    # Non-admins can only toggle recurring tasks from their area
+    # One UPDATE ... RETURNING; non-admins can only toggle recurring tasks
+    # from their area (or without area), checked in the WHERE
+    toggle = db.update(RecurringTask).where(RecurringTask.id == rt_id).values(
+        is_active=db.case((RecurringTask.is_active == True, False), else_=True)
+    )
     if not current_user.can_see_all_areas():
-        user_area_ids = [a.id for a in current_user.areas]
-        if rt.area_id not in user_area_ids and rt.area_id is not None:
-            return jsonify({'success': False, 'error': 'No autorizado para esta tarea'}), 403
-    
-    rt.is_active = not rt.is_active
+        toggle = toggle.where(db.or_(
+            RecurringTask.area_id.in_(get_user_area_ids()),
+            RecurringTask.area_id.is_(None)
+        ))
+    rt = db.session.execute(
+        toggle.returning(RecurringTask.id, RecurringTask.is_active, RecurringTask.title, RecurringTask.area_id)
+    ).one_or_none()
+    if rt is None:
+        if db.session.get(RecurringTask, rt_id) is None:
+            abort(404)
+        return jsonify({'success': False, 'error': 'No autorizado para esta tarea'}), 403
     db.session.commit()
     
     # Log activity
@@ -5101,10 +5284,23 @@ def delete_recurring_task(rt_id):
     if not current_user.is_admin:
         return jsonify({'success': False, 'error': 'No autorizado'}), 403
     
-    rt = RecurringTask.query.get_or_404(rt_id)
-    title = rt.title
-    db.session.delete(rt)
+    # Generated tasks keep existing without their origin (task.recurring_task_id
+    # has no ON DELETE): one UPDATE instead of loading them through the ORM.
+    # Assignee/tag links are deleted explicitly (no FK cascade on SQLite).
+    Task.query.filter_by(recurring_task_id=rt_id).update(
+        {Task.recurring_task_id: None}, synchronize_session=False
+    )
+    rt = db.session.execute(
+        db.delete(RecurringTask).where(RecurringTask.id == rt_id)
+        .returning(RecurringTask.title, RecurringTask.area_id)
+    ).one_or_none()
+    if rt is None:
+        db.session.rollback()
+        abort(404)
+    delete_links(rt_id, recurring_task_assignments.c.recurring_task_id,
+                 recurring_task_tags.c.recurring_task_id)
     db.session.commit()
+    title = rt.title
     
     # Log activity
     log_activity(
@@ -5126,7 +5322,6 @@ def generate_recurring_tasks_now():
     if not current_user.is_admin:
         return jsonify({'success': False, 'error': 'No autorizado'}), 403
     
-    from flask import current_app
     from scheduler import generate_daily_tasks
     
     try:
@@ -5145,7 +5340,7 @@ def api_get_recurring_task(rt_id):
     
     rt = RecurringTask.query.get_or_404(rt_id)
     
-    return jsonify({
+    return conditional_json({
         'id': rt.id,
         'title': rt.title,
         'description': rt.description or '',
@@ -5170,8 +5365,6 @@ def api_get_recurring_task(rt_id):
 @login_required
 def activity_log():
     """Registro de actividades - solo admin y supervisores"""
-    from models import Area
-    
     # Only admins and supervisors can access
     if current_user.role not in ['admin', 'supervisor', 'gerente']:
         flash('No tienes permiso para acceder al registro de actividades.', 'danger')
@@ -5198,7 +5391,7 @@ def activity_log():
         show_area_filter = True
     else:
         # Supervisor only sees their area(s)
-        user_area_ids = [a.id for a in current_user.areas]
+        user_area_ids = get_user_area_ids()
         if user_area_ids:
             query = query.filter(ActivityLog.area_id.in_(user_area_ids))
             if filter_area and int(filter_area) in user_area_ids:
@@ -5270,15 +5463,13 @@ def activity_log():
 @login_required
 def manage_process_types():
     """View and create process types - Admin/Supervisor only"""
-    from models import Area
-    
     # Only admin and supervisors can manage process types
     if not current_user.is_admin and current_user.role != 'supervisor':
         flash('No tienes permiso para gestionar tipos de proceso.', 'danger')
         return redirect(url_for('main.dashboard'))
     
     # Get user's areas for filtering
-    user_area_ids = [a.id for a in current_user.areas]
+    user_area_ids = get_user_area_ids()
     
     if request.method == 'POST':
         name = request.form.get('name', '').strip()
@@ -5362,12 +5553,10 @@ def manage_process_types():
 @login_required
 def edit_process_type(pt_id):
     """Edit a process type"""
-    from models import Area
-    
     process_type = ProcessType.query.get_or_404(pt_id)
     
     # Check permissions
-    user_area_ids = [a.id for a in current_user.areas]
+    user_area_ids = get_user_area_ids()
     if not current_user.is_admin and process_type.area_id not in user_area_ids:
         flash('No tienes permiso para editar este tipo de proceso.', 'danger')
         return redirect(url_for('main.manage_process_types'))
@@ -5432,7 +5621,7 @@ def toggle_process_type(pt_id):
     process_type = ProcessType.query.get_or_404(pt_id)
     
     # Check permissions
-    user_area_ids = [a.id for a in current_user.areas]
+    user_area_ids = get_user_area_ids()
     if not current_user.is_admin and process_type.area_id not in user_area_ids:
         return jsonify({'success': False, 'error': 'No tienes permiso'}), 403
     
@@ -5474,7 +5663,7 @@ def delete_process_type(pt_id):
     process_type = ProcessType.query.get_or_404(pt_id)
     
     # Check permissions
-    user_area_ids = [a.id for a in current_user.areas]
+    user_area_ids = get_user_area_ids()
     if not current_user.is_admin and process_type.area_id not in user_area_ids:
         return jsonify({'success': False, 'error': 'No tienes permiso'}), 403
     
@@ -5510,14 +5699,12 @@ def delete_process_type(pt_id):
 @login_required
 def list_processes():
     """List all processes"""
-    from models import Area
-    
     # Get filter parameters
     filter_type = request.args.get('type')
     filter_status = request.args.get('status', 'Active')
     filter_area = request.args.get('area')
     
-    user_area_ids = [a.id for a in current_user.areas]
+    user_area_ids = get_user_area_ids()
     
     # Base query
     query = Process.query.options(
@@ -5582,14 +5769,12 @@ def list_processes():
 @login_required
 def create_process():
     """Create a new process"""
-    from models import Area
-    
     # Only supervisor+ can create processes
     if not current_user.can_create_tasks():
         flash('No tienes permiso para crear procesos.', 'danger')
         return redirect(url_for('main.list_processes'))
     
-    user_area_ids = [a.id for a in current_user.areas]
+    user_area_ids = get_user_area_ids()
     
     if request.method == 'POST':
         process_type_id = request.form.get('process_type_id')
@@ -5641,8 +5826,8 @@ def create_process():
             
             # Get assignees from form
             assignee_ids = request.form.getlist('assignees')
-            assignees = [User.query.get(int(uid)) for uid in assignee_ids if uid]
-            assignees = [a for a in assignees if a]
+            assignee_ids = [int(uid) for uid in assignee_ids if uid]
+            assignees = User.query.filter(User.id.in_(assignee_ids)).all() if assignee_ids else []
             
             # Create main task from template
             main_task = Task(
@@ -5699,7 +5884,7 @@ def create_process():
             ProcessType.area_id.in_(user_area_ids),
             ProcessType.is_active == True
         ).order_by(ProcessType.name).all()
-        users = [u for u in User.query.all() if any(area in u.areas for area in current_user.areas)]
+        users = users_in_areas(get_user_area_ids()).all()
     
     # Default due date: 7 days from now
     default_due_date = (datetime.now() + timedelta(days=7)).strftime('%Y-%m-%d')
@@ -5714,8 +5899,6 @@ def create_process():
 @login_required
 def process_details(process_id):
     """View process details"""
-    from models import Area
-    
     process = Process.query.options(
         joinedload(Process.process_type),
         joinedload(Process.area),
@@ -5724,7 +5907,7 @@ def process_details(process_id):
     ).get_or_404(process_id)
     
     # Check permission - allow current area OR involved areas (read-only)
-    user_area_ids = [a.id for a in current_user.areas]
+    user_area_ids = get_user_area_ids()
     involved_area_ids = [a.id for a in process.involved_areas]
     can_view = (current_user.is_admin or 
                 process.area_id in user_area_ids or 
@@ -5765,7 +5948,7 @@ def cancel_process(process_id):
     process = Process.query.get_or_404(process_id)
     
     # Check permission
-    user_area_ids = [a.id for a in current_user.areas]
+    user_area_ids = get_user_area_ids()
     if not current_user.is_admin and process.area_id not in user_area_ids:
         return jsonify({'success': False, 'error': 'No tienes permiso'}), 403
     
@@ -5796,7 +5979,7 @@ def complete_process(process_id):
     process = Process.query.get_or_404(process_id)
     
     # Check permission - only current area can complete
-    user_area_ids = [a.id for a in current_user.areas]
+    user_area_ids = get_user_area_ids()
     if not current_user.is_admin and process.area_id not in user_area_ids:
         return jsonify({'success': False, 'error': 'No tienes permiso'}), 403
     
@@ -5849,7 +6032,7 @@ def complete_process(process_id):
 @login_required
 def transfer_process(process_id):
     """Transfer a process to another area, keeping visibility for involved areas."""
-    from models import Process, Area, ProcessTransfer
+    from models import ProcessTransfer
     
     # Only admin and supervisor can transfer
     if not current_user.is_admin and current_user.role != 'supervisor':
@@ -5859,7 +6042,7 @@ def transfer_process(process_id):
     
     # Check if user has access to current area
     if not current_user.is_admin:
-        user_area_ids = [a.id for a in current_user.areas]
+        user_area_ids = get_user_area_ids()
         if process.area_id not in user_area_ids:
             return jsonify({'success': False, 'error': 'Solo puedes transferir procesos de tu área'}), 403
     
@@ -6029,7 +6212,6 @@ def download_import_template():
     wb.save(output)
     output.seek(0)
     
-    from flask import send_file
     return send_file(
         output,
         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
@@ -6093,7 +6275,7 @@ def upload_attachment(task_id):
     print(f"DEBUG: Tarea encontrada: {task.title}")
     
     # Check if user has access to this task
-    if not current_user.is_admin and current_user not in task.assignees and task.creator_id != current_user.id:
+    if not current_user.is_admin and task.creator_id != current_user.id and not is_task_assignee(task):
         print(f"DEBUG: Usuario sin permiso: {current_user.username}")
         flash('No tienes permiso para adjuntar archivos a esta tarea.', 'danger')
         return redirect(url_for('main.task_details', task_id=task_id))
@@ -6181,7 +6363,7 @@ def download_attachment(attachment_id):
     task = attachment.task
     
     # Check if user has access to this task
-    if not current_user.is_admin and current_user not in task.assignees and task.creator_id != current_user.id:
+    if not current_user.is_admin and task.creator_id != current_user.id and not is_task_assignee(task):
         flash('No tienes permiso para descargar este archivo.', 'danger')
         return redirect(url_for('main.dashboard'))
     
@@ -6246,7 +6428,7 @@ def view_attachment(attachment_id):
     task = attachment.task
     
     # Check if user has access to this task
-    if not current_user.is_admin and current_user not in task.assignees and task.creator_id != current_user.id:
+    if not current_user.is_admin and task.creator_id != current_user.id and not is_task_assignee(task):
         flash('No tienes permiso para ver este archivo.', 'danger')
         return redirect(url_for('main.dashboard'))
     
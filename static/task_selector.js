@@ -27,8 +27,9 @@ function searchTasks() {
     const query = document.getElementById('taskSearchInput').value.trim();
     const resultsContainer = document.getElementById('taskSearchResults');
 
-    if (query.length < 2) {
-        resultsContainer.innerHTML = '<p style="text-align: center; color: #64748b; padding: 2rem;">Escribe al menos 2 caracteres para buscar...</p>';
+    // Numbers search by task id; text needs 3+ characters (same rule as the API)
+    if (query.length < 3 && !/^\d+$/.test(query)) {
+        resultsContainer.innerHTML = '<p style="text-align: center; color: #64748b; padding: 2rem;">Escribe al menos 3 caracteres o el número de tarea...</p>';
         return;
     }
 
@@ -0,0 +1,92 @@
+import unittest
+from datetime import datetime, timedelta, date, time
+from app import create_app, db
+from models import (User, Task, Tag, Expiration, RecurringTask, task_tags, expiration_tags,
+                    recurring_task_assignments, recurring_task_tags)
+
+
+class TestDeleteLinks(unittest.TestCase):
+    """Bulk deletes must not leave association rows behind on SQLite."""
+
+    def setUp(self):
+        self.app = create_app(test_config={
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:'
+        })
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+            user = User(username='admin', email='admin@example.com', full_name='Admin', is_admin=True)
+            user.set_password('password')
+            db.session.add(user)
+            db.session.commit()
+            self.user_id = user.id
+
+            tag = Tag(name='T1', color='#000', created_by_id=user.id)
+            task = Task(title='Task', due_date=datetime.now() + timedelta(days=1), creator_id=user.id)
+            task.tags.append(tag)
+            db.session.add(task)
+
+            expiration = Expiration(title='Exp', due_date=datetime.now(), creator_id=user.id)
+            expiration.tags.append(tag)
+            recurring = RecurringTask(
+                title='Rec', recurrence_type='weekdays', due_time=time(14, 0),
+                start_date=date.today(), creator_id=user.id
+            )
+            recurring.assignees.append(user)
+            recurring.tags.append(tag)
+            db.session.add_all([expiration, recurring])
+            db.session.commit()
+            self.tag_id = tag.id
+            self.expiration_id = expiration.id
+            self.recurring_id = recurring.id
+
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.user_id)
+            sess['_fresh'] = True
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def link_count(self, table):
+        with self.app.app_context():
+            return db.session.execute(db.select(db.func.count()).select_from(table)).scalar()
+
+    def test_delete_tag_removes_links(self):
+        response = self.client.delete(f'/api/tags/{self.tag_id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.link_count(task_tags), 0)
+        self.assertEqual(self.link_count(expiration_tags), 0)
+        self.assertEqual(self.link_count(recurring_task_tags), 0)
+
+        # A new tag reusing the id must not show up on the old task
+        with self.app.app_context():
+            tag = Tag(name='T2', color='#000', created_by_id=self.user_id)
+            db.session.add(tag)
+            db.session.commit()
+            self.assertEqual(db.session.scalars(db.select(Task)).one().tags, [])
+
+    def test_delete_missing_tag(self):
+        response = self.client.delete('/api/tags/999')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.link_count(task_tags), 1)
+
+    def test_delete_expiration_removes_links(self):
+        response = self.client.post(f'/expirations/{self.expiration_id}/delete')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.link_count(expiration_tags), 0)
+        self.assertEqual(self.link_count(task_tags), 1)
+
+    def test_delete_recurring_task_removes_links(self):
+        response = self.client.post(f'/recurring-tasks/{self.recurring_id}/delete')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.link_count(recurring_task_assignments), 0)
+        self.assertEqual(self.link_count(recurring_task_tags), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,7 +8,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from app import create_app
 from extensions import db
-from models import User, Task
+from models import User, Task, task_assignments
 
 class NotificationsTestCase(unittest.TestCase):
     def setUp(self):
@@ -80,6 +80,82 @@ class NotificationsTestCase(unittest.TestCase):
         self.assertIn('InReview Task', titles)
         self.assertNotIn('Completed Task', titles)
         self.assertNotIn('Anulado Task', titles)
+    def test_api_tasks_due_soon_etag(self):
+        self.login()
+        first = self.client.get('/api/tasks/due_soon')
+        etag = first.headers['ETag']
+        self.assertIsNotNone(etag)
+
+        # Nothing changed: the repeat poll gets an empty 304
+        repeat = self.client.get('/api/tasks/due_soon', headers={'If-None-Match': etag})
+        self.assertEqual(repeat.status_code, 304)
+        self.assertEqual(repeat.data, b'')
+
+        # A newly assigned task changes the ETag
+        with self.app.app_context():
+            user = db.session.get(User, self.user_id)
+            task = Task(title='New Task', due_date=datetime.now() + timedelta(days=1),
+                        creator_id=user.id, status='Pending', enabled=True)
+            task.assignees.append(user)
+            db.session.add(task)
+            db.session.commit()
+            self.assertIsNotNone(task.updated_at)
+            new_task_id = task.id
+        assigned = self.client.get('/api/tasks/due_soon', headers={'If-None-Match': etag})
+        self.assertEqual(assigned.status_code, 200)
+        self.assertIn('New Task', [t['title'] for t in assigned.get_json()['tasks']])
+        etag = assigned.headers['ETag']
+
+        # Same rows, edited title: only MAX(updated_at) moves
+        with self.app.app_context():
+            task = db.session.get(Task, new_task_id)
+            task.title = 'Renamed Task'
+            db.session.commit()
+        edited = self.client.get('/api/tasks/due_soon', headers={'If-None-Match': etag})
+        self.assertEqual(edited.status_code, 200)
+        self.assertIn('Renamed Task', [t['title'] for t in edited.get_json()['tasks']])
+        etag = edited.headers['ETag']
+
+        # Completing it changes the ETag again
+        with self.app.app_context():
+            task = db.session.get(Task, new_task_id)
+            task.status = 'Completed'
+            db.session.commit()
+        completed = self.client.get('/api/tasks/due_soon', headers={'If-None-Match': etag})
+        self.assertEqual(completed.status_code, 200)
+        self.assertNotIn('Renamed Task', [t['title'] for t in completed.get_json()['tasks']])
+    def test_api_tasks_due_soon_etag_assignment_swap(self):
+        # (Un)assigning only rewrites task_assignments: the task rows, their
+        # count and MAX(updated_at) stay the same, the ETag must not
+        self.login()
+        with self.app.app_context():
+            user = db.session.get(User, self.user_id)
+            other = Task(title='Other Task', due_date=datetime.now() + timedelta(days=1),
+                         creator_id=user.id, status='Pending', enabled=True)
+            db.session.add(other)
+            db.session.commit()
+            newest = Task(title='Newest Task', due_date=datetime.now() + timedelta(days=1),
+                          creator_id=user.id, status='Pending', enabled=True)
+            newest.assignees.append(user)
+            db.session.add(newest)
+            db.session.commit()
+            other_id = other.id
+            old_id = db.session.scalars(db.select(Task.id).filter_by(title='Pending Task')).one()
+
+        etag = self.client.get('/api/tasks/due_soon').headers['ETag']
+
+        with self.app.app_context():
+            db.session.execute(db.delete(task_assignments).where(
+                task_assignments.c.user_id == self.user_id, task_assignments.c.task_id == old_id
+            ))
+            db.session.execute(task_assignments.insert().values(user_id=self.user_id, task_id=other_id))
+            db.session.commit()
+
+        swapped = self.client.get('/api/tasks/due_soon', headers={'If-None-Match': etag})
+        self.assertEqual(swapped.status_code, 200)
+        titles = [t['title'] for t in swapped.get_json()['tasks']]
+        self.assertIn('Other Task', titles)
+        self.assertNotIn('Pending Task', titles)
 
 if __name__ == '__main__':
     unittest.main()
@@ -76,5 +76,44 @@ class TestPDFExportCalc(unittest.TestCase):
         self.assertEqual(response.headers['Content-Type'], 'application/pdf')
         # We can't easily parse PDF content here, but if status is 200, it generated successfully without crashing.
 
+    def test_export_pdf_async(self):
+        import time
+        response = self.client.post('/reports/export', data={
+            'start_date': date.today().strftime('%Y-%m-%d'),
+            'end_date': date.today().strftime('%Y-%m-%d'),
+            'include_kpis': 'true',
+            'async': 'true'
+        })
+        self.assertEqual(response.status_code, 202)
+        status_url = response.get_json()['status_url']
+
+        # Poll until the background job finishes
+        for _ in range(100):
+            poll = self.client.get(status_url + '?poll=1')
+            if poll.status_code != 202:
+                break
+            time.sleep(0.1)
+        self.assertEqual(poll.get_json()['status'], 'done')
+
+        result = self.client.get(status_url)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.headers['Content-Type'], 'application/pdf')
+        self.assertTrue(result.data.startswith(b'%PDF'))
+
+    def test_export_pdf_async_stale_job(self):
+        import os, time, uuid
+        import report_jobs
+        # Pending job whose worker is gone (e.g. restarted): reported as failed
+        job_id = uuid.uuid4().hex
+        os.makedirs(report_jobs.REPORT_JOBS_DIR, exist_ok=True)
+        report_jobs._write_meta(job_id, {
+            'status': 'pending', 'user_id': self.user_id,
+            'submitted_at': time.time() - report_jobs.REPORT_JOB_TIMEOUT - 1
+        })
+
+        poll = self.client.get(f'/reports/export/{job_id}?poll=1')
+        self.assertEqual(poll.status_code, 500)
+        self.assertEqual(poll.get_json()['status'], 'error')
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,14 +1,16 @@
 """
 Utility functions for the task management application.
 """
-from datetime import date, timedelta
+from datetime import date
 
-def calculate_business_days_until(target_date):
+def calculate_business_days_until(target_date, today=None):
     """
     Calculate the number of business days (Monday-Friday) from today until target_date.
     
     Args:
         target_date: datetime.date or datetime.datetime object
+        today: reference date (defaults to date.today()); pass it when
+            calling in a loop
         
     Returns:
         int: Number of business days until target_date.
@@ -18,30 +20,23 @@ def calculate_business_days_until(target_date):
     if hasattr(target_date, 'date'):
         target_date = target_date.date()
     
-    today = date.today()
+    if today is None:
+        today = date.today()
     
-    # If target is today, return 0
-    if target_date == today:
-        return 0
-    
-    # If target is in the future, count business days until target
-    if target_date > today:
-        business_days = 0
-        current_date = today
-        while current_date < target_date:
-            current_date += timedelta(days=1)
-            if current_date.weekday() < 5:  # Monday to Friday
-                business_days += 1
-        return business_days
-    
-    # If target is in the past, count business days since target (negative)
-    business_days = 0
-    current_date = target_date
-    while current_date < today:
-        current_date += timedelta(days=1)
-        if current_date.weekday() < 5:  # Monday to Friday
-            business_days += 1
-    return -business_days  # Return negative to indicate overdue
+    # Future: business days in (today, target]; past: negative count in (target, today]
+    if target_date >= today:
+        return _count_business_days_after(today, target_date)
+    return -_count_business_days_after(target_date, today)  # Negative = overdue
+
+def _count_business_days_after(start, end):
+    """
+    Number of business days (Monday-Friday) in (start, end], start <= end.
+    Whole weeks contribute 5 each, so only the 0-6 leftover days are checked.
+    """
+    full_weeks, extra_days = divmod((end - start).days, 7)
+    start_weekday = start.weekday()
+    extra = sum(1 for i in range(1, extra_days + 1) if (start_weekday + i) % 7 < 5)
+    return full_weeks * 5 + extra
 
 def is_business_day(check_date):
     """